@@ -0,0 +1,525 @@
+"""
+Local stand-ins for the Last.fm, Spotify Web API, OpenAI and Gemini endpoints the tool uses.
+
+Each server answers from a SyntheticWorld, or from a recording of a real run, with
+injected latency, jitter, 429s and errors. Point the tool at them with
+LASTFM_API_URL, SPOTIFY_API_URL, OPENAI_BASE_URL and GEMINI_API_URL.
+
+Recording: start_recorder() runs a pass-through proxy in front of a real API and
+appends every exchange to a JSONL file, with session keys, tokens and profile details
+redacted; start_replay() serves such a file back.
+"""
+import json
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from abc import ABC, abstractmethod
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+from xml.sax.saxutils import escape, quoteattr
+
+from fixtures import spotify_id
+
+# Query parameters that differ between runs without changing the answer
+VOLATILE_PARAMS = {"api_sig", "sk", "api_key", "password", "username", "user", "authToken", "key"}
+
+# Secrets and personal details blanked out of recorded response bodies: the Last.fm session key,
+# OAuth tokens, and the Spotify profile fields the tool doesn't use
+REDACTED_PATTERNS = [
+    (re.compile(r"<key>[^<]*</key>"), "<key>REDACTED</key>"),
+    (re.compile(r'"(access_token|refresh_token|id_token|session_key|email|birthdate|display_name|country)"(\s*:\s*)"(?:[^"\\]|\\.)*"'),
+     r'"\1"\2"REDACTED"'),
+]
+
+UPSTREAMS = {
+    "lastfm": "https://ws.audioscrobbler.com",
+    "spotify": "https://api.spotify.com",
+    "openai": "https://api.openai.com",
+    "gemini": "https://generativelanguage.googleapis.com",
+}
+
+
+class Faults:
+    """Latency, jitter, 429 and error injection applied to every request."""
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_429=0.0, error_rate=0.0, retry_after=1, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def draw(self):
+        """Sleep for the injected latency and return None, "429" or "error"."""
+        with self.lock:
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            roll = self.random.random()
+        if delay:
+            time.sleep(delay)
+        if roll < self.rate_429:
+            return "429"
+        if roll < self.rate_429 + self.error_rate:
+            return "error"
+        return None
+
+
+class BenchmarkServer(ThreadingHTTPServer):
+    """Threaded HTTP server that counts requests per endpoint and holds the handler's state."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handler_class, world=None, faults=None, host="127.0.0.1", port=0, **state):
+        super().__init__((host, port), handler_class)
+        self.world = world
+        self.faults = faults or Faults()
+        self.counts = Counter()
+        self.latencies = defaultdict(float)
+        self.lock = threading.Lock()
+        self.__dict__.update(state)
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def record(self, endpoint, seconds):
+        with self.lock:
+            self.counts[endpoint] += 1
+            self.latencies[endpoint] += seconds
+
+    def reset_counters(self):
+        with self.lock:
+            self.counts.clear()
+            self.latencies.clear()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class BaseHandler(BaseHTTPRequestHandler, ABC):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PUT(self):
+        self.handle_request("PUT")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+    def handle_request(self, method):
+        started = time.perf_counter()
+        parts = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        query = self.request_params(parts.query, body)
+        endpoint = self.endpoint(method, parts.path, query)
+        try:
+            fault = self.server.faults.draw()
+            if fault:
+                self.send_fault(fault)
+            else:
+                self.route(method, parts.path, query, body)
+        finally:
+            self.server.record(endpoint, time.perf_counter() - started)
+
+    def request_params(self, query_string, body):
+        return dict(parse_qsl(query_string, keep_blank_values=True))
+
+    def endpoint(self, method, path, query):
+        return f"{method} {path}"
+
+    @abstractmethod
+    def route(self, method, path, query, body):
+        """Answer one request that drew no injected fault."""
+
+    def send_fault(self, fault):
+        if fault == "429":
+            self.send_body(429, b'{"error": {"status": 429, "message": "API rate limit exceeded"}}',
+                           headers={"Retry-After": str(self.server.faults.retry_after)})
+        else:
+            self.send_body(503, b'{"error": {"status": 503, "message": "Service unavailable"}}')
+
+    def send_body(self, status, body, content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, obj, status=200):
+        self.send_body(status, json.dumps(obj).encode())
+
+    def send_stream(self, chunks, content_type="text/event-stream", delay=0.0):
+        """Send chunks with chunked transfer encoding, as streaming APIs do."""
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in chunks:
+            data = chunk.encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+            if delay:
+                time.sleep(delay)
+        self.wfile.write(b"0\r\n\r\n")
+
+
+# --- Last.fm ---
+
+class LastfmHandler(BaseHandler):
+    """Last.fm 2.0 API in the XML format pylast parses."""
+
+    def request_params(self, query_string, body):
+        # pylast sends its parameters in the query string; accept a form body as well
+        params = dict(parse_qsl(body.decode("utf-8", errors="replace"))) if body else {}
+        params.update(parse_qsl(query_string, keep_blank_values=True))
+        return params
+
+    def endpoint(self, method, path, query):
+        return query.get("method", "unknown")
+
+    def send_fault(self, fault):
+        # Last.fm reports rate limiting as error 29 and outages as 16, both inside a 200 response
+        code, message = ("29", "Rate limit exceeded") if fault == "429" else ("16", "Temporary error, try again")
+        self.send_xml(f'<lfm status="failed"><error code="{code}">{message}</error></lfm>')
+
+    def send_xml(self, xml):
+        self.send_body(200, f'<?xml version="1.0" encoding="UTF-8"?>\n{xml}'.encode(), "text/xml; charset=utf-8")
+
+    def ok(self, inner):
+        self.send_xml(f'<lfm status="ok">{inner}</lfm>')
+
+    def route(self, method, path, query, body):
+        world = self.server.world
+        api_method = query.get("method", "")
+        artist = query.get("artist", "")
+        page = int(query.get("page") or 1)
+        per_page = int(query.get("limit") or 50)
+
+        if api_method == "auth.getMobileSession":
+            self.ok(f"<session><name>{escape(query.get('username', 'bench'))}</name><key>benchsessionkey</key>"
+                    f"<subscriber>0</subscriber></session>")
+        elif api_method == "user.getLovedTracks":
+            tracks, total_pages = world.loved_page(page, per_page)
+            items = "".join(
+                f"<track><name>{escape(title)}</name><mbid></mbid><url></url>"
+                f'<date uts="{loved_at}">{datetime.fromtimestamp(loved_at, timezone.utc):%d %b %Y, %H:%M}</date>'
+                f"<artist><name>{escape(artist_name)}</name><mbid></mbid><url></url></artist></track>"
+                for title, artist_name, loved_at in tracks)
+            self.ok(f'<lovedtracks user="bench" page="{page}" perPage="{per_page}" totalPages="{total_pages}" '
+                    f'total="{world.loved_count}">{items}</lovedtracks>')
+        elif api_method == "user.getRecentTracks":
+            since = int(query.get("from") or 0)
+            recent = [world.recent_track(i) for i in range(world.recent_scrobbles)]
+            recent = [track for track in recent if track[2] >= since]
+            start = (page - 1) * per_page
+            total_pages = max(1, -(-len(recent) // per_page)) if recent else 0
+            items = "".join(
+                f"<track><artist>{escape(artist_name)}</artist><name>{escape(title)}</name><album></album>"
+                f'<date uts="{played_at}">{datetime.fromtimestamp(played_at, timezone.utc):%d %b %Y, %H:%M}</date></track>'
+                for title, artist_name, played_at in recent[start:start + per_page])
+            self.ok(f'<recenttracks user="bench" page="{page}" perPage="{per_page}" totalPages="{total_pages}" '
+                    f'total="{len(recent)}">{items}</recenttracks>')
+        elif api_method == "user.getTopArtists":
+            top = world.user_top_artists(per_page)
+            items = "".join(f'<artist rank="{rank}"><name>{escape(name)}</name><playcount>{plays}</playcount>'
+                            f"<mbid></mbid><url></url></artist>" for rank, (name, plays) in enumerate(top, 1))
+            self.ok(f'<topartists user="bench" page="1" perPage="{per_page}" totalPages="1" '
+                    f'total="{len(top)}">{items}</topartists>')
+        elif api_method == "artist.getSimilar":
+            items = "".join(f"<artist><name>{escape(name)}</name><mbid></mbid><match>{match}</match><url></url></artist>"
+                            for name, match in world.similar_artists(artist, per_page if query.get("limit") else 100))
+            self.ok(f"<similarartists artist={quoteattr(artist)}>{items}</similarartists>")
+        elif api_method == "artist.getTopTracks":
+            top = world.top_tracks(artist, per_page)
+            items = "".join(f'<track rank="{rank}"><name>{escape(title)}</name><playcount>{plays}</playcount>'
+                            f"<listeners>{plays // 3}</listeners><artist><name>{escape(artist)}</name></artist></track>"
+                            for rank, (title, plays) in enumerate(top, 1))
+            self.ok(f'<toptracks artist={quoteattr(artist)} page="1" perPage="{per_page}" totalPages="1" '
+                    f'total="{len(top)}">{items}</toptracks>')
+        elif api_method == "artist.getInfo":
+            listeners = world.listeners(artist)
+            self.ok(f"<artist><name>{escape(artist)}</name><stats><listeners>{listeners}</listeners>"
+                    f"<playcount>{listeners * 12}</playcount></stats></artist>")
+        elif api_method == "artist.getTopTags":
+            items = "".join(f"<tag><name>{escape(tag)}</name><count>{count}</count></tag>"
+                            for tag, count in world.top_tags(artist))
+            self.ok(f"<toptags artist={quoteattr(artist)}>{items}</toptags>")
+        else:
+            self.send_xml(f'<lfm status="failed"><error code="3">Invalid Method - {escape(api_method)}</error></lfm>')
+
+
+# --- Spotify ---
+
+class SpotifyHandler(BaseHandler):
+    """The Spotify Web API endpoints the tool calls, with an in-memory playlist store."""
+
+    def endpoint(self, method, path, query):
+        segments = path.rstrip("/").split("/")
+        if len(segments) > 3 and segments[2] in ("playlists", "tracks", "artists", "users"):
+            segments[3] = "{id}"
+        return f"{method} {'/'.join(segments)}"
+
+    def playlist(self, playlist_id):
+        with self.server.lock:
+            if playlist_id not in self.server.playlists:
+                self.server.playlists[playlist_id] = {"name": f"Playlist {playlist_id[:6]}", "snapshot": 1, "items": []}
+            return self.server.playlists[playlist_id]
+
+    def changed(self, playlist):
+        playlist["snapshot"] += 1
+        self.send_json({"snapshot_id": f"snapshot-{playlist['snapshot']}"}, 201)
+
+    def route(self, method, path, query, body):
+        world = self.server.world
+        segments = path.strip("/").split("/")[1:]  # drop the "v1" prefix
+        payload = json.loads(body) if body else None
+
+        if segments == ["me"]:
+            self.send_json({"id": "benchuser", "display_name": "Benchmark User"})
+        elif segments == ["search"]:
+            items = world.search(query.get("q", ""), int(query.get("limit") or 10))
+            for item in items:
+                self.server.catalogue[item["uri"]] = item
+            self.send_json({"tracks": {"items": items, "total": len(items), "limit": int(query.get("limit") or 10),
+                                       "offset": 0, "next": None}})
+        elif segments[:1] == ["tracks"] and len(segments) == 2:
+            track = self.server.catalogue.get(f"spotify:track:{segments[1]}")
+            self.send_json(track or {"error": {"status": 404, "message": "Not found"}}, 200 if track else 404)
+        elif segments[:1] == ["artists"] and len(segments) == 2:
+            self.send_json(world.artist(segments[1]))
+        elif segments[:1] == ["users"] and segments[2:] == ["playlists"] and method == "POST":
+            playlist_id = spotify_id("playlist", len(self.server.playlists), time.time())
+            self.server.playlists[playlist_id] = {"name": (payload or {}).get("name", ""), "snapshot": 1, "items": []}
+            self.send_json({"id": playlist_id, "name": (payload or {}).get("name", "")}, 201)
+        elif segments[:1] == ["playlists"] and len(segments) == 2:
+            playlist = self.playlist(segments[1])
+            self.send_json({"id": segments[1], "name": playlist["name"], "snapshot_id": f"snapshot-{playlist['snapshot']}"})
+        elif segments[:1] == ["playlists"] and segments[2:] in (["tracks"], ["items"]):
+            # Newer spotipy releases use /items, older ones /tracks
+            self.route_playlist_items(method, self.playlist(segments[1]), segments[1], query, payload, segments[2])
+        else:
+            self.send_json({"error": {"status": 404, "message": f"No fake for {method} {path}"}}, 404)
+
+    def route_playlist_items(self, method, playlist, playlist_id, query, payload, resource="tracks"):
+        with self.server.lock:
+            items = playlist["items"]
+            if method == "GET":
+                offset, limit = int(query.get("offset") or 0), int(query.get("limit") or 100)
+                page = [{"added_at": added_at, "track": self.server.catalogue.get(uri, {"uri": uri, "name": "", "artists": [{"name": ""}]})}
+                        for uri, added_at in items[offset:offset + limit]]
+                next_url = None
+                if offset + limit < len(items):
+                    next_url = f"{self.server.url}/v1/playlists/{playlist_id}/{resource}?" + urlencode(
+                        {"offset": offset + limit, "limit": limit})
+                self.send_json({"items": page, "next": next_url, "total": len(items)})
+                return
+
+            now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+            if method == "POST":
+                uris = payload["uris"] if isinstance(payload, dict) else payload
+                position = int(query["position"]) if "position" in query else len(items)
+                items[position:position] = [(uri, now) for uri in uris]
+            elif method == "PUT" and "range_start" in payload:
+                start, length = payload["range_start"], payload.get("range_length", 1)
+                moved = items[start:start + length]
+                del items[start:start + length]
+                insert_before = payload["insert_before"]
+                if insert_before > start:
+                    insert_before -= length
+                items[insert_before:insert_before] = moved
+            elif method == "PUT":
+                playlist["items"] = [(uri, now) for uri in payload.get("uris", [])]
+            elif method == "DELETE":
+                remove_positions = set()
+                for track in payload.get("items", payload.get("tracks", [])):
+                    positions = track.get("positions")
+                    if positions is None:
+                        positions = [i for i, (uri, _) in enumerate(items) if uri == track["uri"]]
+                    remove_positions.update(positions)
+                playlist["items"] = [item for i, item in enumerate(items) if i not in remove_positions]
+            self.changed(playlist)
+
+
+# --- AI ---
+
+class OpenAIHandler(BaseHandler):
+    """Streaming chat completions, sent in small chunks like the real API."""
+
+    def route(self, method, path, query, body):
+        if not path.endswith("/chat/completions"):
+            self.send_json({"error": {"message": f"No fake for {path}"}}, 404)
+            return
+        text = self.server.world.ai_recommendations()
+        pieces = [text[i:i + 24] for i in range(0, len(text), 24)]
+
+        def chunk(delta, finish_reason=None):
+            return "data: " + json.dumps({
+                "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": "gpt-5-mini", "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }) + "\n\n"
+
+        events = [chunk({"role": "assistant", "content": ""})] + [chunk({"content": piece}) for piece in pieces]
+        events += [chunk({}, "stop"), "data: [DONE]\n\n"]
+        self.send_stream(events, delay=self.server.stream_delay)
+
+
+class GeminiHandler(BaseHandler):
+    """streamGenerateContent over REST, as a JSON array or as server-sent events with alt=sse."""
+
+    def route(self, method, path, query, body):
+        if not path.endswith(":streamGenerateContent"):
+            self.send_json({"error": {"message": f"No fake for {path}"}}, 404)
+            return
+        text = self.server.world.ai_recommendations()
+        messages = [json.dumps({"candidates": [{"content": {"role": "model", "parts": [{"text": text[i:i + 48]}]},
+                                                "index": 0}]})
+                    for i in range(0, len(text), 48)]
+        if query.get("alt") == "sse":
+            self.send_stream([f"data: {message}\r\n\r\n" for message in messages], delay=self.server.stream_delay)
+        else:
+            chunks = ["[" + messages[0]] + ["," + message for message in messages[1:]] + ["]"]
+            self.send_stream(chunks, content_type="application/json", delay=self.server.stream_delay)
+
+
+# --- Record and replay ---
+
+def redact(body):
+    """Blank out session keys, tokens and personal profile fields in a response body."""
+    for pattern, replacement in REDACTED_PATTERNS:
+        body = pattern.sub(replacement, body)
+    return body
+
+
+def request_key(method, path, query):
+    """Replay key for a request: method, path and the query without credentials or signatures."""
+    stable = sorted((name, value) for name, value in query.items() if name not in VOLATILE_PARAMS)
+    return f"{method} {path}?{urlencode(stable)}"
+
+
+class RecordingHandler(BaseHandler):
+    """Pass-through proxy to server.upstream that appends each exchange to server.fixture_file."""
+
+    def route(self, method, path, query, body):
+        url = self.server.upstream + self.path
+        headers = {name: value for name, value in self.headers.items()
+                   if name.lower() not in ("host", "content-length", "accept-encoding", "connection")}
+        request = urllib.request.Request(url, data=body or None, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                status, response_headers, response_body = response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            status, response_headers, response_body = e.code, e.headers, e.read()
+        # Absolute URLs in responses (e.g. Spotify's paging "next") must come back through the proxy
+        response_body = response_body.replace(self.server.upstream.encode(), self.server.url.encode())
+
+        entry = {
+            "key": request_key(method, urlsplit(self.path).path, query),
+            "status": status,
+            "content_type": response_headers.get("Content-Type", "application/json"),
+            "retry_after": response_headers.get("Retry-After"),
+            # The tool gets the real body; only the stored copy is redacted
+            "body": redact(response_body.decode("utf-8", errors="replace"))
+        }
+        with self.server.lock:
+            with open(self.server.fixture_file, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+        self.send_body(status, response_body, entry["content_type"],
+                       {"Retry-After": entry["retry_after"]} if entry["retry_after"] else None)
+
+
+class ReplayHandler(BaseHandler):
+    """
+    Serves a recording made by RecordingHandler.
+
+    Requests match on the full replay key, falling back to method and path (e.g. AI
+    prompts that differ between runs). Repeated requests get the recorded answers in
+    order, and the last one once they run out.
+    """
+
+    def route(self, method, path, query, body):
+        key = request_key(method, path, query)
+        with self.server.lock:
+            candidates = self.server.recording.get(key) or self.server.recording.get(f"{method} {path}")
+            if not candidates:
+                self.send_json({"error": {"status": 404, "message": f"Not in recording: {key}"}}, 404)
+                return
+            served = self.server.served[key]
+            entry = candidates[min(served, len(candidates) - 1)]
+            self.server.served[key] += 1
+        self.send_body(entry["status"], entry["body"].encode(), entry["content_type"],
+                       {"Retry-After": entry["retry_after"]} if entry.get("retry_after") else None)
+
+
+def load_recording(fixture_file):
+    recording = defaultdict(list)
+    with open(fixture_file) as f:
+        for line in f:
+            entry = json.loads(line)
+            recording[entry["key"]].append(entry)
+            recording[entry["key"].split("?", 1)[0]].append(entry)
+    return recording
+
+
+# --- Starting servers ---
+
+FAKE_HANDLERS = {
+    "lastfm": LastfmHandler,
+    "spotify": SpotifyHandler,
+    "openai": OpenAIHandler,
+    "gemini": GeminiHandler,
+}
+
+
+def serve(server):
+    threading.Thread(target=server.serve_forever, name=f"{server.RequestHandlerClass.__name__}", daemon=True).start()
+    return server
+
+
+def start_fake(api, world, faults=None, stream_delay=0.01):
+    """Start the synthetic server for an api ("lastfm", "spotify", "openai" or "gemini")."""
+    return serve(BenchmarkServer(FAKE_HANDLERS[api], world, faults, playlists={}, catalogue={},
+                                 stream_delay=stream_delay))
+
+
+def start_recorder(api, fixture_file, upstream=None):
+    """Start a recording proxy in front of the real api."""
+    return serve(BenchmarkServer(RecordingHandler, upstream=upstream or UPSTREAMS[api], fixture_file=fixture_file))
+
+
+def start_replay(fixture_file, faults=None):
+    """Start a server that replays a recording, with faults injected on top."""
+    return serve(BenchmarkServer(ReplayHandler, faults=faults, recording=load_recording(fixture_file),
+                                 served=Counter()))
+
+
+def tool_environment(servers):
+    """Environment variables that point the tool at the given servers ({api: server})."""
+    env = {}
+    if "lastfm" in servers:
+        env["LASTFM_API_URL"] = servers["lastfm"].url
+    if "spotify" in servers:
+        env["SPOTIFY_API_URL"] = servers["spotify"].url + "/v1/"
+    if "openai" in servers:
+        env["OPENAI_BASE_URL"] = servers["openai"].url + "/v1"
+    if "gemini" in servers:
+        env["GEMINI_API_URL"] = servers["gemini"].url
+    return env
@@ -0,0 +1,212 @@
+"""
+Synthetic fixtures for the benchmark servers.
+
+A SyntheticWorld is a deterministic music collection of any size. Every answer is
+derived from the seed and the request, so a 100k loved-track world costs nothing to
+build, and two runs with the same seed see exactly the same data.
+"""
+import hashlib
+import json
+import re
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+BASE62 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+TAGS = ["indie", "rock", "electronic", "pop", "folk", "ambient", "jazz", "hip-hop", "shoegaze", "synthpop",
+        "post-punk", "soul", "techno", "dream pop", "alternative", "singer-songwriter"]
+GENRES = ["indie rock", "electropop", "modern rock", "art pop", "chillwave", "neo soul", "indie folk"]
+
+TITLE_PATTERN = re.compile(r"(?:track:)?(Track \d+)")
+ARTIST_PATTERN = re.compile(r"(?:artist:)?((?:Discovery |AI )?Artist \d+)")
+# Title suffixes the quality rules look at, mixed into a share of the synthetic titles
+TITLE_VARIANTS = [" (Live)", " - Demo", " (Acoustic Version)", " - Remastered", " (Alive Mix)", " Christmas Edit"]
+
+
+def stable_hash(*parts):
+    """A 64-bit hash of the parts that is the same in every process."""
+    digest = hashlib.sha1("\x1f".join(str(part) for part in parts).encode()).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def spotify_id(*parts):
+    """A 22-character base62 id, the shape spotipy expects in URIs."""
+    value = stable_hash(*parts)
+    chars = []
+    for _ in range(22):
+        value, remainder = divmod(value * 7919 + 17, 62)
+        chars.append(BASE62[remainder])
+    return "".join(chars)
+
+
+class SyntheticWorld:
+    """
+    A deterministic collection: loved tracks, artist playcounts, similar artists, top tracks, listener
+    counts, tags, scrobbles, Spotify catalogue and AI recommendations.
+
+    obscure_share of artists fall under the default 10,000 listener gate and
+    unresolvable_share of tracks are missing from the Spotify catalogue, so the
+    filters and fallbacks do real work.
+    """
+
+    def __init__(self, loved_tracks=1000, seed=1, tracks_per_artist=10, obscure_share=0.1,
+                 unresolvable_share=0.05, recent_scrobbles=200):
+        self.loved_count = loved_tracks
+        self.seed = seed
+        self.tracks_per_artist = tracks_per_artist
+        self.artist_count = max(1, loved_tracks // tracks_per_artist)
+        self.obscure_share = obscure_share
+        self.unresolvable_share = unresolvable_share
+        self.recent_scrobbles = recent_scrobbles
+        self.created = 1700000000
+
+    def chance(self, share, *parts):
+        return stable_hash(self.seed, *parts) % 10000 < share * 10000
+
+    # --- Last.fm ---
+
+    def loved_track(self, index):
+        """(title, artist, loved_at) of the index-th loved track, most recently loved first."""
+        artist = f"Artist {index % self.artist_count:05d}"
+        title = f"Track {index // self.artist_count:03d}"
+        return title, artist, self.created - index * 600
+
+    def loved_page(self, page, per_page):
+        total_pages = max(1, -(-self.loved_count // per_page))
+        start = (page - 1) * per_page
+        return [self.loved_track(i) for i in range(start, min(start + per_page, self.loved_count))], total_pages
+
+    def recent_track(self, index):
+        title, artist, _ = self.loved_track(stable_hash(self.seed, "recent", index) % self.loved_count)
+        return title, artist, self.created + 86400 - index * 180
+
+    def similar_artists(self, artist, limit=100):
+        """[(name, match)]: about a third known artists, the rest discovery artists."""
+        similar = []
+        for i in range(min(limit, 100)):
+            value = stable_hash(self.seed, "similar", artist.lower(), i)
+            if value % 3 == 0:
+                name = f"Artist {value // 3 % self.artist_count:05d}"
+            else:
+                name = f"Discovery Artist {value // 3 % (self.artist_count * 5 + 50):05d}"
+            if name.lower() != artist.lower() and name not in (n for n, _ in similar):
+                similar.append((name, round(1 - i / 100, 4)))
+        return similar
+
+    def top_tracks(self, artist, limit=50):
+        """[(title, playcount)] for any artist."""
+        return [(f"Track {i:03d}", 100000 // (i + 1) + stable_hash(self.seed, "plays", artist.lower(), i) % 1000)
+                for i in range(min(limit, 50))]
+
+    def user_top_artists(self, limit=50):
+        """[(artist, playcount)] of the user's most played artists, most played first."""
+        plays = [(f"Artist {i:05d}", 10 + stable_hash(self.seed, "artist plays", i) % 5000) for i in range(self.artist_count)]
+        return sorted(plays, key=lambda item: (-item[1], item[0]))[:limit]
+
+    def listeners(self, artist):
+        if self.chance(self.obscure_share, "obscure", artist.lower()):
+            return 500 + stable_hash(self.seed, "listeners", artist.lower()) % 9000
+        return 10000 + stable_hash(self.seed, "listeners", artist.lower()) % 2000000
+
+    def top_tags(self, artist):
+        value = stable_hash(self.seed, "tags", artist.lower())
+        return [(TAGS[(value >> (4 * i)) % len(TAGS)], 100 - i * 20) for i in range(3)]
+
+    # --- Spotify ---
+
+    def spotify_track(self, title, artist):
+        """Catalogue entry for a track, or None for the unresolvable share."""
+        if self.chance(self.unresolvable_share, "unresolvable", title.lower(), artist.lower()):
+            return None
+        track_id = spotify_id(self.seed, "track", title.lower(), artist.lower())
+        artist_id = spotify_id(self.seed, "artist", artist.lower())
+        return {
+            "id": track_id,
+            "uri": f"spotify:track:{track_id}",
+            "name": title,
+            "popularity": 20 + stable_hash(self.seed, "popularity", title.lower(), artist.lower()) % 80,
+            "artists": [{"id": artist_id, "uri": f"spotify:artist:{artist_id}", "name": artist}]
+        }
+
+    def search(self, query, limit=10):
+        """Spotify search results for one of the tool's query shapes."""
+        title_match = TITLE_PATTERN.search(query)
+        artist_match = ARTIST_PATTERN.search(query)
+        if not title_match:
+            return []
+        if artist_match:
+            track = self.spotify_track(title_match.group(1), artist_match.group(1))
+            return [track] if track else []
+        # Title-only query: the loosest rung of the ladder finds a same-titled track by someone else
+        artist = f"Artist {stable_hash(self.seed, 'loose', query) % self.artist_count:05d}"
+        return [track for track in [self.spotify_track(title_match.group(1), artist)] if track][:limit]
+
+    def artist(self, artist_id):
+        return {"id": artist_id, "name": f"Artist {artist_id[:6]}",
+                "genres": [GENRES[stable_hash(self.seed, "genre", artist_id) % len(GENRES)]]}
+
+    # --- AI ---
+
+    def ai_recommendations(self, count=15):
+        """The JSON document an AI provider returns for an artist recommendation prompt."""
+        recommendations = []
+        for i in range(count):
+            if i % 2:
+                name = f"Discovery Artist {stable_hash(self.seed, 'ai', i) % (self.artist_count * 5 + 50):05d}"
+            else:
+                name = f"AI Artist {stable_hash(self.seed, 'ai', i) % 100000:05d}"
+            recommendations.append({"type": "artist", "name": name, "reason": "Shares the collection's mood and era"})
+        return json.dumps({"recommendations": recommendations})
+
+    # --- Local state ---
+
+    def track_title(self, index):
+        """Title of the index-th loved track, with a quality-rule suffix on about one in five."""
+        title, artist, _ = self.loved_track(index)
+        value = stable_hash(self.seed, "variant", index)
+        if value % 5 == 0:
+            title += TITLE_VARIANTS[value // 5 % len(TITLE_VARIANTS)]
+        return title, artist
+
+    def loved_dicts(self, count=None):
+        """Loved tracks as the dicts the station builders work with."""
+        return [{"title": title, "artist": artist, "playcount": stable_hash(self.seed, "playcount", i) % 200}
+                for i, (title, artist) in enumerate(map(self.track_title, range(count or self.loved_count)))]
+
+    def track_objects(self, count=None):
+        """Loved tracks as pylast-shaped objects with .title and .artist.name."""
+        return [SimpleNamespace(title=title, artist=SimpleNamespace(name=artist))
+                for title, artist in map(self.track_title, range(count or self.loved_count))]
+
+    def banned_file(self, songs=5000, artists=2000, albums=1000, genres=200):
+        """banned.json contents: one in a hundred artists is in the collection, everything else never matches."""
+        items = [f"song:Banned Song {i:05d}" for i in range(songs)]
+        items += [f"artist:Artist {i // 100 % self.artist_count:05d}" if i % 100 == 0 else f"artist:Banned Artist {i:05d}"
+                  for i in range(artists)]
+        items += [f"album:Album {i:05d}" for i in range(albums)]
+        items += [f"genre:{GENRES[i % len(GENRES)]} {i:03d}" for i in range(genres)]
+        return {"banned_items": items}
+
+    def playlist_history(self, entries=100000, now=None):
+        """Playlist history with entries suggested between today and 180 days ago."""
+        now = now or datetime.now()
+        track_history = {}
+        for i in range(entries):
+            title, artist, _ = self.loved_track(i % self.loved_count)
+            key = f"{title.lower()}|{artist.lower()}" if i < self.loved_count else f"history track {i}|{artist.lower()}"
+            value = stable_hash(self.seed, "history", i)
+            track_history[key] = {
+                "last_suggested": (now - timedelta(days=value % 180, seconds=value % 86400)).isoformat(),
+                "times_suggested": 1 + value % 7
+            }
+        return {"track_history": track_history}
+
+    def search_items(self, title, artist, results=10):
+        """Spotify search items for a track where the right artist is usually among the last results."""
+        items = [{"uri": f"spotify:track:{spotify_id(self.seed, 'item', title, artist, i)}",
+                  "artists": [{"name": f"Other Artist {stable_hash(self.seed, 'other', title, i) % 1000:03d}"},
+                              {"name": f"Featured Artist {i}"}]}
+                 for i in range(results)]
+        position = stable_hash(self.seed, "position", title, artist) % (results + 2)
+        if position < results:
+            items[position]["artists"].append({"name": artist})
+        return items
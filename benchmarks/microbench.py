@@ -0,0 +1,260 @@
+"""
+Microbenchmarks for the pure hot-path functions.
+
+Each benchmark runs one function over synthetic data at collection scale (a large
+ban list, a 100k-entry playlist history, 50k loved tracks) and reports throughput
+and tracemalloc allocations. Save a run and compare later runs against it to catch
+regressions across versions:
+
+    python benchmarks/microbench.py --output before.json
+    python benchmarks/microbench.py --compare before.json --max-slowdown 0.2
+
+The comparison exits with status 1 when a benchmark's throughput drops or its peak
+allocation grows by more than the thresholds. Compare runs from the same machine.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from fixtures import SyntheticWorld
+
+TOOL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "spotify-my-station.py")
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a setup function: (tool, world, args) -> (function to time, items processed per call)."""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def load_tool(state_dir, world, args):
+    """Import the tool with its state files in state_dir and the synthetic ban list in place."""
+    banned_file = os.path.join(state_dir, "banned.json")
+    with open(banned_file, "w") as f:
+        json.dump(world.banned_file(songs=args.banned, artists=args.banned * 2 // 5, albums=args.banned // 5), f)
+    os.environ.update({
+        "CACHE_DIR": os.path.join(state_dir, "cache"),
+        "LOG_FILE": os.path.join(state_dir, "spotify-my-station.log"),
+        "HISTORY_FILE": os.path.join(state_dir, "playlist-history.json"),
+        "BANNED_FILE": banned_file,
+    })
+    spec = importlib.util.spec_from_file_location("spotify_my_station", TOOL)
+    tool = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(tool)
+    return tool
+
+
+@benchmark("is_banned_item")
+def bench_is_banned_item(tool, world, args):
+    banned_items = tool.load_banned_items()
+    pairs = [(track["title"], track["artist"]) for track in world.loved_dicts(args.loved)]
+
+    def run():
+        for title, artist in pairs:
+            tool.is_banned_item(title, artist, None, banned_items)
+    return run, len(pairs)
+
+
+@benchmark("is_banned_item_genres")
+def bench_is_banned_item_genres(tool, world, args):
+    # Genre checks only run for resolved tracks, so a playlist-sized sample is realistic
+    banned_items = tool.load_banned_items()
+    genres = ["indie rock", "art pop", "modern alternative rock"]
+    pairs = [(track["title"], track["artist"]) for track in world.loved_dicts(min(args.loved, 5000))]
+
+    def run():
+        for title, artist in pairs:
+            tool.is_banned_item(title, artist, None, banned_items, genres)
+    return run, len(pairs)
+
+
+@benchmark("is_recently_used")
+def bench_is_recently_used(tool, world, args):
+    history = world.playlist_history(args.history)
+    pairs = [(track["title"], track["artist"]) for track in world.loved_dicts(args.loved)]
+
+    def run():
+        for title, artist in pairs:
+            tool.is_recently_used(title, artist, history)
+    return run, len(pairs)
+
+
+@benchmark("is_track_suitable")
+def bench_is_track_suitable(tool, world, args):
+    tracks = world.loved_dicts(args.loved)
+
+    def run():
+        for track in tracks:
+            tool.is_track_suitable(track)
+    return run, len(tracks)
+
+
+@benchmark("quality_classify_many")
+def bench_quality_classify_many(tool, world, args):
+    pairs = [(track["title"], track["artist"]) for track in world.loved_dicts(args.loved)]
+    quality_filter = tool.get_quality_filter()
+    return (lambda: quality_filter.classify_many(pairs)), len(pairs)
+
+
+@benchmark("apply_randomity_30")
+def bench_apply_randomity_partial(tool, world, args):
+    tracks = world.track_objects(args.loved)
+    return (lambda: tool.apply_randomity(list(tracks), 30)), len(tracks)
+
+
+@benchmark("apply_randomity_90")
+def bench_apply_randomity_shuffle(tool, world, args):
+    tracks = world.track_objects(args.loved)
+    return (lambda: tool.apply_randomity(list(tracks), 90)), len(tracks)
+
+
+@benchmark("find_artist_match")
+def bench_find_artist_match(tool, world, args):
+    # One search ladder step per playlist candidate, ten results each
+    searches = [(world.search_items(track["title"], track["artist"]), track["artist"].lower())
+                for track in world.loved_dicts(min(args.loved, 10000))]
+
+    def run():
+        for items, artist_lower in searches:
+            tool.find_artist_match(items, artist_lower)
+    return run, len(searches)
+
+
+@benchmark("unique_additional_tracks")
+def bench_unique_additional_tracks(tool, world, args):
+    # Filling a 1000-track playlist from the loved collection, starting with tracks it already has
+    tracks = world.track_objects(args.loved)
+    existing = tracks[:1000]
+    return (lambda: tool.unique_additional_tracks(tracks, existing, 1000)), len(existing) + 1000
+
+
+def measure(function, items, repeat, seed):
+    """Best and median time over repeat calls, then peak and retained allocations of one call."""
+    random.seed(seed)
+    function()  # Warm-up: caches, compiled regexes, lazy imports
+
+    timings = []
+    for _ in range(repeat):
+        random.seed(seed)
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+
+    random.seed(seed)
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    result = function()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    best = min(timings)
+    return {
+        "items": items,
+        "best_seconds": round(best, 6),
+        "median_seconds": round(statistics.median(timings), 6),
+        "items_per_second": round(items / best, 1) if best else None,
+        "peak_kib": round((peak - baseline) / 1024, 1),
+        "retained_kib": round((current - baseline) / 1024, 1)
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(TOOL),
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def compare(results, baseline, max_slowdown, max_memory_growth):
+    """Return a description of every benchmark that regressed against the baseline."""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        if before["items_per_second"] and result["items_per_second"]:
+            change = result["items_per_second"] / before["items_per_second"] - 1
+            if change < -max_slowdown:
+                regressions.append(f"{name}: {before['items_per_second']:,.0f} -> {result['items_per_second']:,.0f} items/s ({change:+.0%})")
+        # Small absolute differences are noise, whatever the ratio
+        growth = result["peak_kib"] - before["peak_kib"]
+        if growth > 64 and growth > max_memory_growth * max(before["peak_kib"], 1):
+            regressions.append(f"{name}: peak allocation {before['peak_kib']:,.1f} -> {result['peak_kib']:,.1f} KiB")
+    return regressions
+
+
+def print_results(results, baseline=None):
+    print(f"{'benchmark':<26} {'items':>7} {'best ms':>9} {'items/s':>12} {'peak KiB':>10} {'vs base':>8}")
+    for name, result in results.items():
+        before = (baseline or {}).get(name)
+        change = ""
+        if before and before["items_per_second"] and result["items_per_second"]:
+            change = f"{result['items_per_second'] / before['items_per_second'] - 1:+.0%}"
+        print(f"{name:<26} {result['items']:>7} {result['best_seconds'] * 1000:>9.2f} "
+              f"{result['items_per_second'] or 0:>12,.0f} {result['peak_kib']:>10,.1f} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the pure hot-path functions")
+    parser.add_argument("benchmarks", nargs="*", help=f"Benchmarks to run (default: all): {', '.join(BENCHMARKS)}")
+    parser.add_argument("--loved", type=int, default=50000, help="Loved tracks in the synthetic collection")
+    parser.add_argument("--history", type=int, default=100000, help="Playlist history entries")
+    parser.add_argument("--banned", type=int, default=5000, help="Banned songs (artists and albums scale with it)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed calls per benchmark")
+    parser.add_argument("--seed", type=int, default=1, help="Synthetic data and random seed")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare against an earlier --output file")
+    parser.add_argument("--max-slowdown", type=float, default=0.25, help="Allowed throughput loss against the baseline")
+    parser.add_argument("--max-memory-growth", type=float, default=0.5, help="Allowed peak allocation growth against the baseline")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    world = SyntheticWorld(args.loved, seed=args.seed)
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="sms-microbench-") as state_dir:
+        tool = load_tool(state_dir, world, args)
+        for name in args.benchmarks or BENCHMARKS:
+            function, items = BENCHMARKS[name](tool, world, args)
+            results[name] = measure(function, items, args.repeat, args.seed)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"version": tool.__version__, "revision": git_revision(), "python": platform.python_version(),
+                       "parameters": {"loved": args.loved, "history": args.history, "banned": args.banned,
+                                      "repeat": args.repeat, "seed": args.seed},
+                       "results": results}, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.max_slowdown, args.max_memory_growth)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+End-to-end benchmarks against the fake Last.fm, Spotify and OpenAI servers.
+
+For every collection size a synthetic world is served by fresh fake servers, and
+the tool is run as a subprocess in each station mode with its state in a temporary
+directory. Wall time, API calls per endpoint (as seen by the servers) and the
+tool's own run summary are reported.
+
+    python benchmarks/run_benchmarks.py --sizes 1000 10000 100000
+    python benchmarks/run_benchmarks.py --latency 0.05 --jitter 0.02 --rate-429 0.02 --error-rate 0.01
+
+Record a real run (using the credentials and playlist in .env, as a dry run that publishes
+nothing) and replay it with injected latency:
+
+    python benchmarks/run_benchmarks.py --record recordings/
+    python benchmarks/run_benchmarks.py --replay recordings/ --latency 0.1
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from fixtures import SyntheticWorld
+import fake_servers
+
+TOOL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "spotify-my-station.py")
+PLAYLIST_ID = "benchplaylist000000000"
+SPOTIFY_SCOPE = "playlist-modify-public playlist-modify-private user-read-private user-library-read user-read-recently-played"
+
+# Modes run in this order for each size; offline reuses the caches the online run left behind,
+# but every mode starts from an empty playlist history so cooldown doesn't exclude those tracks
+STATION_MODES = {
+    "apple": [],
+    "offline": ["--offline"],
+}
+# Recorded runs use the playlist from .env and never publish, so recording leaves the real
+# account untouched and replay serves exactly the traffic that was recorded
+RECORDED_RUN_ARGS = ["--dry-run"]
+
+
+def benchmark_environment(state_dir, servers, args, credentials=True):
+    """Environment for one tool run: state in state_dir, APIs pointed at servers."""
+    env = dict(os.environ)
+    env.update(fake_servers.tool_environment(servers))
+    env.update({
+        "CACHE_DIR": os.path.join(state_dir, "cache"),
+        "HISTORY_FILE": os.path.join(state_dir, "playlist-history.json"),
+        "BANNED_FILE": os.path.join(state_dir, "banned.json"),
+        "LOG_FILE": os.path.join(state_dir, "spotify-my-station.log"),
+        "RATE_LIMIT_DB": os.path.join(state_dir, "rate-limits.sqlite"),
+        "NUMBER_OF_TRACKS": str(args.tracks),
+        "LASTFM_RATE_LIMIT": str(args.lastfm_rate_limit),
+        "SPOTIFY_RATE_LIMIT": str(args.spotify_rate_limit),
+    })
+    if credentials:
+        # Fake servers accept anything; a cached token keeps spotipy from starting the OAuth flow
+        token_path = os.path.join(state_dir, "spotify-token.json")
+        with open(token_path, "w") as f:
+            json.dump({"access_token": "bench", "token_type": "Bearer", "expires_in": 3600, "scope": SPOTIFY_SCOPE,
+                       "expires_at": int(time.time()) + 86400, "refresh_token": "bench"}, f)
+        env.update({
+            "SPOTIFY_CACHE_PATH": token_path,
+            "LASTFM_API_KEY": "bench", "LASTFM_API_SECRET": "bench", "LASTFM_USERNAME": "bench", "LASTFM_PASSWORD": "bench",
+            "SPOTIPY_CLIENT_ID": "bench", "SPOTIPY_CLIENT_SECRET": "bench", "SPOTIPY_REDIRECT_URI": "http://127.0.0.1/callback",
+            "AI_PROVIDER": "openai", "OPENAI_API_KEY": "bench",
+        })
+    return env
+
+
+def run_tool(env, extra_args, timeout, playlist_id=PLAYLIST_ID):
+    started = time.perf_counter()
+    playlist_args = ["--playlist", playlist_id] if playlist_id else []
+    try:
+        completed = subprocess.run([sys.executable, TOOL] + playlist_args + extra_args, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=timeout, text=True)
+        returncode, stderr = completed.returncode, completed.stderr
+    except subprocess.TimeoutExpired:
+        returncode, stderr = "timeout", ""
+    return time.perf_counter() - started, returncode, stderr
+
+
+def run_mode(mode, state_dir, servers, args, credentials=True, recorded=False):
+    for server in servers.values():
+        server.reset_counters()
+    env = benchmark_environment(state_dir, servers, args, credentials)
+    if os.path.exists(env["HISTORY_FILE"]):
+        os.remove(env["HISTORY_FILE"])
+    # Seeding the tool too means every build of the same world does the same work
+    tool_args = STATION_MODES[mode] + ["--seed", str(args.seed)] + (RECORDED_RUN_ARGS if recorded else []) + args.tool_args
+    wall, returncode, stderr = run_tool(env, tool_args, args.timeout, playlist_id=None if recorded else PLAYLIST_ID)
+
+    result = {"mode": mode, "wall_seconds": round(wall, 3), "returncode": returncode,
+              "calls": {api: dict(server.counts) for api, server in servers.items()},
+              "call_totals": {api: sum(server.counts.values()) for api, server in servers.items()}}
+    if "spotify" in servers and hasattr(servers["spotify"], "playlists"):
+        result["published_tracks"] = len(servers["spotify"].playlists.get(PLAYLIST_ID, {}).get("items", []))
+    # Dry runs leave run-summary.json to real runs and write their own
+    summary_path = os.path.join(env["CACHE_DIR"], "dry-run-summary.json" if recorded else "run-summary.json")
+    if os.path.exists(summary_path):
+        with open(summary_path) as f:
+            summary = json.load(f)
+        result["stages"] = {h["labels"]["stage"]: h["sum"] for h in summary["histograms"] if h["name"] == "stage_seconds"}
+        result["cache_hit_ratios"] = summary.get("cache_hit_ratios", {})
+        result["circuit_opened"] = {c["labels"]["upstream"]: c["value"] for c in summary["counters"] if c["name"] == "circuit_opened_total"}
+    if returncode != 0 and stderr:
+        result["stderr"] = stderr[-2000:]
+    return result
+
+
+def print_results(results):
+    print(f"{'size':>8} {'mode':<9} {'wall s':>8} {'last.fm':>8} {'spotify':>8} {'ai':>5} {'tracks':>7}  exit  breakers opened")
+    for result in results:
+        totals = result["call_totals"]
+        opened = ", ".join(f"{upstream} x{count}" for upstream, count in result.get("circuit_opened", {}).items()) or "-"
+        print(f"{result.get('size', '-'):>8} {result['mode']:<9} {result['wall_seconds']:>8.2f} {totals.get('lastfm', 0):>8} "
+              f"{totals.get('spotify', 0):>8} {totals.get('openai', 0):>5} {result.get('published_tracks', '-'):>7}  {result['returncode']:<4}  {opened}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmarks against fake Last.fm, Spotify and OpenAI servers")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Loved-track collection sizes")
+    parser.add_argument("--modes", nargs="+", choices=list(STATION_MODES), default=list(STATION_MODES))
+    parser.add_argument("--tracks", type=int, default=100, help="NUMBER_OF_TRACKS for each run")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the synthetic world, injected faults and the tool's random choices")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds on top of the latency")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with a server error")
+    parser.add_argument("--lastfm-rate-limit", type=float, default=1000, help="LASTFM_RATE_LIMIT for the tool")
+    parser.add_argument("--spotify-rate-limit", type=float, default=1000, help="SPOTIFY_RATE_LIMIT for the tool")
+    parser.add_argument("--timeout", type=float, default=3600, help="Seconds before a run is abandoned")
+    parser.add_argument("--record", metavar="DIR", help="Record one real dry run's traffic into DIR instead of benchmarking")
+    parser.add_argument("--replay", metavar="DIR", help="Benchmark against recordings in DIR instead of synthetic worlds")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("tool_args", nargs=argparse.REMAINDER, help="Extra arguments for the tool, after --")
+    args = parser.parse_args()
+    args.tool_args = [arg for arg in args.tool_args if arg != "--"]
+
+    def faults():
+        return fake_servers.Faults(args.latency, args.jitter, args.rate_429, args.error_rate, seed=args.seed)
+
+    results = []
+    if args.record:
+        os.makedirs(args.record, exist_ok=True)
+        servers = {api: fake_servers.start_recorder(api, os.path.join(args.record, f"{api}.jsonl"))
+                   for api in ("lastfm", "spotify", "openai")}
+        with tempfile.TemporaryDirectory(prefix="sms-record-") as state_dir:
+            results.append(run_mode("apple", state_dir, servers, args, credentials=False, recorded=True))
+    elif args.replay:
+        servers = {api: fake_servers.start_replay(os.path.join(args.replay, f"{api}.jsonl"), faults())
+                   for api in ("lastfm", "spotify", "openai") if os.path.exists(os.path.join(args.replay, f"{api}.jsonl"))}
+        with tempfile.TemporaryDirectory(prefix="sms-replay-") as state_dir:
+            for mode in args.modes:
+                results.append(run_mode(mode, state_dir, servers, args, recorded=True))
+    else:
+        for size in args.sizes:
+            world = SyntheticWorld(size, seed=args.seed)
+            servers = {api: fake_servers.start_fake(api, world, faults()) for api in ("lastfm", "spotify", "openai")}
+            with tempfile.TemporaryDirectory(prefix=f"sms-bench-{size}-") as state_dir:
+                for mode in args.modes:
+                    result = run_mode(mode, state_dir, servers, args)
+                    result["size"] = size
+                    results.append(result)
+                    print_results([result])
+            for server in servers.values():
+                server.stop()
+
+    print()
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
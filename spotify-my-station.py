@@ -8,22 +8,25 @@ import argparse
 from datetime import datetime
 from dotenv import load_dotenv
 import json
-from collections import Counter, defaultdict
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import re
 import fcntl
 import sys
 import signal
 import atexit
-try:
-    import openai
-except ImportError:
-    openai = None
-try:
-    import google.generativeai as genai
-except ImportError:
-    genai = None
-
-__version__ = "2.5.0"
+import threading
+import importlib.util
+import hashlib
+import math
+import queue
+import bisect
+import itertools
+import sqlite3
+from urllib.parse import parse_qs, urlsplit
+
+__version__ = "2.6.0"
 
 load_dotenv()
 
@@ -80,9 +83,65 @@ AI_PROVIDER = os.getenv("AI_PROVIDER", "openai").lower()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY") or os.getenv("OPEN_AI_API_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
+# API base URLs, only overridden to point the tool at local stand-ins such as the benchmark servers
+# (the OpenAI SDK reads OPENAI_BASE_URL itself)
+LASTFM_API_URL = os.getenv("LASTFM_API_URL")
+SPOTIFY_API_URL = os.getenv("SPOTIFY_API_URL")
+GEMINI_API_URL = os.getenv("GEMINI_API_URL")
+SPOTIFY_CACHE_PATH = os.getenv("SPOTIFY_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), '.spotify_cache'))
+
 LOG_FILE = os.getenv("LOG_FILE", "/home/rolle/spotify-my-station/spotify-my-station.log")
 HISTORY_FILE = os.getenv("HISTORY_FILE", "/home/rolle/spotify-my-station/playlist-history.json")
 BANNED_FILE = os.getenv("BANNED_FILE", "/home/rolle/spotify-my-station/banned.json")
+CACHE_DIR = os.getenv("CACHE_DIR", "/home/rolle/spotify-my-station/cache")
+AI_CACHE_FILE = os.getenv("AI_CACHE_FILE", os.path.join(CACHE_DIR, "ai-recommendations.json"))
+AI_CACHE_TTL_HOURS = float(os.getenv("AI_CACHE_TTL_HOURS", "24"))
+AI_DEADLINE_SECONDS = float(os.getenv("AI_DEADLINE_SECONDS", "45"))
+AI_HEDGE = os.getenv("AI_HEDGE", "false").lower() in ("1", "true", "yes")
+AI_HEDGE_PERCENTILE = float(os.getenv("AI_HEDGE_PERCENTILE", "90"))
+AI_HEDGE_DEFAULT_SECONDS = float(os.getenv("AI_HEDGE_DEFAULT_SECONDS", "15"))
+AI_STATS_FILE = os.getenv("AI_STATS_FILE", os.path.join(CACHE_DIR, "ai-provider-stats.json"))
+AI_PROMPT_TOKEN_BUDGET = int(os.getenv("AI_PROMPT_TOKEN_BUDGET", "600"))
+TASTE_PROFILE_FILE = os.getenv("TASTE_PROFILE_FILE", os.path.join(CACHE_DIR, "taste-profile.json"))
+TASTE_AFFINITY_HALF_LIFE_DAYS = float(os.getenv("TASTE_AFFINITY_HALF_LIFE_DAYS", "7"))
+TASTE_TAGS_PER_RUN = int(os.getenv("TASTE_TAGS_PER_RUN", "10"))
+ARTIST_CACHE_FILE = os.getenv("ARTIST_CACHE_FILE", os.path.join(CACHE_DIR, "artist-info.json"))
+ARTIST_CACHE_TTL_DAYS = float(os.getenv("ARTIST_CACHE_TTL_DAYS", "7"))
+ARTIST_VALIDATION_WORKERS = int(os.getenv("ARTIST_VALIDATION_WORKERS", "5"))
+REJECTIONS_FILE = os.getenv("REJECTIONS_FILE", os.path.join(CACHE_DIR, "rejections.json"))
+REJECTION_RECHECK_DAYS = float(os.getenv("REJECTION_RECHECK_DAYS", "30"))
+MIN_ARTIST_LISTENERS = int(os.getenv("MIN_ARTIST_LISTENERS", "10000"))
+MIN_TRACK_POPULARITY = int(os.getenv("MIN_TRACK_POPULARITY", "15"))
+PUBLISH_MODE = os.getenv("PUBLISH_MODE", "diff").lower()
+ROTATION_FRACTION = float(os.getenv("ROTATION_FRACTION", "0"))
+ROTATION_STRATEGY = os.getenv("ROTATION_STRATEGY", "oldest").lower()
+LARGE_PLAYLIST_THRESHOLD = int(os.getenv("LARGE_PLAYLIST_THRESHOLD", "300"))
+STAGING_PLAYLIST_ID = os.getenv("STAGING_PLAYLIST_ID")
+STAGING_STATE_FILE = os.path.join(CACHE_DIR, "staging-playlists.json")
+PUBLISH_RETRIES = int(os.getenv("PUBLISH_RETRIES", "3"))
+SPOTIFY_MAX_CONCURRENCY = int(os.getenv("SPOTIFY_MAX_CONCURRENCY", "8"))
+SPOTIFY_MAX_RETRIES = int(os.getenv("SPOTIFY_MAX_RETRIES", "5"))
+SPOTIFY_MAX_RETRY_AFTER = float(os.getenv("SPOTIFY_MAX_RETRY_AFTER", "60"))
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", os.path.join(CACHE_DIR, "rate-limits.sqlite"))
+LASTFM_RATE_LIMIT = float(os.getenv("LASTFM_RATE_LIMIT", "5"))
+SPOTIFY_RATE_LIMIT = float(os.getenv("SPOTIFY_RATE_LIMIT", "10"))
+SINGLE_FLIGHT_CACHE_SIZE = int(os.getenv("SINGLE_FLIGHT_CACHE_SIZE", "5000"))
+RUN_DEADLINE_SECONDS = float(os.getenv("RUN_DEADLINE_SECONDS", "3300"))
+PUBLISH_RESERVE_SECONDS = float(os.getenv("PUBLISH_RESERVE_SECONDS", "60"))
+LASTFM_REQUEST_TIMEOUT = float(os.getenv("LASTFM_REQUEST_TIMEOUT", "10"))
+SPOTIFY_REQUEST_TIMEOUT = float(os.getenv("SPOTIFY_REQUEST_TIMEOUT", "10"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "60"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", str(max(SPOTIFY_MAX_CONCURRENCY, ARTIST_VALIDATION_WORKERS))))
+HTTP2 = os.getenv("HTTP2", "true").lower() in ("1", "true", "yes")
+METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE", os.path.join(CACHE_DIR, "spotify-my-station.prom"))
+RUN_SUMMARY_FILE = os.getenv("RUN_SUMMARY_FILE", os.path.join(CACHE_DIR, "run-summary.json"))
+DRY_RUN_FILE = os.getenv("DRY_RUN_FILE", os.path.join(CACHE_DIR, "dry-run.json"))
+DRY_RUN_SUMMARY_FILE = os.getenv("DRY_RUN_SUMMARY_FILE", os.path.join(CACHE_DIR, "dry-run-summary.json"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(CACHE_DIR, "profiles"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+SIMILARITY_GRAPH_FILE = os.path.join(CACHE_DIR, "similarity-graph.json")
+RESOLUTION_CACHE_FILE = os.path.join(CACHE_DIR, "resolutions.json")
 
 NUMBER_OF_TRACKS = int(os.getenv("NUMBER_OF_TRACKS", "100"))
 RANDOMITY_FACTOR = int(os.getenv("RANDOMITY_FACTOR", "50"))  # 0-100 scale
@@ -133,6 +192,45 @@ def load_banned_items():
         return {'songs': [], 'artists': [], 'albums': [], 'genres': []}
 
 
+def load_json_state(path, default):
+    """Load a JSON state/cache file, returning default if it is missing or unreadable."""
+    try:
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                return json.load(f)
+    except Exception as e:
+        log_message(f"Error loading {os.path.basename(path)}: {e}", 'yellow')
+    return default
+
+
+# Dry runs read every cache but write none, so repeated dry runs start from the same state
+_state_read_only = False
+
+
+def set_state_read_only(read_only):
+    global _state_read_only
+    _state_read_only = read_only
+
+
+def save_json_state(path, data, report=False):
+    """
+    Atomically write a JSON state/cache file so readers never see a partial file.
+
+    State is not written while it is read-only (dry runs); report=True marks run
+    outputs such as summaries, which are always written.
+    """
+    if _state_read_only and not report:
+        return
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        log_message(f"Error saving {os.path.basename(path)}: {e}", 'yellow')
 
 
 def save_playlist_history(tracks):
@@ -307,6 +405,116 @@ def is_banned_item(track_title, artist_name, album_name, banned_items, genres=No
     return False
 
 
+# Quality rules: phrases matched case-insensitively at word boundaries, per field.
+# Override or extend them with a "quality_rules" object in banned.json.
+QUALITY_RULES = {
+    "title": {
+        "live": ["live", "concert", "acoustic version"],
+        "unsuitable": ["demo", "rehearsal", "interview", "spoken word"],
+        "skip": ["christmas", "xmas", "ai generated", "ai music", "cover version", "tribute", "karaoke"]
+    },
+    "artist": {
+        "various_artists": ["various artists", "va"]
+    }
+}
+
+
+class QualityFilter:
+    """
+    Precompiled matcher for the quality rules.
+
+    Each field gets one regex with a named group per rule, so a title is scanned once
+    no matter how many rules there are, and 'live' no longer matches 'Alive'.
+    """
+
+    def __init__(self, rules):
+        self.patterns = {}
+        self.group_rules = {}
+        for field, field_rules in rules.items():
+            groups = []
+            self.group_rules[field] = {}
+            for rule, phrases in field_rules.items():
+                # Longest first so 'ai music' wins over a shorter overlapping phrase
+                alternatives = "|".join(
+                    r"[ \t]+".join(re.escape(word) for word in phrase.split())
+                    for phrase in sorted(phrases, key=len, reverse=True) if phrase.strip()
+                )
+                if alternatives:
+                    group = f"r{len(self.group_rules[field])}"
+                    self.group_rules[field][group] = rule
+                    groups.append(rf"(?P<{group}>(?<!\w)(?:{alternatives})(?!\w))")
+            if groups:
+                self.patterns[field] = re.compile("|".join(groups), re.IGNORECASE)
+
+    def matches(self, title, artist=None):
+        """Return the set of rule names a track matches."""
+        hits = set()
+        for field, text in (("title", title), ("artist", artist)):
+            pattern = self.patterns.get(field)
+            if pattern and text:
+                hits.update(self.group_rules[field][match.lastgroup] for match in pattern.finditer(text))
+        return hits
+
+    def rejects(self, title, artist=None, rules=None):
+        """True if the track matches any of the given rules (all rules when None); stops at the first hit."""
+        for field, text in (("title", title), ("artist", artist)):
+            pattern = self.patterns.get(field)
+            if pattern and text:
+                group_rules = self.group_rules[field]
+                for match in pattern.finditer(text):
+                    if rules is None or group_rules[match.lastgroup] in rules:
+                        return True
+        return False
+
+    def classify_many(self, tracks):
+        """
+        Classify many (title, artist) pairs at once, returning a set of rule names per pair.
+
+        All values of a field are joined into one newline-separated text and scanned
+        with a single regex pass; match offsets are mapped back to their track.
+        """
+        tracks = list(tracks)
+        results = [set() for _ in tracks]
+        for index, field in enumerate(("title", "artist")):
+            pattern = self.patterns.get(field)
+            if not pattern:
+                continue
+            texts = [(track[index] or "").replace("\n", " ") for track in tracks]
+            line_ends = list(itertools.accumulate(len(text) + 1 for text in texts))
+            for match in pattern.finditer("\n".join(texts)):
+                results[bisect.bisect_right(line_ends, match.start())].add(self.group_rules[field][match.lastgroup])
+        return results
+
+
+_quality_filter = None
+_quality_filter_mtime = None
+
+
+def get_quality_filter():
+    """Return the compiled quality filter; called per candidate, so banned.json is only checked by refresh_quality_filter."""
+    return _quality_filter or refresh_quality_filter()
+
+
+def refresh_quality_filter():
+    """Compile the quality filter, or rebuild it if banned.json changed since; run once per job."""
+    global _quality_filter, _quality_filter_mtime
+    mtime = os.path.getmtime(BANNED_FILE) if os.path.exists(BANNED_FILE) else None
+    if _quality_filter is None or mtime != _quality_filter_mtime:
+        rules = {field: dict(field_rules) for field, field_rules in QUALITY_RULES.items()}
+        try:
+            if mtime is not None:
+                with open(BANNED_FILE, 'r') as f:
+                    custom_rules = json.load(f).get("quality_rules", {})
+                for field, field_rules in custom_rules.items():
+                    if not field.startswith("_"):
+                        rules.setdefault(field, {}).update(field_rules)
+        except Exception as e:
+            log_message(f"Error loading quality rules: {e}", 'red')
+        _quality_filter = QualityFilter(rules)
+        _quality_filter_mtime = mtime
+    return _quality_filter
+
+
 def apply_randomity(tracks_list, randomity_factor):
     """Apply randomity factor to track selection with improved variety."""
     if randomity_factor == 0:
@@ -344,14 +552,889 @@ def apply_randomity(tracks_list, randomity_factor):
         return result[:len(tracks_list)]  # Return original length
 
 
+# --- Metrics ---
+
+METRICS_PREFIX = "spotify_my_station"
+METRICS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+METRICS_RESERVOIR_SIZE = 1024  # Samples kept per histogram for the summary's percentiles
+
+
+class Histogram:
+    """
+    Latency histogram with fixed memory: per-bucket counts, sum, count and max, as
+    Prometheus keeps them, plus a bounded uniform reservoir sample for p50/p95.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * len(METRICS_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.reservoir = []
+        # Own generator, so sampling never consumes the seeded global random state
+        self.random = random.Random(0)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        bucket = bisect.bisect_left(METRICS_BUCKETS, value)
+        if bucket < len(self.buckets):
+            self.buckets[bucket] += 1
+        if len(self.reservoir) < METRICS_RESERVOIR_SIZE:
+            self.reservoir.append(value)
+        else:
+            slot = self.random.randrange(self.count)
+            if slot < METRICS_RESERVOIR_SIZE:
+                self.reservoir[slot] = value
+
+    def cumulative_buckets(self):
+        return list(zip(METRICS_BUCKETS, itertools.accumulate(self.buckets)))
+
+    def percentile(self, q):
+        ordered = sorted(self.reservoir)
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 4) if ordered else 0
+
+
+class Metrics:
+    """
+    Run metrics: labelled counters, gauges and latency histograms.
+
+    API calls are tagged by api and endpoint, cache lookups by cache and result,
+    pipeline stages by stage and station tracks by source. export() writes a
+    Prometheus textfile (for node_exporter's textfile collector) and a JSON run summary.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.counters = Counter()
+        self.gauges = {}
+        self.histograms = defaultdict(Histogram)
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+    def count(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[self.key(name, labels)] += value
+
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[self.key(name, labels)] = value
+
+    def observe(self, name, seconds, **labels):
+        with self.lock:
+            self.histograms[self.key(name, labels)].observe(seconds)
+
+    def lap(self, stage, started):
+        """Record a pipeline stage that began at started; returns now, when the next stage begins."""
+        now = time.time()
+        self.observe("stage_seconds", now - started, stage=stage)
+        return now
+
+    def cache_hit_ratios(self):
+        lookups = defaultdict(Counter)
+        for (name, labels), value in self.counters.items():
+            if name == "cache_lookups_total":
+                labels = dict(labels)
+                lookups[labels["cache"]][labels["result"]] += value
+        return {cache: round(results["hit"] / sum(results.values()), 3) for cache, results in lookups.items()}
+
+    def stage_seconds(self):
+        stages = Counter()
+        for (name, labels), histogram in self.histograms.items():
+            if name == "stage_seconds":
+                stages[dict(labels)["stage"]] += histogram.sum
+        return {stage: round(seconds, 3) for stage, seconds in stages.items()}
+
+    def api_call_counts(self):
+        calls = defaultdict(Counter)
+        for (name, labels), value in self.counters.items():
+            if name == "api_requests_total":
+                labels = dict(labels)
+                calls[labels["api"]][labels["endpoint"]] += value
+        return {api: dict(endpoints) for api, endpoints in sorted(calls.items())}
+
+    def to_prometheus(self):
+        def series(name, labels, extra=()):
+            pairs = list(labels) + list(extra)
+            rendered = ",".join(f'{label}="{value}"' for label, value in pairs)
+            return f"{METRICS_PREFIX}_{name}" + (f"{{{rendered}}}" if rendered else "")
+
+        lines = []
+        for kind, metrics in (("counter", self.counters), ("gauge", self.gauges)):
+            for name in sorted({name for name, _ in metrics}):
+                lines.append(f"# TYPE {METRICS_PREFIX}_{name} {kind}")
+                for (metric_name, labels), value in sorted(metrics.items()):
+                    if metric_name == name:
+                        lines.append(f"{series(name, labels)} {value}")
+        for name in sorted({name for name, _ in self.histograms}):
+            lines.append(f"# TYPE {METRICS_PREFIX}_{name} histogram")
+            for (metric_name, labels), histogram in sorted(self.histograms.items()):
+                if metric_name != name:
+                    continue
+                for bound, count in histogram.cumulative_buckets():
+                    lines.append(f"{series(name + '_bucket', labels, [('le', f'{bound:g}')])} {count}")
+                lines.append(f"{series(name + '_bucket', labels, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{series(name + '_sum', labels)} {histogram.sum:.6f}")
+                lines.append(f"{series(name + '_count', labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        return {
+            "version": __version__,
+            "started_at": datetime.fromtimestamp(self.started_at).isoformat(),
+            "duration_seconds": round(time.time() - self.started_at, 3),
+            "counters": [{"name": name, "labels": dict(labels), "value": value}
+                         for (name, labels), value in sorted(self.counters.items())],
+            "gauges": [{"name": name, "labels": dict(labels), "value": value}
+                       for (name, labels), value in sorted(self.gauges.items())],
+            "histograms": [{"name": name, "labels": dict(labels), "count": histogram.count, "sum": round(histogram.sum, 4),
+                            "p50": histogram.percentile(0.5), "p95": histogram.percentile(0.95), "max": round(histogram.max, 4)}
+                           for (name, labels), histogram in sorted(self.histograms.items())],
+            "cache_hit_ratios": self.cache_hit_ratios()
+        }
+
+    def export(self, textfile=None, summary_file=None, prometheus=True):
+        """Write the Prometheus textfile (unless prometheus is False) and the JSON run summary; returns the summary."""
+        self.set_gauge("run_duration_seconds", round(time.time() - self.started_at, 3))
+        self.set_gauge("run_finished_timestamp_seconds", int(time.time()))
+        with self.lock:
+            text = self.to_prometheus()
+            summary = self.summary()
+        try:
+            if prometheus:
+                textfile = textfile or METRICS_TEXTFILE
+                os.makedirs(os.path.dirname(textfile) or ".", exist_ok=True)
+                tmp_path = f"{textfile}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w') as f:
+                    f.write(text)
+                os.replace(tmp_path, textfile)
+        except Exception as e:
+            log_message(f"Error writing metrics textfile: {e}", 'yellow')
+        save_json_state(summary_file or RUN_SUMMARY_FILE, summary, report=True)
+        return summary
+
+
+metrics = Metrics()
+
+
+def record_api_call(api, endpoint, started, outcome):
+    """Count one upstream request and its latency; outcome is "ok", an HTTP status or "error"."""
+    metrics.observe("api_request_seconds", time.time() - started, api=api, endpoint=endpoint)
+    metrics.count("api_requests_total", api=api, endpoint=endpoint, outcome=outcome)
+
+
+def endpoint_from_lastfm_url(url):
+    """Last.fm API method (e.g. artist.getSimilar) from a request URL."""
+    return parse_qs(urlsplit(str(url)).query).get("method", ["unknown"])[0]
+
+
+# --- Run Deadline ---
+
+class DeadlineExceeded(Exception):
+    """The run's time budget is used up."""
+
+
+class Deadline:
+    """
+    Time budget for a whole run.
+
+    Network calls take their timeout from what is left, so nothing can outlive the
+    budget, and stages check allows() to cut their work short while there's still
+    time to publish.
+    """
+
+    def __init__(self, seconds=None):
+        self.expires_at = time.time() + seconds if seconds else None
+
+    def remaining(self):
+        return float('inf') if self.expires_at is None else self.expires_at - time.time()
+
+    def allows(self, seconds):
+        """True if at least this many seconds are left."""
+        return self.remaining() >= seconds
+
+    def timeout(self, cap):
+        """Timeout for one call: cap, or the rest of the budget if that's shorter."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("Run deadline reached")
+        return max(0.1, min(cap, remaining))
+
+
+_run_deadline = Deadline()
+
+
+def start_run_deadline(seconds):
+    global _run_deadline
+    _run_deadline = Deadline(seconds)
+    return _run_deadline
+
+
+def get_run_deadline():
+    return _run_deadline
+
+
+class PylastHttpx:
+    """
+    Stand-in for the httpx module inside pylast.
+
+    pylast opens a new client for every request; this hands out the pooled client
+    for the host instead, so connections are kept alive across requests. Every
+    request gets the remaining run budget as its timeout, and its responses are
+    reported to the lastfm circuit breaker.
+    """
+
+    def __init__(self, httpx_module, cap):
+        self.httpx = httpx_module
+        self.cap = cap
+
+    def __getattr__(self, name):
+        return getattr(self.httpx, name)
+
+    def Client(self, *args, **kwargs):
+        kwargs.pop("timeout", None)
+        if LASTFM_API_URL:
+            kwargs["base_url"] = LASTFM_API_URL
+        client = get_httpx_client(f"lastfm {kwargs.get('base_url', '')}", *args, **kwargs)
+        return BreakerHttpxClient(client, get_circuit_breaker("lastfm"), get_run_deadline().timeout(self.cap))
+
+
+# --- Circuit Breakers ---
+
+class CircuitOpenError(Exception):
+    """An upstream's circuit breaker is open, so the call was not attempted."""
+
+
+class CircuitBreaker:
+    """
+    Per-upstream breaker that stops calling a service after repeated failures.
+
+    Closed: calls go through. After `failure_threshold` consecutive upstream failures
+    it opens and calls fail fast with CircuitOpenError. Once `reset_seconds` have
+    passed it half-opens and lets a single probe through, whose outcome closes or
+    re-opens it. State changes are logged.
+    """
+
+    def __init__(self, name, failure_threshold=None, reset_seconds=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or CIRCUIT_FAILURE_THRESHOLD
+        self.reset_seconds = reset_seconds or CIRCUIT_RESET_SECONDS
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def set_state(self, state, reason=""):
+        if state != self.state:
+            colour = 'green' if state == "closed" else 'yellow' if state == "half-open" else 'red'
+            log_message(f"Circuit breaker {self.name}: {self.state} -> {state}" + (f" ({reason})" if reason else ""), colour)
+            if state == "open":
+                metrics.count("circuit_opened_total", upstream=self.name)
+            self.state = state
+
+    def is_open(self):
+        with self.lock:
+            return self.state == "open" and time.time() - self.opened_at < self.reset_seconds
+
+    def allow(self):
+        """True if a call may go ahead now; in half-open state only one probe is let through."""
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.time() - self.opened_at >= self.reset_seconds:
+                self.set_state("half-open", "probing for recovery")
+            if self.state == "half-open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def check(self):
+        if not self.allow():
+            metrics.count("circuit_open_rejections_total", upstream=self.name)
+            raise CircuitOpenError(f"{self.name} circuit is open")
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.probing = False
+            self.set_state("closed")
+
+    def record_failure(self, error=None):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state != "closed" or self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+                self.set_state("open", f"{self.failures} consecutive failures, last: {error}" if error else f"{self.failures} consecutive failures")
+
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name):
+    """Return the process-wide breaker for an upstream ('lastfm', 'spotify', or 'ai-<provider>')."""
+    with _circuit_breakers_lock:
+        if name not in _circuit_breakers:
+            _circuit_breakers[name] = CircuitBreaker(name)
+        return _circuit_breakers[name]
+
+
+def is_upstream_failure(error):
+    """
+    True if an exception means the service itself is struggling.
+
+    Answers like "artist not found" or a 404 are the service working fine, and an
+    expired run deadline is our own limit, so neither counts against the breaker.
+    """
+    if isinstance(error, (DeadlineExceeded, CircuitOpenError)):
+        return False
+    if isinstance(error, SpotifyThrottledError):
+        return True
+    if isinstance(error, spotipy.SpotifyException):
+        return error.http_status is None or error.http_status >= 500 or error.http_status == 429
+    if isinstance(error, pylast.WSError):
+        return str(getattr(error, 'status', '')) in LASTFM_SERVICE_ERRORS
+    return True
+
+
+# Last.fm errors that mean the service is struggling: 11 offline, 16 temporarily unavailable, 29 rate limited
+LASTFM_SERVICE_ERRORS = ("11", "16", "29")
+LASTFM_ERROR_PATTERN = re.compile(r'<error code="(\d+)"')
+
+
+def lastfm_error_code(response):
+    """The Last.fm error code in a failed response body, or None; errors come with any HTTP status."""
+    body = response.text
+    if 'status="failed"' not in body[:200]:
+        return None
+    match = LASTFM_ERROR_PATTERN.search(body)
+    return match.group(1) if match else None
+
+
+class BreakerHttpxClient:
+    """
+    Proxy for a shared httpx client as used by pylast.
+
+    Leaving the with block keeps the shared client open, requests get the given
+    timeout, and each Last.fm response is reported to the lastfm breaker.
+    """
+
+    def __init__(self, client, breaker, timeout=None):
+        self.client = client
+        self.breaker = breaker
+        self.timeout = timeout
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def post(self, *args, **kwargs):
+        if self.timeout is not None:
+            kwargs.setdefault("timeout", self.timeout)
+        endpoint = endpoint_from_lastfm_url(args[0] if args else kwargs.get("url", ""))
+        started = time.time()
+        try:
+            response = self.client.post(*args, **kwargs)
+        except Exception as e:
+            record_api_call("lastfm", endpoint, started, "error")
+            self.breaker.record_failure(e)
+            raise
+        # pylast raises Last.fm's own errors only after this returns, so they are read from the body here
+        error_code = lastfm_error_code(response)
+        status = f"error {error_code}" if error_code else "ok" if response.status_code < 400 else str(response.status_code)
+        record_api_call("lastfm", endpoint, started, status)
+        if response.status_code >= 500 or response.status_code == 429:
+            self.breaker.record_failure(f"HTTP {response.status_code}")
+        elif error_code in LASTFM_SERVICE_ERRORS:
+            self.breaker.record_failure(f"Last.fm error {error_code}")
+        else:
+            self.breaker.record_success()
+        return response
+
+
+# --- HTTP Transport ---
+
+_http_clients = {}
+_http_clients_lock = threading.Lock()
+# Per-thread Spotify request timeout; spotipy's requests_timeout is one value shared by every thread
+_spotify_request_timeout = threading.local()
+
+
+def use_http2():
+    """True if HTTP/2 is enabled and the h2 package httpx needs for it is installed."""
+    return HTTP2 and importlib.util.find_spec("h2") is not None
+
+
+def get_httpx_client(name, *args, **kwargs):
+    """
+    Return the process-wide pooled httpx client called name, creating it on first use.
+
+    Connections are kept alive between requests, up to HTTP_POOL_SIZE of them, and
+    HTTP/2 is negotiated where the server supports it. kwargs only apply on creation.
+    """
+    with _http_clients_lock:
+        if name not in _http_clients:
+            import httpx
+            limits = httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE)
+            _http_clients[name] = httpx.Client(*args, limits=limits, http2=use_http2(), **kwargs)
+        return _http_clients[name]
+
+
+def get_requests_session():
+    """
+    Return the process-wide pooled requests session for spotipy, creating it on first use.
+
+    requests has no HTTP/2, so this only pools keep-alive connections. The adapter
+    never retries; RateLimitedSpotify owns retries. It applies the calling thread's
+    timeout set by RateLimitedSpotify in place of spotipy's shared one.
+    """
+    with _http_clients_lock:
+        if "spotify" not in _http_clients:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            class ThreadTimeoutAdapter(HTTPAdapter):
+                def send(self, request, **kwargs):
+                    timeout = getattr(_spotify_request_timeout, "seconds", None)
+                    if timeout is not None:
+                        kwargs["timeout"] = timeout
+                    return super().send(request, **kwargs)
+
+            session = requests.Session()
+            adapter = ThreadTimeoutAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_clients["spotify"] = session
+        return _http_clients["spotify"]
+
+
+def close_http_clients():
+    """Close every pooled client and its connections."""
+    with _http_clients_lock:
+        for client in _http_clients.values():
+            try:
+                client.close()
+            except Exception:
+                pass
+        _http_clients.clear()
+
+
+atexit.register(close_http_clients)
+
+
+# --- Fallback Caches ---
+
+class JsonStore:
+    """A sectioned JSON state file, loaded on first use and written back by save() when changed."""
+
+    def __init__(self, path, sections):
+        self.path = path
+        self.sections = sections
+        self.data = None
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        if self.data is None:
+            self.data = load_json_state(self.path, {})
+            for section in self.sections:
+                self.data.setdefault(section, {})
+        return self.data
+
+    def get(self, section, key):
+        with self.lock:
+            return self.load()[section].get(key)
+
+    def put(self, section, key, value):
+        with self.lock:
+            self.load()[section][key] = value
+            self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if self.dirty:
+                save_json_state(self.path, self.data)
+                self.dirty = False
+
+
+# Last.fm similar artists and top tracks, and Spotify matches, kept for when an upstream is down
+similarity_graph = JsonStore(SIMILARITY_GRAPH_FILE, ("similar", "top_tracks"))
+resolution_cache = JsonStore(RESOLUTION_CACHE_FILE, ("tracks",))
+
+
+def cached_similar_item(artist_name):
+    """Stand-in for a pylast SimilarItem built from the similarity graph."""
+    return type('SimilarItem', (), {'item': type('Artist', (), {'name': artist_name})()})()
+
+
+def cached_top_item(title, artist_name):
+    """Stand-in for a pylast TopItem built from the similarity graph."""
+    track = type('Track', (), {'title': title, 'artist': type('Artist', (), {'name': artist_name})()})()
+    return type('TopItem', (), {'item': track})()
+
+
+def save_fallback_caches():
+    similarity_graph.save()
+    resolution_cache.save()
+
+
+# --- Shared Rate Limiting ---
+
+class SharedRateLimiter:
+    """
+    Host-wide token buckets kept in SQLite, shared by every process using the same file.
+
+    Each named bucket refills at `rate` tokens per second up to `burst`; acquire()
+    takes one token, sleeping until one is available. Parallel runs therefore split
+    one API budget between them instead of each assuming it has the API to itself.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.failed = False
+
+    def connection(self):
+        if not hasattr(self.local, "connection"):
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+            self.local.connection = connection
+        return self.local.connection
+
+    def acquire(self, bucket, rate, burst=None):
+        if rate <= 0 or self.failed:
+            return
+        burst = burst or max(1.0, rate)
+        try:
+            connection = self.connection()
+            while True:
+                # BEGIN IMMEDIATE takes the write lock, so read-modify-write is atomic across processes
+                connection.execute("BEGIN IMMEDIATE")
+                now = time.time()
+                row = connection.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (bucket,)).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+                if tokens >= 1:
+                    connection.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                                       (bucket, tokens - 1, now))
+                    connection.execute("COMMIT")
+                    return
+                connection.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                                   (bucket, tokens, now))
+                connection.execute("COMMIT")
+                time.sleep((1 - tokens) / rate)
+        except Exception as e:
+            # Never let limiter trouble stop a run; fall back to per-process behaviour
+            self.failed = True
+            log_message(f"Shared rate limiter unavailable ({e}), continuing without it", 'yellow')
+
+
+_rate_limiter = None
+
+
+def get_rate_limiter():
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = SharedRateLimiter(RATE_LIMIT_DB)
+    return _rate_limiter
+
+
+def get_rate_limit_bucket(api, credential):
+    """Bucket name per API and credential, without writing the credential itself to disk."""
+    return f"{api}:{hashlib.sha1((credential or '').encode()).hexdigest()[:12]}"
+
+
+# --- Request Coalescing ---
+
+class SingleFlight:
+    """
+    In-process single-flight cache for API calls, keyed by (endpoint, params).
+
+    Concurrent identical calls wait for the one already in flight instead of
+    repeating it, and finished results are kept in a bounded LRU for the rest of
+    the run. Failures are shared with the waiting callers but not cached.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.results = OrderedDict()
+        self.in_flight = {}
+        self.stats = Counter()
+
+    def do(self, key, fetch):
+        with self.lock:
+            if key in self.results:
+                self.results.move_to_end(key)
+                self.stats["cached"] += 1
+                metrics.count("cache_lookups_total", cache="run", endpoint=key[0], result="hit")
+                return self.results[key]
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self.in_flight[key] = Future()
+                self.stats["fetched"] += 1
+            else:
+                self.stats["coalesced"] += 1
+            metrics.count("cache_lookups_total", cache="run", endpoint=key[0], result="miss" if owner else "coalesced")
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = fetch()
+        except BaseException as e:
+            with self.lock:
+                del self.in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            del self.in_flight[key]
+            self.results[key] = value
+            while len(self.results) > self.max_entries:
+                self.results.popitem(last=False)
+        future.set_result(value)
+        return value
+
+
+_single_flight = SingleFlight(SINGLE_FLIGHT_CACHE_SIZE)
+
+
+def lastfm_similar_artists(network, artist_name, limit=10):
+    """
+    Similar artists for an artist; always fetches 10 so different limits share one request.
+
+    Results are recorded in the similarity graph, which answers instead while the
+    lastfm circuit breaker is open.
+    """
+    artist_key = artist_name.lower()
+
+    def fetch():
+        similar = list(network.get_artist(artist_name).get_similar(limit=10))
+        similarity_graph.put("similar", artist_key, [similar_item.item.name for similar_item in similar])
+        return similar
+
+    try:
+        similar = _single_flight.do(("artist.getSimilar", artist_key), fetch)
+    except CircuitOpenError:
+        similar = [cached_similar_item(name) for name in similarity_graph.get("similar", artist_key) or []]
+    return similar[:limit]
+
+
+def lastfm_top_tracks(network, artist_name, limit=5):
+    """Top tracks for an artist; always fetches 5 so different limits share one request, with the same fallback."""
+    artist_key = artist_name.lower()
+
+    def fetch():
+        top_tracks = list(network.get_artist(artist_name).get_top_tracks(limit=5))
+        similarity_graph.put("top_tracks", artist_key, [[item.item.title, item.item.artist.name] for item in top_tracks])
+        return top_tracks
+
+    try:
+        top_tracks = _single_flight.do(("artist.getTopTracks", artist_key), fetch)
+    except CircuitOpenError:
+        top_tracks = [cached_top_item(title, artist) for title, artist in similarity_graph.get("top_tracks", artist_key) or []]
+    return top_tracks[:limit]
+
+
+def lastfm_listener_count(network, artist_name):
+    return _single_flight.do(("artist.getInfo.listeners", artist_name.lower()),
+                             lambda: network.get_artist(artist_name).get_listener_count())
+
+
+def spotify_search(sp, query, limit=10):
+    return _single_flight.do(("search.track", query, limit),
+                             lambda: sp.search(q=query, type="track", limit=limit))
+
+
+def log_request_coalescing():
+    stats = _single_flight.stats
+    if stats["cached"] or stats["coalesced"]:
+        log_message(f"Request coalescing: {stats['fetched']} fetched, {stats['cached']} served from run cache, "
+                    f"{stats['coalesced']} joined an in-flight request", 'green')
+
+
+# --- Spotify Client ---
+
+class SpotifyThrottledError(Exception):
+    """Spotify kept answering 429 after all retries, or asked us to wait longer than we will."""
+
+
+class AIMDLimiter:
+    """Concurrency limit with additive increase on success and multiplicative decrease on throttling."""
+
+    def __init__(self, initial, maximum):
+        self.limit = float(min(initial, maximum))
+        self.maximum = maximum
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1.0, self.limit / 2)
+            else:
+                # Roughly +1 per full window of successful calls
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+class RateLimitedSpotify:
+    """
+    Wraps a spotipy client so every API call respects Spotify's rate limits.
+
+    A 429 makes all threads wait out its Retry-After and halves the allowed
+    concurrency, successes grow it again one step at a time, and 5xx responses
+    are retried with backoff. With a bucket, calls also draw from the shared
+    host-wide rate limit, and calls that still fail count against the spotify
+    circuit breaker. Other attributes pass through to the spotipy client.
+    """
+
+    def __init__(self, client, max_concurrency=None, max_retries=None, bucket=None):
+        self.client = client
+        self.bucket = bucket
+        self.limiter = AIMDLimiter(2, max_concurrency or SPOTIFY_MAX_CONCURRENCY)
+        self.max_retries = SPOTIFY_MAX_RETRIES if max_retries is None else max_retries
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            return self.call(attribute, *args, **kwargs)
+        return call
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def call(self, method, *args, **kwargs):
+        """Make one API call through the spotify circuit breaker, with throttling and retries."""
+        breaker = get_circuit_breaker("spotify")
+        breaker.check()
+        try:
+            result = self.call_with_retries(method, *args, **kwargs)
+        except Exception as e:
+            if is_upstream_failure(e):
+                breaker.record_failure(e)
+            elif isinstance(e, spotipy.SpotifyException):
+                # A 4xx answer still means Spotify is up
+                breaker.record_success()
+            raise
+        breaker.record_success()
+        return result
+
+    def call_with_retries(self, method, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            # A Retry-After applies to the whole client, not just the thread that received it
+            delay = self.blocked_until - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+            self.limiter.acquire()
+            throttled = False
+            try:
+                if self.bucket:
+                    get_rate_limiter().acquire(self.bucket, SPOTIFY_RATE_LIMIT)
+                # Picked up by the pooled session's adapter for this thread's request only
+                _spotify_request_timeout.seconds = get_run_deadline().timeout(SPOTIFY_REQUEST_TIMEOUT)
+                self.count("calls")
+                return self.timed(method, *args, **kwargs)
+            except spotipy.SpotifyException as e:
+                if e.http_status == 429:
+                    throttled = True
+                    self.count("throttled")
+                    retry_after = float((getattr(e, 'headers', None) or {}).get("Retry-After", 1))
+                    if retry_after > min(SPOTIFY_MAX_RETRY_AFTER, get_run_deadline().remaining()):
+                        raise SpotifyThrottledError(f"Spotify asked to wait {retry_after:.0f}s") from e
+                    with self.lock:
+                        self.blocked_until = max(self.blocked_until, time.time() + retry_after)
+                elif e.http_status and e.http_status >= 500:
+                    time.sleep(min(2 ** attempt, 30))
+                else:
+                    raise
+                self.count("wasted")
+                if attempt == self.max_retries:
+                    if throttled:
+                        raise SpotifyThrottledError(f"Still throttled after {self.max_retries} retries") from e
+                    raise
+                self.count("retries")
+            finally:
+                _spotify_request_timeout.seconds = None
+                self.limiter.release(throttled)
+
+    @staticmethod
+    def timed(method, *args, **kwargs):
+        endpoint = getattr(method, "__name__", "unknown")
+        started = time.time()
+        outcome = "error"
+        try:
+            result = method(*args, **kwargs)
+            outcome = "ok"
+            return result
+        except spotipy.SpotifyException as e:
+            outcome = str(e.http_status)
+            raise
+        finally:
+            record_api_call("spotify", endpoint, started, outcome)
+
+    def log_stats(self):
+        log_message(f"Spotify API: {self.stats['calls']} calls, {self.stats['throttled']} throttled, "
+                    f"{self.stats['retries']} retries, {self.stats['wasted']} wasted "
+                    f"(concurrency limit now {int(self.limiter.limit)})", 'green')
+
+
 def authenticate_lastfm():
     try:
+        # pylast builds an httpx client per request; hand it the pooled client with the remaining budget as its timeout.
+        # Installed first, since creating the network already requests a session key
+        if hasattr(pylast, "httpx") and not isinstance(pylast.httpx, PylastHttpx):
+            pylast.httpx = PylastHttpx(pylast.httpx, LASTFM_REQUEST_TIMEOUT)
+
+        # pylast calls _delay_call() before every request when rate limiting is on;
+        # pointing it at the shared bucket paces all processes using this API key together,
+        # and no request starts once the run deadline has passed or while Last.fm's breaker is open
+        bucket = get_rate_limit_bucket("lastfm", LASTFM_API_KEY)
+
+        def delay_call():
+            get_run_deadline().timeout(LASTFM_REQUEST_TIMEOUT)
+            get_circuit_breaker("lastfm").check()
+            get_rate_limiter().acquire(bucket, LASTFM_RATE_LIMIT)
+
+        # The session key request made by the constructor can't be hooked, so gate it here
+        delay_call()
         network = pylast.LastFMNetwork(
             api_key=LASTFM_API_KEY,
             api_secret=LASTFM_API_SECRET,
             username=LASTFM_USERNAME,
             password_hash=pylast.md5(LASTFM_PASSWORD),
         )
+
+        network.enable_rate_limit()
+        network._delay_call = delay_call
         return network
     except Exception as e:
         log_message(f"Last.fm Authentication Error: {e}", 'red')
@@ -360,7 +1443,7 @@ def authenticate_lastfm():
 
 def authenticate_spotify():
     try:
-        cache_path = os.path.join(os.path.dirname(__file__), '.spotify_cache')
+        cache_path = SPOTIFY_CACHE_PATH
         
         # Check if we already have a cached token
         if os.path.exists(cache_path):
@@ -374,7 +1457,8 @@ def authenticate_spotify():
             redirect_uri=SPOTIPY_REDIRECT_URI,
             scope="playlist-modify-public playlist-modify-private user-read-private user-library-read user-read-recently-played",
             cache_path=cache_path,
-            open_browser=False
+            open_browser=False,
+            requests_session=get_requests_session()
         )
         
         # If no cached token, provide manual authorization instructions
@@ -407,7 +1491,12 @@ def authenticate_spotify():
                 log_message(f"Error processing redirect URL: {e}", 'red')
                 return None
         
-        sp = spotipy.Spotify(auth_manager=auth_manager)
+        # spotipy's own status retries would hide 429s, so they're handled by the wrapper instead;
+        # token refreshes and API calls share one pooled keep-alive session
+        client = spotipy.Spotify(auth_manager=auth_manager, status_retries=0, requests_session=get_requests_session())
+        if SPOTIFY_API_URL:
+            client.prefix = SPOTIFY_API_URL.rstrip("/") + "/"
+        sp = RateLimitedSpotify(client, bucket=get_rate_limit_bucket("spotify", SPOTIPY_CLIENT_ID))
         
         # Test the connection
         user_info = sp.me()
@@ -530,7 +1619,7 @@ def get_similar_artist_tracks(network, loved_tracks, num_tracks):
     """Get tracks from similar artists based on user's loved tracks."""
     try:
         # Extract unique artists from loved tracks
-        artists = list(set([track.artist.name for track in loved_tracks]))
+        artists = sorted(set(track.artist.name for track in loved_tracks))
         random.shuffle(artists)
         
         similar_tracks = []
@@ -543,8 +1632,7 @@ def get_similar_artist_tracks(network, loved_tracks, num_tracks):
                 break
                 
             try:
-                artist = network.get_artist(artist_name)
-                similar_artists = artist.get_similar(limit=10)  # Increased from 5 to 10
+                similar_artists = lastfm_similar_artists(network, artist_name, 10)  # Increased from 5 to 10
                 
                 for similar_artist in similar_artists:
                     if len(similar_tracks) >= num_tracks:
@@ -553,17 +1641,14 @@ def get_similar_artist_tracks(network, loved_tracks, num_tracks):
                     similar_artist_name = similar_artist.item.name
                     if similar_artist_name.lower() not in used_artists:
                         try:
-                            top_tracks = similar_artist.item.get_top_tracks(limit=5)  # Increased from 3 to 5
-                            for track in top_tracks:
+                            top_tracks = lastfm_top_tracks(network, similar_artist_name)  # Increased from 3 to 5
+                            for track_item in top_tracks:
                                 if len(similar_tracks) >= num_tracks:
                                     break
+                                track = track_item.item
                                 
                                 # Filter out live tracks
-                                track_title = track.title.lower()
-                                is_live = any(keyword in track_title for keyword in 
-                                            ['live', 'live at', 'live from', 'live in', 'live on', 'concert', 'acoustic version'])
-                                
-                                if not is_live:
+                                if not get_quality_filter().rejects(track.title, rules=("live",)):
                                     similar_tracks.append(track)
                                     used_artists.add(similar_artist_name.lower())
                                     break
@@ -579,6 +1664,24 @@ def get_similar_artist_tracks(network, loved_tracks, num_tracks):
         return []
 
 
+def unique_additional_tracks(candidates, existing_tracks, limit):
+    """Return up to limit candidates whose title and artist are not already in existing_tracks."""
+    additional = []
+    for track in candidates:
+        if len(additional) >= limit:
+            break
+        # Don't add tracks we already have
+        track_already_added = False
+        for existing_track in existing_tracks:
+            if (existing_track.title.lower() == track.title.lower() and 
+                existing_track.artist.name.lower() == track.artist.name.lower()):
+                track_already_added = True
+                break
+        if not track_already_added:
+            additional.append(track)
+    return additional
+
+
 def get_lastfm_recommendations(sp, network, num_tracks=100, randomity_factor=50):
     try:
         log_message("Getting recommendations using Last.fm similar artists...")
@@ -592,7 +1695,7 @@ def get_lastfm_recommendations(sp, network, num_tracks=100, randomity_factor=50)
         for item in loved_tracks:
             artists_set.add(item.track.artist.name)
         
-        artists_list = list(artists_set)
+        artists_list = sorted(artists_set)
         random.shuffle(artists_list)
         log_message(f"Found {len(artists_list)} unique artists from loved tracks")
         
@@ -617,8 +1720,7 @@ def get_lastfm_recommendations(sp, network, num_tracks=100, randomity_factor=50)
                 
             try:
                 log_message(f"Finding artists similar to: {artist_name}")
-                artist = network.get_artist(artist_name)
-                similar_artists = artist.get_similar(limit=10)
+                similar_artists = lastfm_similar_artists(network, artist_name, 10)
                 
                 # Get top tracks from similar artists
                 for similar_artist in similar_artists:
@@ -627,7 +1729,7 @@ def get_lastfm_recommendations(sp, network, num_tracks=100, randomity_factor=50)
                     
                     try:
                         # Get top tracks from this similar artist
-                        top_tracks = similar_artist.item.get_top_tracks(limit=5)
+                        top_tracks = lastfm_top_tracks(network, similar_artist.item.name)
                         
                         for track_item in top_tracks:
                             if len(similar_tracks) >= remaining_slots:
@@ -684,20 +1786,7 @@ def get_lastfm_recommendations(sp, network, num_tracks=100, randomity_factor=50)
             log_message(f"Need {remaining_needed} more tracks to reach {num_tracks}. Adding more loved tracks...", 'yellow')
             
             # Get more loved tracks to fill the gap
-            additional_loved = []
-            for item in loved_tracks:
-                if len(additional_loved) >= remaining_needed:
-                    break
-                track = item.track
-                # Don't add tracks we already have
-                track_already_added = False
-                for existing_track in recommended_tracks:
-                    if (existing_track.title.lower() == track.title.lower() and 
-                        existing_track.artist.name.lower() == track.artist.name.lower()):
-                        track_already_added = True
-                        break
-                if not track_already_added:
-                    additional_loved.append(track)
+            additional_loved = unique_additional_tracks((item.track for item in loved_tracks), recommended_tracks, remaining_needed)
             
             recommended_tracks.extend(additional_loved)
             log_message(f"Added {len(additional_loved)} additional loved tracks", 'green')
@@ -1024,17 +2113,21 @@ def create_coherent_mix(sp, network, clustered_tracks, recent_context, num_track
 
 
 def get_coherent_similar_tracks(sp, network, seed_artists, used_artists, target_count):
-    """Get tracks from similar artists that maintain genre/mood coherence."""
-    try:
-        similar_tracks = []
+    """
+    Get tracks from similar artists that maintain genre/mood coherence.
+
+    Last.fm lookups fall back to the similarity graph while its breaker is open,
+    and the Spotify check to the resolution cache.
+    """
+    try:
+        similar_tracks = []
         
         for seed_artist in seed_artists:
             if len(similar_tracks) >= target_count:
                 break
                 
             try:
-                artist = network.get_artist(seed_artist)
-                similar_artists = artist.get_similar(limit=3)
+                similar_artists = lastfm_similar_artists(network, seed_artist, 3)
                 
                 for similar_artist_item in similar_artists:
                     if len(similar_tracks) >= target_count:
@@ -1044,7 +2137,7 @@ def get_coherent_similar_tracks(sp, network, seed_artists, used_artists, target_
                     artist_name_lower = similar_artist.name.lower()
                     
                     if artist_name_lower not in used_artists:
-                        top_tracks = similar_artist.get_top_tracks(limit=1)
+                        top_tracks = lastfm_top_tracks(network, similar_artist.name, 1)
                         
                         for track_item in top_tracks:
                             track = track_item.item
@@ -1056,22 +2149,16 @@ def get_coherent_similar_tracks(sp, network, seed_artists, used_artists, target_
                             if is_track_suitable(track_data):
                                 # Verify track exists on Spotify
                                 try:
-                                    search_results = sp.search(
-                                        q=f"track:{track.title} artist:{track.artist.name}",
-                                        type="track",
-                                        limit=1
-                                    )
-                                    if search_results["tracks"]["items"]:
-                                        class SimilarTrack:
-                                            def __init__(self, title, artist_name):
-                                                self.title = title
-                                                self.artist = type('Artist', (), {'name': artist_name})()
-                                        
-                                        similar_tracks.append(SimilarTrack(track.title, track.artist.name))
-                                        used_artists.add(artist_name_lower)
-                                        break
-                                except:
+                                    search_results = spotify_search(sp, f"track:{track.title} artist:{track.artist.name}", 1)
+                                    found = bool(search_results["tracks"]["items"])
+                                except CircuitOpenError:
+                                    found = resolution_cache.get("tracks", f"{track.title.lower()}|{track.artist.name.lower()}") is not None
+                                except Exception:
                                     continue
+                                if found:
+                                    similar_tracks.append(CoherentTrack(track.title, track.artist.name))
+                                    used_artists.add(artist_name_lower)
+                                    break
                             break
                             
             except Exception:
@@ -1086,27 +2173,14 @@ def get_coherent_similar_tracks(sp, network, seed_artists, used_artists, target_
 
 def is_track_suitable(track_data):
     """Smart filtering to ensure track quality and coherence."""
-    title = track_data['title'].lower()
-    artist = track_data['artist'].lower()
-    
-    # Filter out problematic content
-    unsuitable_keywords = [
-        'live', 'live at', 'live from', 'live in', 'live on', 
-        'concert', 'acoustic version', 'demo', 'rehearsal',
-        'interview', 'spoken word', 'various artists', 'va'
-    ]
-    
-    # Check title and artist
-    if any(keyword in title for keyword in unsuitable_keywords):
+    # Filter out live recordings, demos, interviews and compilation artists
+    if get_quality_filter().rejects(track_data['title'], track_data['artist'], ("live", "unsuitable", "various_artists")):
         return False
-    
-    if any(keyword in artist for keyword in unsuitable_keywords):
-        return False
-    
+
     # Filter out very short or very long titles (likely incomplete or messy data)
     if len(track_data['title']) < 2 or len(track_data['title']) > 100:
         return False
-    
+
     return True
 
 
@@ -1151,88 +2225,716 @@ def get_coherent_my_station_recommendations(sp, network, history_analysis, num_t
         return get_ai_hybrid_recommendations(sp, network, history_analysis, num_tracks, randomity_factor)
 
 
-def get_ai_artist_recommendations(network, loved_tracks_list, num_artists=10):
-    """Get AI-powered artist recommendations using GPT-5-mini or Gemini."""
-    try:
-        log_message("Getting AI-powered artist recommendations...", 'green')
+# --- AI Providers ---
+
+# Structured-output schema shared by both providers. The recommendations array is parsed while it streams.
+AI_RECOMMENDATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "recommendations": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "type": {"type": "string", "enum": ["artist", "direction"]},
+                    "name": {"type": "string"},
+                    "reason": {"type": "string"},
+                    "relation": {"type": "string"},
+                    "description": {"type": "string"}
+                },
+                "required": ["type", "reason"]
+            }
+        }
+    },
+    "required": ["recommendations"]
+}
 
-        # Sample tracks for AI analysis
-        sample_size = min(100, len(loved_tracks_list))
-        sample_tracks = random.sample(loved_tracks_list, sample_size)
-        sample_track_names = [f"{item.track.title} by {item.track.artist.name}" for item in sample_tracks]
 
-        # Get unique artists
-        artists_set = set()
-        for item in loved_tracks_list:
-            artists_set.add(item.track.artist.name)
-        artists_list = list(artists_set)[:50]  # Top 50 for prompt
+class AIProvider(ABC):
+    """Common interface for AI providers. The SDK is imported and the client built on first use."""
 
-        prompt = f"""You are an AI music curator. Analyze this user's music taste and recommend {num_artists} NEW artists they would love.
+    name = None
+    label = None
+    module_name = None
 
-User's Music Profile:
-- Sample tracks: {', '.join(sample_track_names[:30])}
-- Favorite artists: {', '.join(artists_list[:25])}
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self._client = None
+        self._client_lock = threading.Lock()
 
-Return ONLY a JSON array of artist recommendations in this exact format:
-[
-  {{"type": "artist", "name": "Artist Name", "reason": "Brief reason"}},
-  ...
-]
+    def is_available(self):
+        """Check that the SDK is installed without importing it."""
+        try:
+            return importlib.util.find_spec(self.module_name) is not None
+        except ImportError:
+            return False
 
-Focus on artists similar to their taste but NOT in their current collection."""
+    def is_configured(self):
+        return bool(self.api_key) and self.is_available()
+
+    def client(self):
+        """Return the shared client, creating it once per process."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._create_client()
+        return self._client
+
+    @abstractmethod
+    def _create_client(self):
+        """Import the SDK and build its client."""
+
+    @abstractmethod
+    def stream(self, prompt, temperature=None, max_tokens=None, schema=None, timeout=None):
+        """Yield completion text chunks as they arrive, in the provider's JSON mode when a schema is given."""
+
+
+class OpenAIProvider(AIProvider):
+    name = "openai"
+    label = "GPT-5-mini"
+    module_name = "openai"
+    model = "gpt-5-mini"
+
+    def _create_client(self):
+        import openai
+        # One client per process on the shared transport keeps its connections alive between requests
+        return openai.OpenAI(api_key=self.api_key, http_client=get_httpx_client("openai", follow_redirects=True))
+
+    def stream(self, prompt, temperature=None, max_tokens=None, schema=None, timeout=None):
+        # Note: GPT-5 models only support their default sampling settings, so options are opt-in
+        options = {}
+        if timeout is not None:
+            options['timeout'] = timeout
+        if temperature is not None:
+            options['temperature'] = temperature
+        if max_tokens is not None:
+            options['max_completion_tokens'] = max_tokens
+        if schema:
+            options['response_format'] = {
+                "type": "json_schema",
+                "json_schema": {"name": "recommendations", "schema": schema}
+            }
+
+        response_stream = self.client().chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            stream=True,
+            **options
+        )
+        try:
+            for chunk in response_stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # Closing the stream drops the HTTP response, which is how an abandoned request is cancelled
+            response_stream.close()
+
+
+class GeminiProvider(AIProvider):
+    name = "gemini"
+    label = "Gemini"
+    module_name = "google.generativeai"
+    model = "gemini-1.5-flash"
+
+    def _create_client(self):
+        import google.generativeai as genai
+        if GEMINI_API_URL:
+            genai.configure(api_key=self.api_key, transport="rest", client_options={"api_endpoint": GEMINI_API_URL})
+        else:
+            genai.configure(api_key=self.api_key)
+        return genai.GenerativeModel(self.model)
+
+    def stream(self, prompt, temperature=None, max_tokens=None, schema=None, timeout=None):
+        generation_config = {}
+        if temperature is not None:
+            generation_config['temperature'] = temperature
+        if max_tokens is not None:
+            generation_config['max_output_tokens'] = max_tokens
+        if schema:
+            generation_config['response_mime_type'] = "application/json"
+            generation_config['response_schema'] = schema
+
+        request_options = {'timeout': timeout} if timeout is not None else None
+        response = self.client().generate_content(prompt, generation_config=generation_config or None,
+                                                  stream=True, request_options=request_options)
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. safety metadata) carry nothing to parse
+                continue
+            if text:
+                yield text
+
+
+AI_PROVIDER_CLASSES = {
+    "openai": (OpenAIProvider, OPENAI_API_KEY),
+    "gemini": (GeminiProvider, GEMINI_API_KEY),
+}
+_ai_providers = {}
+
+
+def get_ai_provider(name):
+    """Return the process-wide provider instance for a name, or None if unknown."""
+    if name not in AI_PROVIDER_CLASSES:
+        return None
+    if name not in _ai_providers:
+        provider_class, api_key = AI_PROVIDER_CLASSES[name]
+        _ai_providers[name] = provider_class(api_key)
+    return _ai_providers[name]
+
+
+def get_ai_providers():
+    """Return configured providers in the order they should be tried (Gemini is the fallback)."""
+    order = [AI_PROVIDER]
+    if AI_PROVIDER != "gemini":
+        order.append("gemini")
+
+    providers = []
+    for name in order:
+        provider = get_ai_provider(name)
+        if provider and provider.is_configured():
+            providers.append(provider)
+    return providers
+
+
+class StreamingJSONArrayParser:
+    """Incrementally parse the first JSON array in streamed text, returning each object once it closes."""
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.depth = 0
+        self.array_depth = None
+        self.object_start = None
+        self.in_string = False
+        self.escaped = False
+        self.finished = False
+
+    def feed(self, text):
+        """Add a chunk of text and return the array objects completed by it."""
+        self.buffer += text
+        completed = []
+
+        while self.position < len(self.buffer) and not self.finished:
+            char = self.buffer[self.position]
+
+            if self.array_depth is None:
+                # Anything before the array (an object key, a code fence) is skipped
+                if char == '[':
+                    self.depth += 1
+                    self.array_depth = self.depth
+                elif char == '{':
+                    self.depth += 1
+                elif char == '}':
+                    self.depth -= 1
+            elif self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in '[{':
+                self.depth += 1
+                if char == '{' and self.depth == self.array_depth + 1:
+                    self.object_start = self.position
+            elif char in ']}':
+                if char == '}' and self.depth == self.array_depth + 1 and self.object_start is not None:
+                    try:
+                        completed.append(json.loads(self.buffer[self.object_start:self.position + 1]))
+                    except json.JSONDecodeError:
+                        pass
+                    self.object_start = None
+                elif char == ']' and self.depth == self.array_depth:
+                    self.finished = True
+                self.depth -= 1
+
+            self.position += 1
+
+        # Drop text that can no longer be part of an object
+        keep_from = self.object_start if self.object_start is not None else self.position
+        self.buffer = self.buffer[keep_from:]
+        self.position -= keep_from
+        if self.object_start is not None:
+            self.object_start = 0
+
+        return completed
+
+
+def is_valid_ai_recommendation(rec):
+    """Check that a parsed recommendation has the fields the playlist builders rely on."""
+    if not isinstance(rec, dict):
+        return False
+    if rec.get('type') == 'artist':
+        return isinstance(rec.get('name'), str) and bool(rec['name'].strip())
+    return rec.get('type') == 'direction'
+
+
+# --- AI Provider Statistics ---
+
+_ai_stats = None
+_ai_stats_lock = threading.Lock()
+
+
+def get_ai_stats():
+    """Return per-provider latency and failure statistics, loaded once per process."""
+    global _ai_stats
+    if _ai_stats is None:
+        _ai_stats = load_json_state(AI_STATS_FILE, {})
+    return _ai_stats
+
+
+def record_ai_result(provider, latency, success):
+    """Record one request outcome so the hedge threshold follows each provider's time to first recommendation."""
+    with _ai_stats_lock:
+        stats = get_ai_stats().setdefault(provider.name, {"latencies": [], "outcomes": []})
+        if success:
+            stats["latencies"] = (stats["latencies"] + [round(latency, 2)])[-50:]
+        stats["outcomes"] = (stats["outcomes"] + [1 if success else 0])[-20:]
+        save_json_state(AI_STATS_FILE, get_ai_stats())
+
+
+def get_hedge_delay(provider):
+    """Seconds to wait for a provider's first recommendation before hedging, or zero if it mostly fails."""
+    with _ai_stats_lock:
+        stats = get_ai_stats().get(provider.name, {})
+        latencies = sorted(stats.get("latencies", []))
+        outcomes = stats.get("outcomes", [])
+
+    if len(outcomes) >= 5 and sum(outcomes) / len(outcomes) < 0.5:
+        return 0.0
+    if len(latencies) < 5:
+        return AI_HEDGE_DEFAULT_SECONDS
 
-        ai_response = None
+    index = max(0, math.ceil(AI_HEDGE_PERCENTILE / 100 * len(latencies)) - 1)
+    return latencies[index]
 
-        # Try OpenAI first
-        if AI_PROVIDER == "openai" and OPENAI_API_KEY and openai:
+
+def _stream_provider_recommendations(provider, prompt, options, results, cancelled):
+    """Worker: stream one provider's completion and put each valid recommendation on the results queue."""
+    start_ai_time = time.time()
+    first_item_time = None
+    try:
+        parser = StreamingJSONArrayParser()
+        chunks = provider.stream(prompt, schema=AI_RECOMMENDATION_SCHEMA, **options)
+        try:
+            for chunk in chunks:
+                if cancelled.is_set():
+                    break
+                for rec in parser.feed(chunk):
+                    if not is_valid_ai_recommendation(rec):
+                        continue
+                    if first_item_time is None:
+                        first_item_time = time.time() - start_ai_time
+                        record_ai_result(provider, first_item_time, True)
+                        get_circuit_breaker(f"ai-{provider.name}").record_success()
+                    results.put((provider, rec))
+        finally:
+            chunks.close()
+    except Exception as e:
+        if not cancelled.is_set():
+            log_message(f"{provider.label} error: {e}", 'yellow')
+            if first_item_time is None and is_upstream_failure(e):
+                get_circuit_breaker(f"ai-{provider.name}").record_failure(e)
+    finally:
+        record_api_call("ai", provider.name, start_ai_time,
+                        "ok" if first_item_time is not None else "cancelled" if cancelled.is_set() else "error")
+        if first_item_time is not None:
+            metrics.observe("ai_first_item_seconds", first_item_time, provider=provider.name)
+        if first_item_time is None and not cancelled.is_set():
+            record_ai_result(provider, time.time() - start_ai_time, False)
+            log_message(f"{provider.label} returned no usable recommendations after {time.time() - start_ai_time:.1f} seconds", 'yellow')
+        results.put((provider, None))
+
+
+def stream_ai_recommendations(prompt, purpose, temperature=None, max_tokens=None):
+    """
+    Yield validated recommendation dicts as soon as each one has streamed in.
+
+    Providers are tried one after another, or raced with AI_HEDGE where the fallback is
+    started once the primary exceeds its recorded time-to-first-recommendation percentile.
+    The first provider to produce a valid recommendation wins and the others are cancelled.
+    Providers whose circuit breaker is open are left out until it half-opens. The whole
+    stream is capped at the request timeout, since the SDK timeouts only bound each read.
+    """
+    providers = [provider for provider in get_ai_providers()
+                 if not get_circuit_breaker(f"ai-{provider.name}").is_open()]
+    if not providers:
+        return
+
+    # A provider request may use the AI deadline, or whatever is left of the run if that's less
+    try:
+        timeout = get_run_deadline().timeout(AI_DEADLINE_SECONDS)
+    except DeadlineExceeded:
+        log_message(f"No time left in this run, skipping {purpose}", 'yellow')
+        return
+
+    options = {'temperature': temperature, 'max_tokens': max_tokens, 'timeout': timeout}
+    hedging = AI_HEDGE and len(providers) > 1
+    results = queue.Queue()
+    cancel_events = {}
+    active = set()
+    winner = None
+    next_index = 0
+    received = 0
+    start_ai_time = time.time()
+    stream_deadline = start_ai_time + timeout
+
+    def launch():
+        nonlocal next_index
+        provider = providers[next_index]
+        next_index += 1
+        log_message(f"Using {provider.label} for {purpose}...", 'green')
+        cancel_events[provider] = threading.Event()
+        active.add(provider)
+        threading.Thread(target=_stream_provider_recommendations,
+                         args=(provider, prompt, options, results, cancel_events[provider]),
+                         name=f"ai-{provider.name}", daemon=True).start()
+        return time.time() + get_hedge_delay(provider)
+
+    try:
+        hedge_at = launch()
+        while active:
+            can_hedge = hedging and winner is None and next_index < len(providers)
+            wait_until = min(hedge_at, stream_deadline) if can_hedge else stream_deadline
             try:
-                openai.api_key = OPENAI_API_KEY
-                log_message("Using GPT-5-mini for artist recommendations...")
-                response = openai.chat.completions.create(
-                    model="gpt-5-mini",
-                    messages=[{"role": "user", "content": prompt}]
-                    # Note: GPT-5 models don't support temperature/top_p/max_tokens parameters
-                    # They use default settings only
-                )
-                ai_response = response.choices[0].message.content
-                log_message("Received AI artist recommendations from GPT-5-mini", 'green')
-            except Exception as e:
-                log_message(f"OpenAI error: {e}", 'yellow')
+                provider, rec = results.get(timeout=max(0, wait_until - time.time()))
+            except queue.Empty:
+                if time.time() >= stream_deadline:
+                    log_message(f"Stopping {purpose} after {timeout:.0f} seconds", 'yellow')
+                    break
+                log_message(f"{providers[next_index - 1].label} is slower than usual, hedging with {providers[next_index].label}...", 'yellow')
+                hedge_at = launch()
+                continue
+
+            if rec is None:
+                active.discard(provider)
+                if provider is winner:
+                    break
+                # Nothing usable from this provider yet, so move on without waiting for the hedge threshold
+                if winner is None and next_index < len(providers) and (hedging or not active):
+                    hedge_at = launch()
+                continue
+
+            if winner is None:
+                winner = provider
+                for other in active - {provider}:
+                    log_message(f"Cancelling slower {other.label} request", 'yellow')
+                    cancel_events[other].set()
+                log_message(f"Streaming {purpose} from {provider.label} (first result after {time.time() - start_ai_time:.1f} seconds)", 'green')
+
+            if provider is winner:
+                received += 1
+                yield rec
+    finally:
+        for cancelled in cancel_events.values():
+            cancelled.set()
+
+    if winner:
+        log_message(f"Received {received} {purpose} from {winner.label} in {time.time() - start_ai_time:.1f} seconds", 'green')
+
+
+# --- Taste Profile ---
 
-        # Fallback to Gemini
-        if not ai_response and GEMINI_API_KEY and genai:
+def load_taste_profile():
+    """Load the persisted taste profile with every field present."""
+    profile = load_json_state(TASTE_PROFILE_FILE, {})
+    profile.setdefault("loved", {})
+    profile.setdefault("artists", {})
+    profile.setdefault("artist_tags", {})
+    profile.setdefault("recent_affinity", {})
+    profile.setdefault("track_plays", {})
+    profile.setdefault("artist_plays", {})
+    profile.setdefault("artist_plays_seeded", False)
+    profile.setdefault("last_scrobble", 0)
+    return profile
+
+
+def update_taste_profile(network, loved_tracks_list):
+    """
+    Bring the persisted taste profile up to date and return it.
+
+    Only loved tracks added or removed since the last run and scrobbles newer than the
+    last seen one are applied, and the derived lists used for prompts are refreshed so
+    building a prompt never has to scan the collection. An artist's weight is its loved
+    tracks plus its plays: all-time playcounts fetched once, then counted from scrobbles.
+    """
+    profile = load_taste_profile()
+    loved = profile["loved"]
+    artists = profile["artists"]
+
+    def adjust_artist(track_data, sign):
+        artist_key = track_data["artist"].lower()
+        entry = artists.setdefault(artist_key, {"name": track_data["artist"], "weight": 0, "loved": 0})
+        entry["loved"] += sign
+        if entry["loved"] <= 0:
+            del artists[artist_key]
+
+    # 1. Loved tracks: apply only the difference against the stored collection
+    current = {}
+    for item in loved_tracks_list:
+        track = item.track
+        current[f"{track.title.lower()}|{track.artist.name.lower()}"] = {
+            "title": track.title,
+            "artist": track.artist.name,
+            "playcount": getattr(track, 'playcount', 0) or 0,
+            "loved_at": int(getattr(item, 'timestamp', 0) or 0)
+        }
+
+    removed_keys = [key for key in loved if key not in current]
+    added_keys = [key for key in current if key not in loved]
+    for key in removed_keys:
+        adjust_artist(loved.pop(key), -1)
+    for key in added_keys:
+        loved[key] = current[key]
+        adjust_artist(loved[key], 1)
+
+    # 2. Scrobbles: decay the previous affinity and add plays since the last seen scrobble
+    now = time.time()
+    last_updated = profile.get("updated_at", now)
+    decay = 0.5 ** ((now - last_updated) / (TASTE_AFFINITY_HALF_LIFE_DAYS * 86400))
+    affinity = {}
+    for artist_key, entry in profile["recent_affinity"].items():
+        if entry["score"] * decay >= 0.05:
+            affinity[artist_key] = {"name": entry["name"], "score": entry["score"] * decay}
+
+    artist_plays = profile["artist_plays"]
+    new_scrobbles = 0
+    try:
+        user = network.get_user(LASTFM_USERNAME)
+        # Loved-track objects carry no user playcount, so artist plays start from the all-time top artists
+        count_artist_plays = profile["artist_plays_seeded"]
+        if not count_artist_plays:
             try:
-                genai.configure(api_key=GEMINI_API_KEY)
-                log_message("Using Gemini for artist recommendations...")
-                model = genai.GenerativeModel('gemini-1.5-flash')
-                response = model.generate_content(prompt)
-                ai_response = response.text
-                log_message("Received AI artist recommendations from Gemini", 'green')
+                for top_item in user.get_top_artists(period=pylast.PERIOD_OVERALL, limit=1000):
+                    artist_plays[top_item.item.name.lower()] = int(top_item.weight)
+                profile["artist_plays_seeded"] = True
             except Exception as e:
-                log_message(f"Gemini error: {e}", 'yellow')
+                log_message(f"Could not fetch top artist playcounts for taste profile: {e}", 'yellow')
+        time_from = profile["last_scrobble"] + 1 if profile["last_scrobble"] else int(now) - 7 * 86400
+        for played in user.get_recent_tracks(limit=500, time_from=time_from):
+            artist_name = played.track.artist.name
+            entry = affinity.setdefault(artist_name.lower(), {"name": artist_name, "score": 0})
+            entry["score"] += 1
+            # Plays are counted from scrobbles as they arrive; a fresh playcount seed already includes them
+            if count_artist_plays:
+                artist_plays[artist_name.lower()] = artist_plays.get(artist_name.lower(), 0) + 1
+            track_key = f"{played.track.title.lower()}|{artist_name.lower()}"
+            profile["track_plays"][track_key] = profile["track_plays"].get(track_key, 0) + 1
+            profile["last_scrobble"] = max(profile["last_scrobble"], int(getattr(played, 'timestamp', 0) or 0))
+            new_scrobbles += 1
+    except Exception as e:
+        log_message(f"Could not sync recent scrobbles for taste profile: {e}", 'yellow')
+    profile["recent_affinity"] = affinity
+    for artist_key, entry in artists.items():
+        entry["weight"] = entry["loved"] + artist_plays.get(artist_key, 0)
+
+    # 3. Tags: fill in a few missing top artists per run so the distribution converges over time
+    top_entries = sorted(artists.values(), key=lambda e: (-e["weight"], e["name"].lower()))[:100]
+    tags_fetched = 0
+    for entry in top_entries:
+        if tags_fetched >= TASTE_TAGS_PER_RUN:
+            break
+        if entry["name"].lower() in profile["artist_tags"]:
+            continue
+        try:
+            tags = network.get_artist(entry["name"]).get_top_tags(limit=3)
+            profile["artist_tags"][entry["name"].lower()] = [tag.item.name.lower() for tag in tags]
+        except Exception:
+            profile["artist_tags"][entry["name"].lower()] = []
+        tags_fetched += 1
+
+    # Derived lists, precomputed so prompt construction is a slice
+    profile["top_artists"] = [entry["name"] for entry in top_entries]
+
+    tag_weights = Counter()
+    for entry in top_entries:
+        for tag in profile["artist_tags"].get(entry["name"].lower(), []):
+            tag_weights[tag] += entry["weight"]
+    total_tag_weight = sum(tag_weights.values()) or 1
+    profile["top_tags"] = [[tag, round(weight / total_tag_weight, 3)] for tag, weight in tag_weights.most_common(20)]
+
+    # Recent-affinity delta: share of recent plays minus share of the long-term weight
+    total_affinity = sum(entry["score"] for entry in affinity.values()) or 1
+    total_weight = sum(entry["weight"] for entry in artists.values()) or 1
+    deltas = []
+    for artist_key, entry in affinity.items():
+        delta = entry["score"] / total_affinity - artists.get(artist_key, {}).get("weight", 0) / total_weight
+        if delta > 0:
+            deltas.append([entry["name"], round(delta, 4), round(entry["score"], 2)])
+    deltas.sort(key=lambda d: (-d[1], d[0].lower()))
+    profile["rising_artists"] = deltas[:20]
+
+    # One representative loved track per top artist, preferring the most recently loved
+    best_track = {}
+    for track_data in loved.values():
+        artist_key = track_data["artist"].lower()
+        if artist_key not in best_track or track_data["loved_at"] > best_track[artist_key]["loved_at"]:
+            best_track[artist_key] = track_data
+    profile["sample_tracks"] = [
+        f"{best_track[e['name'].lower()]['title']} by {e['name']}"
+        for e in top_entries[:40] if e["name"].lower() in best_track
+    ]
 
-        if not ai_response:
-            log_message("No AI available, skipping AI recommendations", 'yellow')
+    profile["updated_at"] = now
+    save_json_state(TASTE_PROFILE_FILE, profile)
+    log_message(f"Taste profile updated: +{len(added_keys)}/-{len(removed_keys)} loved tracks, {new_scrobbles} new scrobbles, "
+                f"{tags_fetched} artists tagged ({len(artists)} artists total)", 'green')
+    return profile
+
+
+def format_taste_profile(profile, token_budget=None):
+    """Render the taste profile as prompt lines, fitting each section into its share of the token budget."""
+    token_budget = token_budget or AI_PROMPT_TOKEN_BUDGET
+    sections = [
+        ("Favorite artists (most played first)", profile.get("top_artists", []), 0.35),
+        ("Listening a lot lately", [d[0] for d in profile.get("rising_artists", [])], 0.15),
+        ("Tag distribution", [f"{tag} {share:.0%}" for tag, share in profile.get("top_tags", [])], 0.15),
+        ("Representative loved tracks", profile.get("sample_tracks", []), 0.35),
+    ]
+
+    lines = []
+    for label, values, share in sections:
+        # Roughly four characters per token
+        char_budget = int(token_budget * share * 4)
+        picked = []
+        used_chars = len(label) + 4
+        for value in values:
+            if used_chars + len(value) + 2 > char_budget:
+                break
+            picked.append(value)
+            used_chars += len(value) + 2
+        if picked:
+            lines.append(f"- {label}: {', '.join(picked)}")
+    return "\n".join(lines)
+
+
+# --- AI Recommendation Cache ---
+
+def get_taste_fingerprint(profile):
+    """Hash the user's top artists and recent-affinity buckets into a stable cache key."""
+    top_artists = [name.lower() for name in profile.get("top_artists", [])[:25]]
+
+    # Recent affinity on a log scale, so a handful of extra plays doesn't bust the cache
+    recent_buckets = sorted(f"{name.lower()}:{int(math.log2(1 + score))}"
+                            for name, delta, score in profile.get("rising_artists", [])[:10])
+
+    fingerprint_source = "|".join(top_artists) + "#" + "|".join(recent_buckets)
+    return hashlib.sha1(fingerprint_source.encode('utf-8')).hexdigest()
+
+
+def load_ai_cache():
+    """Load cached AI recommendations, dropping entries older than the TTL."""
+    cache = load_json_state(AI_CACHE_FILE, {})
+    cache.setdefault("entries", {})
+    cache.setdefault("recommended", {})
+
+    now = datetime.now()
+    cache["entries"] = {
+        fingerprint: entry for fingerprint, entry in cache["entries"].items()
+        if (now - datetime.fromisoformat(entry["created"])).total_seconds() < AI_CACHE_TTL_HOURS * 3600
+    }
+    # Remember served artists for a month so discovery keeps rotating across taste changes
+    cache["recommended"] = {
+        artist: served for artist, served in cache["recommended"].items()
+        if (now - datetime.fromisoformat(served)).days < 30
+    }
+    return cache
+
+
+def serve_cached_ai_artists(cache, artists, num_artists):
+    """Pick artists, never-served ones first, and mark them as served."""
+    unused = [a for a in artists if a.lower() not in cache["recommended"]]
+    used = sorted((a for a in artists if a.lower() in cache["recommended"]),
+                  key=lambda a: cache["recommended"][a.lower()])
+    served = (unused + used)[:num_artists]
+
+    current_time = datetime.now().isoformat()
+    for artist in served:
+        cache["recommended"][artist.lower()] = current_time
+    return served
+
+
+def get_ai_artist_recommendations(network, loved_tracks_list, num_artists=10, allow_request=True):
+    """
+    Get AI-powered artist recommendations using GPT-5-mini or Gemini.
+
+    With allow_request=False only cached recommendations are used, for runs short on time.
+    """
+    try:
+        log_message("Getting AI-powered artist recommendations...", 'green')
+
+        profile = update_taste_profile(network, loved_tracks_list)
+
+        # Serve from the taste-fingerprint cache while it still has unused artists
+        ai_cache = load_ai_cache()
+        fingerprint = get_taste_fingerprint(profile)
+        cached_entry = ai_cache["entries"].get(fingerprint)
+        if cached_entry:
+            unused_count = len([a for a in cached_entry["artists"] if a.lower() not in ai_cache["recommended"]])
+            if unused_count >= num_artists:
+                metrics.count("cache_lookups_total", cache="ai_recommendations", endpoint="artists", result="hit")
+                ai_artists = serve_cached_ai_artists(ai_cache, cached_entry["artists"], num_artists)
+                save_json_state(AI_CACHE_FILE, ai_cache)
+                log_message(f"Using {len(ai_artists)} cached AI artist recommendations ({unused_count - len(ai_artists)} unused left for this taste profile)", 'green')
+                return ai_artists
+
+        metrics.count("cache_lookups_total", cache="ai_recommendations", endpoint="artists", result="miss")
+        if not allow_request:
+            if cached_entry:
+                log_message("Short on time, reusing cached AI recommendations for this taste profile", 'yellow')
+                ai_artists = serve_cached_ai_artists(ai_cache, cached_entry["artists"], num_artists)
+                save_json_state(AI_CACHE_FILE, ai_cache)
+                return ai_artists
+            log_message("Short on time, skipping AI recommendations", 'yellow')
             return []
 
-        # Parse JSON response
-        import json
-        import re
-        json_match = re.search(r'\[.*?\]', ai_response, re.DOTALL)
-        if json_match:
-            try:
-                recommendations_data = json.loads(json_match.group())
-                ai_artists = []
-                for rec in recommendations_data:
-                    if isinstance(rec, dict) and rec.get('type') == 'artist' and 'name' in rec:
-                        ai_artists.append(rec['name'])
-                        log_message(f"AI recommends: {rec['name']} - {rec.get('reason', '')[:50]}...", 'yellow')
+        prompt = f"""You are an AI music curator. Analyze this user's music taste and recommend {num_artists} NEW artists they would love.
+
+User's Music Profile:
+{format_taste_profile(profile)}
+
+Return ONLY a JSON object with the artist recommendations in this exact format:
+{{"recommendations": [
+  {{"type": "artist", "name": "Artist Name", "reason": "Brief reason"}},
+  ...
+]}}
+
+Focus on artists similar to their taste but NOT in their current collection."""
+
+        previously_recommended = sorted(ai_cache["recommended"], key=ai_cache["recommended"].get, reverse=True)[:50]
+        if previously_recommended:
+            prompt += f"\nAlso avoid these artists that were already recommended recently: {', '.join(previously_recommended)}"
+
+        ai_artists = []
+        for rec in stream_ai_recommendations(prompt, "AI artist recommendations"):
+            if rec['type'] == 'artist':
+                ai_artists.append(rec['name'])
+                log_message(f"AI recommends: {rec['name']} - {rec.get('reason', '')[:50]}...", 'yellow')
+
+        if not ai_artists:
+            if cached_entry:
+                log_message("No AI available, reusing cached AI recommendations for this taste profile", 'yellow')
+                ai_artists = serve_cached_ai_artists(ai_cache, cached_entry["artists"], num_artists)
+                save_json_state(AI_CACHE_FILE, ai_cache)
                 return ai_artists
-            except json.JSONDecodeError as e:
-                log_message(f"Failed to parse AI response: {e}", 'yellow')
-                return []
+            log_message("No AI available, skipping AI recommendations", 'yellow')
+            return []
 
-        return []
+        # Merge into the cache entry for this taste profile and serve unused artists first
+        cached_artists = cached_entry["artists"] if cached_entry else []
+        known = set(a.lower() for a in cached_artists)
+        merged_artists = cached_artists + [a for a in ai_artists if a.lower() not in known]
+        ai_cache["entries"][fingerprint] = {
+            "created": cached_entry["created"] if cached_entry else datetime.now().isoformat(),
+            "artists": merged_artists
+        }
+        ai_artists = serve_cached_ai_artists(ai_cache, merged_artists, num_artists)
+        save_json_state(AI_CACHE_FILE, ai_cache)
+        return ai_artists
 
     except Exception as e:
         log_message(f"Error getting AI recommendations: {e}", 'yellow')
@@ -1419,6 +3121,255 @@ def get_recent_seed_track(sp, network):
         return None
 
 
+# --- Filter Chain ---
+
+# Relative predicate costs: in-memory checks, lookups in local state files, remote API calls
+FILTER_COST_LOCAL = 1
+FILTER_COST_CACHED = 10
+FILTER_COST_NETWORK = 100
+
+
+class FilterChain:
+    """
+    Candidate filters that run cheapest first, so network checks only see survivors.
+
+    Each predicate takes a candidate and returns True to keep it. Predicates declare
+    a relative cost and their selectivity (expected share of candidates rejected);
+    they run in cost order, the more selective one first within the same cost.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.predicates = []
+        self.checked = 0
+        self.rejections = Counter()
+
+    def add(self, name, predicate, cost=FILTER_COST_LOCAL, selectivity=0.5):
+        self.predicates.append((cost, -selectivity, len(self.predicates), name, predicate))
+        self.predicates.sort(key=lambda entry: entry[:3])
+        return self
+
+    def passes(self, candidate):
+        self.checked += 1
+        for _, _, _, name, predicate in self.predicates:
+            if not predicate(candidate):
+                self.rejections[name] += 1
+                metrics.count("filter_rejections_total", chain=self.name, filter=name)
+                return False
+        metrics.count("filter_passed_total", chain=self.name)
+        return True
+
+    def log_summary(self):
+        if not self.checked:
+            return
+        rejected = ", ".join(f"{name}: {self.rejections[name]}" for _, _, _, name, _ in self.predicates if self.rejections[name])
+        passed = self.checked - sum(self.rejections.values())
+        log_message(f"Filters for {self.name}: {passed}/{self.checked} candidates passed" + (f" (rejected by {rejected})" if rejected else ""), 'yellow')
+
+
+# --- Artist Validation ---
+
+def load_artist_cache():
+    """Load cached Last.fm artist info, dropping entries older than the TTL."""
+    cache = load_json_state(ARTIST_CACHE_FILE, {})
+    now = datetime.now()
+    return {
+        artist_key: info for artist_key, info in cache.items()
+        if (now - datetime.fromisoformat(info["fetched"])).days < ARTIST_CACHE_TTL_DAYS
+    }
+
+
+# Rejection index shared by every quality gate: which gate rejected which artist or track, and when
+_rejections = None
+_rejections_lock = threading.Lock()
+
+
+def get_rejections():
+    """Load the rejection index once per run, forgetting rejections that are due for a re-check."""
+    global _rejections
+    with _rejections_lock:
+        if _rejections is None:
+            rejections = load_json_state(REJECTIONS_FILE, {})
+            now = datetime.now()
+            _rejections = {
+                kind: {
+                    key: entry for key, entry in rejections.get(kind, {}).items()
+                    if (now - datetime.fromisoformat(entry["rejected_at"])).days < REJECTION_RECHECK_DAYS
+                }
+                for kind in ("artists", "tracks")
+            }
+        return _rejections
+
+
+def get_rejection(artist_name, track_title=None):
+    """Return the rejection entry for an artist, or for a track when a title is given, else None."""
+    rejections = get_rejections()
+    if track_title is None:
+        entry = rejections["artists"].get(artist_name.lower())
+    else:
+        entry = rejections["tracks"].get(f"{track_title.lower()}|{artist_name.lower()}")
+
+    # Long-running processes keep the index in memory, so expiry is checked on lookup too
+    if entry and (datetime.now() - datetime.fromisoformat(entry["rejected_at"])).days < REJECTION_RECHECK_DAYS:
+        return entry
+    return None
+
+
+def reject_artist(artist_name, gate, value=None):
+    """Record which gate rejected an artist so later runs skip it without any network calls."""
+    rejections = get_rejections()
+    with _rejections_lock:
+        rejections["artists"][artist_name.lower()] = {
+            "name": artist_name,
+            "gate": gate,
+            "value": value,
+            "rejected_at": datetime.now().isoformat()
+        }
+
+
+def reject_track(track_title, artist_name, gate, value=None):
+    """Record which gate rejected a track so later runs skip it without any network calls."""
+    rejections = get_rejections()
+    with _rejections_lock:
+        rejections["tracks"][f"{track_title.lower()}|{artist_name.lower()}"] = {
+            "title": track_title,
+            "artist": artist_name,
+            "gate": gate,
+            "value": value,
+            "rejected_at": datetime.now().isoformat()
+        }
+
+
+def save_rejections():
+    """Persist the rejection index if it was loaded during this run."""
+    with _rejections_lock:
+        if _rejections is not None:
+            save_json_state(REJECTIONS_FILE, _rejections)
+
+
+def describe_rejection(entry):
+    """Format a rejection entry for logging, e.g. 'min_listeners: 4200'."""
+    return f"{entry['gate']}: {entry['value']}" if entry.get("value") is not None else entry["gate"]
+
+
+def check_artist_listeners(artist_name, get_listeners, min_listeners=None):
+    """
+    Apply the listener-count gate to an artist, consulting the rejection index first.
+
+    get_listeners is only called when the artist isn't already rejected, so known
+    obscure artists cost no network calls. Returns True if the artist may be used.
+    """
+    min_listeners = MIN_ARTIST_LISTENERS if min_listeners is None else min_listeners
+    if get_rejection(artist_name):
+        return False
+
+    try:
+        listeners = get_listeners()
+        if listeners and int(listeners) < min_listeners:
+            log_message(f"Skipping obscure artist: {artist_name} ({int(listeners):,} listeners)", 'yellow')
+            reject_artist(artist_name, "min_listeners", int(listeners))
+            return False
+    except Exception:
+        # If we can't get listener count, proceed anyway (don't be too strict)
+        pass
+    return True
+
+
+def get_artist_listeners(network, artist_name, artist_cache):
+    """Return the Last.fm listener count for an artist, using the artist-info cache when fresh."""
+    artist_key = artist_name.lower()
+    info = artist_cache.get(artist_key)
+    if info and info.get("listeners") is not None:
+        metrics.count("cache_lookups_total", cache="artist_info", endpoint="listeners", result="hit")
+        return info["listeners"]
+
+    metrics.count("cache_lookups_total", cache="artist_info", endpoint="listeners", result="miss")
+
+    listeners = int(lastfm_listener_count(network, artist_name) or 0)
+    artist_cache.setdefault(artist_key, {"name": artist_name, "fetched": datetime.now().isoformat()})["listeners"] = listeners
+    return listeners
+
+
+def get_artist_top_tracks(network, artist_name, artist_cache, limit=5):
+    """Return [(title, artist), ...] top tracks for an artist, using the artist-info cache when fresh."""
+    artist_key = artist_name.lower()
+    info = artist_cache.get(artist_key)
+    if info and info.get("top_tracks") is not None:
+        metrics.count("cache_lookups_total", cache="artist_info", endpoint="top_tracks", result="hit")
+        return [tuple(track) for track in info["top_tracks"][:limit]]
+
+    metrics.count("cache_lookups_total", cache="artist_info", endpoint="top_tracks", result="miss")
+
+    top_tracks = [(item.item.title, item.item.artist.name)
+                  for item in lastfm_top_tracks(network, artist_name, limit)]
+    artist_cache.setdefault(artist_key, {"name": artist_name, "fetched": datetime.now().isoformat()})["top_tracks"] = top_tracks
+    return top_tracks
+
+
+def validate_artists(network, artist_names, min_listeners=None):
+    """
+    Check a batch of artists concurrently and return [(artist_name, top_tracks), ...] for those that pass.
+
+    Artists in the rejection index are dropped before any network call, newly failing
+    artists are added to it with the gate, and only passing artists get their
+    top tracks looked up.
+    """
+    min_listeners = MIN_ARTIST_LISTENERS if min_listeners is None else min_listeners
+    artist_cache = load_artist_cache()
+
+    candidates = []
+    denied = 0
+    seen = set()
+    for artist_name in artist_names:
+        artist_key = artist_name.lower()
+        if artist_key in seen:
+            continue
+        seen.add(artist_key)
+        rejection = get_rejection(artist_name)
+        if rejection:
+            log_message(f"Skipping previously rejected artist: {artist_name} ({describe_rejection(rejection)})", 'yellow')
+            denied += 1
+            continue
+        candidates.append(artist_name)
+
+    def check_listeners(artist_name):
+        try:
+            return get_artist_listeners(network, artist_name, artist_cache), None
+        except pylast.WSError as e:
+            # Status 6: the artist doesn't exist on Last.fm, which is a verdict rather than an outage
+            return None, "not_found" if str(getattr(e, 'status', '')) == "6" else None
+        except Exception:
+            return None, None
+
+    passed = []
+    with ThreadPoolExecutor(max_workers=ARTIST_VALIDATION_WORKERS, thread_name_prefix="validate") as executor:
+        for artist_name, (listeners, failure) in zip(candidates, executor.map(check_listeners, candidates)):
+            if failure:
+                reject_artist(artist_name, failure)
+            elif listeners is not None and listeners < min_listeners:
+                log_message(f"Skipping obscure artist: {artist_name} ({listeners:,} listeners)", 'yellow')
+                reject_artist(artist_name, "min_listeners", listeners)
+            else:
+                # If we can't get listener count, proceed anyway (don't be too strict)
+                passed.append(artist_name)
+
+        def lookup_top_tracks(artist_name):
+            try:
+                return get_artist_top_tracks(network, artist_name, artist_cache)
+            except Exception:
+                return []
+
+        validated = [(artist_name, top_tracks)
+                     for artist_name, top_tracks in zip(passed, executor.map(lookup_top_tracks, passed))
+                     if top_tracks]
+
+    save_json_state(ARTIST_CACHE_FILE, artist_cache)
+    save_rejections()
+    log_message(f"Validated {len(artist_names)} artists: {len(validated)} passed, "
+                f"{denied} skipped from deny-cache, {len(candidates) - len(passed)} newly rejected", 'green')
+    return validated
+
+
 def get_sonic_station(sp, network, num_tracks=100):
     """
     Create a sonically cohesive playlist using Last.fm similar artists.
@@ -1476,98 +3427,93 @@ def get_sonic_station(sp, network, num_tracks=100):
 
         log_message(f"Building playlist from similar artists' top tracks...", 'yellow')
 
-        # Get tracks from similar artists
+        quality_filter = get_quality_filter()
+        listener_checks = {}
+
+        def passes_listener_gate(candidate):
+            # One listener lookup per artist, and none for artists already in the rejection index
+            artist_key = candidate['artist'].lower()
+            if artist_key not in listener_checks:
+                listener_checks[artist_key] = check_artist_listeners(candidate['artist'], candidate['listeners'])
+            return listener_checks[artist_key]
+
+        def passes_spotify_popularity(candidate):
+            try:
+                search_results = sp.search(
+                    q=f"track:{candidate['title']} artist:{candidate['artist']}",
+                    type="track",
+                    limit=1
+                )
+            except Exception:
+                return False
+            if not search_results["tracks"]["items"]:
+                return False
+
+            spotify_track = search_results["tracks"]["items"][0]
+            candidate['spotify_track'] = spotify_track
+
+            # Check Spotify popularity (0-100 scale, skip below MIN_TRACK_POPULARITY)
+            popularity = spotify_track.get('popularity', 0)
+            if popularity < MIN_TRACK_POPULARITY:
+                log_message(f"Skipping unpopular track: {candidate['title']} by {candidate['artist']} (popularity: {popularity})", 'yellow')
+                reject_track(candidate['title'], candidate['artist'], "min_popularity", popularity)
+                return False
+            return True
+
+        # Free local checks run first; Last.fm and Spotify are only asked about tracks that survive them
+        sonic_filters = FilterChain("sonic station")
+        sonic_filters.add("duplicate", lambda c: f"{c['title'].lower()}|{c['artist'].lower()}" not in used_track_keys, FILTER_COST_LOCAL, 0.05)
+        sonic_filters.add("banned", lambda c: not is_banned_item(c['title'], c['artist'], None, banned_items), FILTER_COST_LOCAL, 0.05)
+        sonic_filters.add("unsuitable", lambda c: is_track_suitable(c), FILTER_COST_LOCAL, 0.15)
+        # Skip Christmas songs, AI music indicators, etc.
+        sonic_filters.add("keywords", lambda c: not quality_filter.rejects(c['title'], rules=("skip",)), FILTER_COST_LOCAL, 0.05)
+        sonic_filters.add("cooldown", lambda c: not is_recently_used(c['title'], c['artist'], playlist_history), FILTER_COST_LOCAL, 0.2)
+        sonic_filters.add("rejected", lambda c: not get_rejection(c['artist'], c['title']), FILTER_COST_CACHED, 0.05)
+        sonic_filters.add("min_listeners", passes_listener_gate, FILTER_COST_NETWORK, 0.2)
+        sonic_filters.add("min_popularity", passes_spotify_popularity, FILTER_COST_NETWORK, 0.1)
+        if banned_items['genres']:
+            # Genre lookup needs the track and its artist from Spotify
+            sonic_filters.add("banned_genres", lambda c: not is_banned_item(
+                c['title'], c['artist'], None, banned_items, get_track_genres(sp, c['spotify_track']['uri'])),
+                FILTER_COST_NETWORK * 2, 0.05)
+
+        # Get tracks from similar artists, leaving time to resolve and publish
         for similar_artist in similar_artists:
             if len(final_tracks) >= num_tracks:
                 break
+            if not get_run_deadline().allows(PUBLISH_RESERVE_SECONDS * 2):
+                log_message("Running out of time, stopping sonic discovery early", 'yellow')
+                break
 
             artist_name = similar_artist.name
             artist_lower = artist_name.lower()
 
-            # Skip if already used
-            if artist_lower in used_artists:
+            # Skip if already used, or rejected as obscure on an earlier run
+            if artist_lower in used_artists or get_rejection(artist_name):
                 continue
 
-            # Filter out obscure/low-quality artists
-            try:
-                # Get Last.fm listener count
-                listeners = similar_artist.get_listener_count()
-                if listeners:
-                    listener_count = int(listeners)
-                    # Skip artists with very low listener counts (< 10,000 listeners)
-                    if listener_count < 10000:
-                        log_message(f"Skipping obscure artist: {artist_name} ({listener_count:,} listeners)", 'yellow')
-                        continue
-            except:
-                # If we can't get listener count, proceed anyway (don't be too strict)
-                pass
-
             try:
                 # Get top tracks for this artist
-                top_tracks = similar_artist.get_top_tracks(limit=5)
+                top_tracks = lastfm_top_tracks(network, artist_name)
 
                 for track_item in top_tracks:
-                    if len(final_tracks) >= num_tracks:
-                        break
-
-                    track = track_item.item
-                    track_title = track.title
-                    track_key = f"{track_title.lower()}|{artist_lower}"
-
-                    # Skip if already used, recently played, or banned
-                    if (track_key in used_track_keys or
-                        is_recently_used(track_title, artist_name, playlist_history) or
-                        is_banned_item(track_title, artist_name, None, banned_items)):
-                        continue
-
-                    if not is_track_suitable({'title': track_title, 'artist': artist_name}):
-                        continue
-
-                    # Additional quality filters for track titles
-                    title_lower = track_title.lower()
-                    # Skip Christmas songs, AI music indicators, etc.
-                    skip_keywords = ['christmas', 'xmas', 'ai generated', 'ai music',
-                                    'cover version', 'tribute', 'karaoke']
-                    if any(keyword in title_lower for keyword in skip_keywords):
+                    track_title = track_item.item.title
+                    candidate = {'title': track_title, 'artist': artist_name,
+                                 'listeners': lambda: lastfm_listener_count(network, artist_name)}
+                    if not sonic_filters.passes(candidate):
                         continue
 
-                    # Search on Spotify
-                    try:
-                        search_results = sp.search(
-                            q=f"track:{track_title} artist:{artist_name}",
-                            type="track",
-                            limit=1
-                        )
-
-                        if search_results["tracks"]["items"]:
-                            spotify_track = search_results["tracks"]["items"][0]
-
-                            # Check Spotify popularity (0-100 scale, skip < 15)
-                            popularity = spotify_track.get('popularity', 0)
-                            if popularity < 15:
-                                log_message(f"Skipping unpopular track: {track_title} by {artist_name} (popularity: {popularity})", 'yellow')
-                                continue
-
-                            # Check for banned genres
-                            if banned_items['genres']:
-                                track_genres = get_track_genres(sp, spotify_track['uri'])
-                                if is_banned_item(track_title, artist_name, None, banned_items, track_genres):
-                                    continue
-
-                            class SonicTrack:
-                                def __init__(self, title, artist_name):
-                                    self.title = title
-                                    self.artist = type('Artist', (), {'name': artist_name})()
-
-                            final_tracks.append(SonicTrack(track_title, artist_name))
-                            used_artists.add(artist_lower)
-                            used_track_keys.add(track_key)
+                    class SonicTrack:
+                        def __init__(self, title, artist_name):
+                            self.title = title
+                            self.artist = type('Artist', (), {'name': artist_name})()
 
-                            # Only one track per artist for variety
-                            break
+                    final_tracks.append(SonicTrack(track_title, artist_name))
+                    used_artists.add(artist_lower)
+                    used_track_keys.add(f"{track_title.lower()}|{artist_lower}")
 
-                    except Exception as e:
-                        continue
+                    # Only one track per artist for variety
+                    break
 
             except Exception as e:
                 log_message(f"Error getting tracks for {artist_name}: {e}", 'yellow')
@@ -1577,6 +3523,8 @@ def get_sonic_station(sp, network, num_tracks=100):
             if len(final_tracks) % 10 == 0 and len(final_tracks) > 0:
                 log_message(f"Progress: {len(final_tracks)}/{num_tracks} tracks...", 'yellow')
 
+        sonic_filters.log_summary()
+        save_rejections()
         log_message(f"Got {len(final_tracks)} tracks from similar artists", 'green')
 
         # If we don't have enough, fill from your loved tracks by similar artists
@@ -1663,7 +3611,7 @@ def get_sonic_station(sp, network, num_tracks=100):
         return get_apple_music_discovery_station(sp, network, num_tracks)
 
 
-def get_apple_music_discovery_station(sp, network, num_tracks=100):
+def get_apple_music_discovery_station(sp, network, num_tracks=100, exclude_artists=None):
     """
     Apple Music My Station with balanced familiarity and discovery.
 
@@ -1673,6 +3621,7 @@ def get_apple_music_discovery_station(sp, network, num_tracks=100):
     - 30% Last.fm Discovery (similar artists from Last.fm)
 
     Note: Fetches 2x tracks to account for duplicate artist filtering during playlist update.
+    exclude_artists skips artists already in the playlist, e.g. the tracks kept by a rotation run.
     """
     try:
         log_message("Creating Apple Music-style discovery station (50% favorites + 20% AI + 30% Last.fm)...", 'green')
@@ -1684,6 +3633,7 @@ def get_apple_music_discovery_station(sp, network, num_tracks=100):
         all_tracks = []
         used_track_keys = set()
         artist_track_count = Counter()  # Track how many songs per artist
+        excluded_artists = {artist.lower() for artist in exclude_artists or ()}
 
         def add_track(title, artist, source):
             """Helper to add track if not duplicate. Allows up to 2 tracks per artist for variety."""
@@ -1691,18 +3641,42 @@ def get_apple_music_discovery_station(sp, network, num_tracks=100):
             artist_key = artist.lower()
 
             # Allow up to 2 tracks per artist during discovery (will be filtered to 1 during playlist update)
-            if track_key not in used_track_keys and artist_track_count[artist_key] < 2:
+            if track_key not in used_track_keys and artist_key not in excluded_artists and artist_track_count[artist_key] < 2:
                 all_tracks.append({'title': title, 'artist': artist, 'source': source})
                 used_track_keys.add(track_key)
                 artist_track_count[artist_key] += 1
                 return True
             return False
 
+        quality_filter = get_quality_filter()
+        listener_checks = {}
+
+        def passes_listener_gate(candidate):
+            # One listener lookup per artist, and none for artists already validated or rejected
+            if candidate['listeners'] is None:
+                return True  # AI artists were validated in batch before their top tracks were fetched
+            artist_key = candidate['artist'].lower()
+            if artist_key not in listener_checks:
+                listener_checks[artist_key] = check_artist_listeners(candidate['artist'], candidate['listeners'])
+            return listener_checks[artist_key]
+
+        # Discovery candidates go through the free local checks before the Last.fm listener lookup;
+        # Spotify verification is skipped for speed and happens during playlist update
+        discovery_filters = FilterChain("discovery")
+        discovery_filters.add("banned", lambda c: not is_banned_item(c['title'], c['artist'], None, banned_items), FILTER_COST_LOCAL, 0.05)
+        discovery_filters.add("retained_artist", lambda c: c['artist'].lower() not in excluded_artists, FILTER_COST_LOCAL, 0.1)
+        # Quality filter: Skip Christmas, AI music, covers, etc.
+        discovery_filters.add("keywords", lambda c: not quality_filter.rejects(c['title'], rules=("skip",)), FILTER_COST_LOCAL, 0.05)
+        discovery_filters.add("rejected", lambda c: not get_rejection(c['artist'], c['title']), FILTER_COST_CACHED, 0.05)
+        discovery_filters.add("min_listeners", passes_listener_gate, FILTER_COST_NETWORK, 0.2)
+
         # Fetch 2x tracks to account for duplicate filtering
         # Target: 100 final tracks, so fetch 200 during discovery
         discovery_multiplier = 2
         target_discovery_tracks = num_tracks * discovery_multiplier
 
+        stage_started = time.time()
+
         # 1. YOUR FAVORITES (50%) - Loved tracks weighted by playcount
         favorites_target = int(target_discovery_tracks * 0.50)
         log_message(f"Selecting {favorites_target} favorites (weighted by playcount)...")
@@ -1727,6 +3701,23 @@ def get_apple_music_discovery_station(sp, network, num_tracks=100):
         random.shuffle(rest)
         loved_tracks_list = top_played + rest
 
+        # Start the AI request as soon as the loved sample exists so it overlaps the favorites and Last.fm phases;
+        # discovery stops while resolving and publishing still have PUBLISH_RESERVE_SECONDS each to spare
+        deadline = get_run_deadline()
+        discovery_reserve = PUBLISH_RESERVE_SECONDS * 2
+        # A daemon thread, so an abandoned AI request can't hold the process (and its run lock) open at exit
+        ai_future = Future()
+        ai_allowed = deadline.allows(AI_DEADLINE_SECONDS + discovery_reserve)
+
+        def run_ai_discovery():
+            try:
+                ai_future.set_result(get_ai_artist_recommendations(network, loved_tracks_list, 15, ai_allowed))
+            except BaseException as e:
+                ai_future.set_exception(e)
+
+        threading.Thread(target=run_ai_discovery, name="ai-discovery", daemon=True).start()
+        ai_started = time.time()
+
         for item in loved_tracks_list:
             if len([t for t in all_tracks if t['source'] == 'favorite']) >= favorites_target:
                 break
@@ -1738,59 +3729,9 @@ def get_apple_music_discovery_station(sp, network, num_tracks=100):
 
         log_message(f"Added {len([t for t in all_tracks if t['source'] == 'favorite'])} favorites")
 
-        # 2. AI DISCOVERY (20%) - NEW artists from GPT-5-mini/Gemini
-        ai_target = int(target_discovery_tracks * 0.20)
-        log_message(f"Getting {ai_target} AI-recommended tracks (will be filtered to ~{int(num_tracks * 0.20)})...")
-
-        # Get AI artist recommendations
-        ai_artists = get_ai_artist_recommendations(network, loved_tracks_list, num_artists=15)
-
-        if ai_artists:
-            ai_added = 0
-            for artist_name in ai_artists:
-                if ai_added >= ai_target:
-                    break
-
-                try:
-                    # Get top tracks from AI-recommended artist
-                    artist = network.get_artist(artist_name)
-
-                    # Quality filter: Check Last.fm listener count
-                    try:
-                        listeners = artist.get_listener_count()
-                        if listeners and int(listeners) < 10000:
-                            continue
-                    except:
-                        pass
-
-                    top_tracks = artist.get_top_tracks(limit=5)
-
-                    for track_item in top_tracks:
-                        if ai_added >= ai_target:
-                            break
-
-                        track = track_item.item
-                        track_title_lower = track.title.lower()
+        stage_started = metrics.lap("favorites", stage_started)
 
-                        # Quality filter: Skip Christmas, AI music, covers, etc.
-                        skip_keywords = ['christmas', 'xmas', 'ai generated', 'ai music',
-                                        'cover version', 'tribute', 'karaoke']
-                        if any(keyword in track_title_lower for keyword in skip_keywords):
-                            continue
-
-                        if not is_banned_item(track.title, track.artist.name, None, banned_items):
-                            # Skip Spotify verification for speed - will verify during playlist update
-                            if add_track(track.title, track.artist.name, 'ai_discovery'):
-                                ai_added += 1
-                                break  # Only one track per AI artist
-                except:
-                    continue
-
-            log_message(f"Added {ai_added} AI-recommended tracks")
-        else:
-            log_message("No AI recommendations available, will fill with Last.fm", 'yellow')
-
-        # 3. LAST.FM DISCOVERY (30%) - NEW tracks via similar artists
+        # 2. LAST.FM DISCOVERY (30%) - NEW tracks via similar artists, runs while the AI request is in flight
         lastfm_target = int(target_discovery_tracks * 0.30)
         log_message(f"Discovering {lastfm_target} NEW tracks via Last.fm similar artists (will be filtered to ~{int(num_tracks * 0.30)})...")
 
@@ -1799,93 +3740,114 @@ def get_apple_music_discovery_station(sp, network, num_tracks=100):
         for item in random.sample(loved_tracks_list, min(10, len(loved_tracks_list))):
             if lastfm_added >= lastfm_target:
                 break
+            if not deadline.allows(discovery_reserve):
+                log_message("Running out of time, stopping Last.fm discovery early", 'yellow')
+                break
 
             try:
-                artist = network.get_artist(item.track.artist.name)
-                similar = artist.get_similar(limit=10)  # Reduced from 20 to 10 for more conservative matching
+                similar = lastfm_similar_artists(network, item.track.artist.name, 10)  # Reduced from 20 to 10 for more conservative matching
 
                 for sim_artist in similar:
                     if lastfm_added >= lastfm_target:
                         break
 
-                    # Quality filter: Check Last.fm listener count
-                    try:
-                        listeners = sim_artist.item.get_listener_count()
-                        if listeners and int(listeners) < 10000:
-                            continue
-                    except:
-                        pass
+                    # Artists rejected as obscure on an earlier run cost no Last.fm calls
+                    if get_rejection(sim_artist.item.name):
+                        continue
 
-                    top_tracks = sim_artist.item.get_top_tracks(limit=5)
+                    sim_artist_name = sim_artist.item.name
+                    top_tracks = lastfm_top_tracks(network, sim_artist_name)
                     for track_item in top_tracks:
-                        if lastfm_added >= lastfm_target:
-                            break
-
                         track = track_item.item
-                        track_title_lower = track.title.lower()
-
-                        # Quality filter: Skip Christmas, AI music, covers, etc.
-                        skip_keywords = ['christmas', 'xmas', 'ai generated', 'ai music',
-                                        'cover version', 'tribute', 'karaoke']
-                        if any(keyword in track_title_lower for keyword in skip_keywords):
-                            continue
-
-                        if not is_banned_item(track.title, track.artist.name, None, banned_items):
-                            # Skip Spotify verification for speed - will verify during playlist update
-                            if add_track(track.title, track.artist.name, 'lastfm_discovery'):
-                                lastfm_added += 1
-                                break  # Only one track per similar artist
+                        candidate = {'title': track.title, 'artist': track.artist.name,
+                                     'listeners': lambda: lastfm_listener_count(network, sim_artist_name)}
+                        if discovery_filters.passes(candidate) and add_track(track.title, track.artist.name, 'lastfm_discovery'):
+                            lastfm_added += 1
+                            break  # Only one track per similar artist
             except:
                 continue
 
         log_message(f"Added {lastfm_added} discovery tracks from Last.fm similar artists")
 
+        stage_started = metrics.lap("lastfm_discovery", stage_started)
+
+        # 3. AI DISCOVERY (20%) - NEW artists from GPT-5-mini/Gemini, merged once the background request is done
+        ai_target = int(target_discovery_tracks * 0.20)
+        log_message(f"Getting {ai_target} AI-recommended tracks (will be filtered to ~{int(num_tracks * 0.20)})...")
+
+        ai_added = 0
+        ai_artists = []
+        try:
+            ai_artists = ai_future.result(timeout=max(0, min(AI_DEADLINE_SECONDS - (time.time() - ai_started),
+                                                             deadline.remaining() - discovery_reserve)))
+        except FutureTimeoutError:
+            log_message(f"AI recommendations missed the {AI_DEADLINE_SECONDS:.0f}s deadline, filling AI slots from Last.fm", 'yellow')
+        except Exception as e:
+            log_message(f"AI recommendations failed: {e}", 'yellow')
+
+        if ai_artists:
+            # Validate all AI artists at once; only those that pass reach top-track lookup
+            validated_artists = validate_artists(network, ai_artists)
+            listener_checks.update({artist_name.lower(): True for artist_name, _ in validated_artists})
+
+            for artist_name, top_tracks in validated_artists:
+                if ai_added >= ai_target:
+                    break
+
+                for track_title, track_artist in top_tracks:
+                    candidate = {'title': track_title, 'artist': track_artist, 'listeners': None}
+                    if discovery_filters.passes(candidate) and add_track(track_title, track_artist, 'ai_discovery'):
+                        ai_added += 1
+                        break  # Only one track per AI artist
+
+            log_message(f"Added {ai_added} AI-recommended tracks")
+        else:
+            log_message("No AI recommendations available, will fill with Last.fm", 'yellow')
+
+        stage_started = metrics.lap("ai_discovery", stage_started)
+
         # 3-5. Fill remaining with more discovery
         remaining = target_discovery_tracks - len(all_tracks)
         log_message(f"Filling {remaining} remaining slots with Last.fm similar artist discovery...")
 
-        # Use Last.fm similar artists for remaining slots (conservative matching)
-        for item in random.sample(loved_tracks_list, min(8, len(loved_tracks_list))):
+        # Use Last.fm similar artists for remaining slots (conservative matching),
+        # with more seeds when the AI share has to be covered by Last.fm too
+        fill_seed_count = 8 if ai_added else 14
+        for item in random.sample(loved_tracks_list, min(fill_seed_count, len(loved_tracks_list))):
             if len(all_tracks) >= target_discovery_tracks:
                 break
+            if not deadline.allows(discovery_reserve):
+                log_message("Running out of time, publishing the tracks discovered so far", 'yellow')
+                break
 
             try:
-                artist = network.get_artist(item.track.artist.name)
-                similar = artist.get_similar(limit=8)  # Reduced from 15 to 8 for closer matches
+                similar = lastfm_similar_artists(network, item.track.artist.name, 8)  # Reduced from 15 to 8 for closer matches
 
                 for sim_artist in similar:
                     if len(all_tracks) >= target_discovery_tracks:
                         break
 
-                    # Quality filter: Check Last.fm listener count
-                    try:
-                        listeners = sim_artist.item.get_listener_count()
-                        if listeners and int(listeners) < 10000:
-                            continue
-                    except:
-                        pass
+                    # Artists rejected as obscure on an earlier run cost no Last.fm calls
+                    if get_rejection(sim_artist.item.name):
+                        continue
 
-                    top_tracks = sim_artist.item.get_top_tracks(limit=5)
+                    sim_artist_name = sim_artist.item.name
+                    top_tracks = lastfm_top_tracks(network, sim_artist_name)
                     for track_item in top_tracks:
-                        if len(all_tracks) >= target_discovery_tracks:
-                            break
-
                         track = track_item.item
-                        track_title_lower = track.title.lower()
-
-                        # Quality filter: Skip Christmas, AI music, covers, etc.
-                        skip_keywords = ['christmas', 'xmas', 'ai generated', 'ai music',
-                                        'cover version', 'tribute', 'karaoke']
-                        if any(keyword in track_title_lower for keyword in skip_keywords):
-                            continue
-
-                        if not is_banned_item(track.title, track.artist.name, None, banned_items):
-                            # Skip Spotify verification for speed - will verify during playlist update
-                            if add_track(track.title, track.artist.name, 'discovery'):
-                                break  # Only one track per similar artist
+                        candidate = {'title': track.title, 'artist': track.artist.name,
+                                     'listeners': lambda: lastfm_listener_count(network, sim_artist_name)}
+                        if discovery_filters.passes(candidate) and add_track(track.title, track.artist.name, 'discovery'):
+                            break  # Only one track per similar artist
             except:
                 continue
 
+        metrics.lap("fill_discovery", stage_started)
+        for source, source_count in Counter(t['source'] for t in all_tracks).items():
+            metrics.count("station_tracks_total", source_count, source=source)
+
+        discovery_filters.log_summary()
+        save_rejections()
         log_message(f"Total tracks discovered: {len(all_tracks)} (target after filtering: ~{num_tracks})", 'green')
 
         # Convert to track objects
@@ -1908,6 +3870,128 @@ def get_apple_music_discovery_station(sp, network, num_tracks=100):
         return []
 
 
+class CachedTrack:
+    """A station track whose Spotify URI is already known, so publishing needs no search."""
+
+    def __init__(self, title, artist_name, uri):
+        self.title = title
+        self.artist = type('Artist', (), {'name': artist_name})()
+        self.uri = uri
+
+
+def get_offline_station(num_tracks=100, exclude_artists=None):
+    """
+    Build the station from local state only: no Last.fm, Spotify or AI calls.
+
+    Favorites come from the taste profile's loved-track store and discovery from the
+    similarity graph around loved artists, with the same bans, quality rules, rejections
+    and cooldown as the online station. Only tracks with a cached Spotify resolution
+    are used, so the result can be published without searching.
+    """
+    try:
+        log_message("Creating offline station from the loved-track store and similarity graph...", 'green')
+
+        profile = load_taste_profile()
+        playlist_history = load_playlist_history()
+        banned_items = load_banned_items()
+        quality_filter = get_quality_filter()
+        excluded_artists = {artist.lower() for artist in exclude_artists or ()}
+
+        offline_filters = FilterChain("offline")
+        offline_filters.add("banned", lambda c: not is_banned_item(c[0], c[1], None, banned_items), FILTER_COST_LOCAL, 0.05)
+        offline_filters.add("retained_artist", lambda c: c[1].lower() not in excluded_artists, FILTER_COST_LOCAL, 0.1)
+        offline_filters.add("keywords", lambda c: not quality_filter.rejects(c[0], rules=("skip",)), FILTER_COST_LOCAL, 0.05)
+        offline_filters.add("cooldown", lambda c: not is_recently_used(c[0], c[1], playlist_history), FILTER_COST_LOCAL, 0.2)
+        offline_filters.add("rejected", lambda c: not get_rejection(c[1], c[0]), FILTER_COST_CACHED, 0.05)
+        offline_filters.add("unresolved", lambda c: resolution_cache.get("tracks", f"{c[0].lower()}|{c[1].lower()}"), FILTER_COST_CACHED, 0.5)
+
+        all_tracks = []
+        used_track_keys = set()
+        artist_track_count = Counter()
+        target_tracks = num_tracks * 2
+
+        def add_track(title, artist):
+            track_key = f"{title.lower()}|{artist.lower()}"
+            if (track_key in used_track_keys or artist_track_count[artist.lower()] >= 2 or
+                    not offline_filters.passes((title, artist))):
+                return False
+            resolved = resolution_cache.get("tracks", track_key)
+            all_tracks.append(CachedTrack(title, artist, resolved["uri"]))
+            used_track_keys.add(track_key)
+            artist_track_count[artist.lower()] += 1
+            return True
+
+        # 1. Favorites: same 70/30 playcount split as the online station
+        loved = sorted(profile["loved"].values(), key=lambda t: t["playcount"], reverse=True)
+        top_played_count = int(len(loved) * 0.7)
+        top_played, rest = loved[:top_played_count], loved[top_played_count:]
+        random.shuffle(top_played)
+        random.shuffle(rest)
+
+        favorites_target = num_tracks
+        for track_data in top_played + rest:
+            if len(all_tracks) >= favorites_target:
+                break
+            add_track(track_data["title"], track_data["artist"])
+        favorites_added = len(all_tracks)
+
+        # 2. Discovery: one cached top track per similar artist of the loved artists
+        seed_artists = sorted({track_data["artist"].lower() for track_data in loved})
+        random.shuffle(seed_artists)
+        for seed_artist in seed_artists:
+            if len(all_tracks) >= target_tracks:
+                break
+            for similar_name in similarity_graph.get("similar", seed_artist) or []:
+                if len(all_tracks) >= target_tracks:
+                    break
+                if get_rejection(similar_name):
+                    continue
+                for title, artist in similarity_graph.get("top_tracks", similar_name.lower()) or []:
+                    if add_track(title, artist):
+                        break  # Only one track per similar artist
+
+        metrics.count("station_tracks_total", favorites_added, source="offline_favorite")
+        metrics.count("station_tracks_total", len(all_tracks) - favorites_added, source="offline_discovery")
+
+        offline_filters.log_summary()
+        log_message(f"Offline station: {favorites_added} favorites and {len(all_tracks) - favorites_added} discovery tracks "
+                    f"from local caches (target after filtering: ~{num_tracks})", 'green')
+
+        random.shuffle(all_tracks)
+        return all_tracks
+
+    except Exception as e:
+        log_message(f"Error building offline station: {e}", 'red')
+        return []
+
+
+def find_ai_artist_track(sp, network, artist_name, banned_items):
+    """Return (title, artist) of the first suitable top track by an AI-recommended artist that exists on Spotify."""
+    top_tracks = lastfm_top_tracks(network, artist_name)
+
+    for track_item in top_tracks:
+        track = track_item.item
+
+        # Skip various artists and live songs
+        if (get_quality_filter().rejects(track.title, track.artist.name, ("live", "various_artists")) or
+            is_banned_item(track.title, track.artist.name, None, banned_items)):
+            continue
+
+        # Verify the track exists on Spotify
+        try:
+            search_results = sp.search(
+                q=f"track:{track.title} artist:{track.artist.name}",
+                type="track",
+                limit=1
+            )
+            if search_results["tracks"]["items"]:
+                return track.title, track.artist.name
+        except Exception:
+            continue
+
+    return None
+
+
 def get_ai_hybrid_recommendations(sp, network, history_analysis, num_tracks=100, randomity_factor=50):
     # Keep existing implementation as fallback
     try:
@@ -1925,6 +4009,7 @@ def get_ai_hybrid_recommendations(sp, network, history_analysis, num_tracks=100,
         
         loved_tracks = user.get_loved_tracks(limit=None)
         
+        loved_items = []
         loved_tracks_data = []
         track_count = 0
         start_time = time.time()
@@ -1933,6 +4018,7 @@ def get_ai_hybrid_recommendations(sp, network, history_analysis, num_tracks=100,
         for item in loved_tracks:
             track = item.track
             track_count += 1
+            loved_items.append(item)
             loved_tracks_data.append({
                 'title': track.title,
                 'artist': track.artist.name,
@@ -1953,30 +4039,23 @@ def get_ai_hybrid_recommendations(sp, network, history_analysis, num_tracks=100,
         total_time = time.time() - start_time
         log_message(f"Analyzed {len(loved_tracks_data)} total loved tracks for AI recommendations in {total_time:.1f} seconds", 'green')
         
-        log_message("Extracting unique artists from your collection...", 'yellow')
-        artists_list = list(set([track['artist'] for track in loved_tracks_data]))
-        random.shuffle(artists_list)
-        log_message(f"Found {len(artists_list)} unique artists in your collection", 'green')
-        
-        log_message("Selecting representative sample of tracks for AI analysis...", 'yellow')
-        # Get a more representative sample of loved tracks
-        sample_tracks = random.sample(loved_tracks_data, min(100, len(loved_tracks_data)))
-        sample_track_names = [f"{track['title']} by {track['artist']}" for track in sample_tracks]
+        log_message("Updating taste profile for AI analysis...", 'yellow')
+        profile = update_taste_profile(network, loved_items)
+        log_message(f"Found {len(profile['artists'])} unique artists in your collection", 'green')
         
         # Also get some direct loved tracks for inclusion
         direct_loved_sample = random.sample(loved_tracks_data, min(30, len(loved_tracks_data)))
         direct_loved_names = [f"{track['title']} by {track['artist']}" for track in direct_loved_sample]
-        log_message(f"Selected {len(sample_tracks)} sample tracks and {len(direct_loved_sample)} loved tracks for analysis", 'green')
+        log_message(f"Selected {len(direct_loved_sample)} loved tracks for analysis", 'green')
         
         prompt = f"""You are an AI music curator creating a personalized "My Station" playlist similar to Apple Music's feature.
 
 User's Music Profile:
 - Last.fm Username: {LASTFM_USERNAME}
 - Total loved tracks: {len(loved_tracks_data)} (20+ years of music history!)
-- Unique artists in collection: {len(artists_list)}
+- Unique artists in collection: {len(profile['artists'])}
 - Playlist update history: {history_analysis.get('total_playlist_updates', 0)} updates
-- Sample of their music taste: {', '.join(sample_track_names[:20])}
-- Top artists from their collection: {', '.join(artists_list[:25])}
+{format_taste_profile(profile)}
 - Some loved tracks to include: {', '.join(direct_loved_names[:15])}
 
 Your task: Recommend artists and musical directions for creating the perfect personalized radio station. Your goal is to mimic Apple Music's My Station. "My Station" on Apple Music refers to a personalized radio station that plays music based on user's listening history and preferences, combining songs from user's library with similar tracks that the AI/algorithm suggests. Try to achieve that same effect with these song choices.
@@ -1994,130 +4073,53 @@ Instead of specific songs (which you might get wrong), focus on:
    - Time periods or movements that align with their preferences
 
 3. **Response Format:**
-   Return a JSON array with artist recommendations and musical guidance:
-   [
+   Return a JSON object with a "recommendations" array of artist recommendations and musical guidance:
+   {{"recommendations": [
      {{"type": "artist", "name": "Artist Name", "reason": "Why they'd like this artist", "relation": "Similar to [their favorite artist]"}},
      {{"type": "direction", "description": "Musical direction or characteristic", "reason": "Why this fits their taste"}},
      ...
-   ]
+   ]}}
 
 Focus on giving me the musical DNA and artist suggestions - I'll handle finding the actual tracks using Spotify's recommendation engine."""
 
-        ai_response = None
-
         log_message(f"AI Provider configured: {AI_PROVIDER}")
         log_message(f"Processing {len(loved_tracks_data)} loved tracks for AI analysis...")
-        log_message(f"Found {len(artists_list)} unique artists in your collection")
-        log_message(f"Using {len(sample_tracks)} sample tracks to represent your taste")
+        log_message(f"Using a taste profile of {len(profile.get('top_artists', []))} top artists and {len(profile.get('top_tags', []))} tags to represent your taste")
         
         # Debug AI configuration
-        log_message(f"OpenAI available: {openai is not None}, API key set: {OPENAI_API_KEY is not None and len(OPENAI_API_KEY) > 0}", 'yellow')
-        log_message(f"Gemini available: {genai is not None}, API key set: {GEMINI_API_KEY is not None and len(GEMINI_API_KEY) > 0}", 'yellow')
-
-        if AI_PROVIDER == "openai" and OPENAI_API_KEY and openai:
-            try:
-                openai.api_key = OPENAI_API_KEY
-                log_message("Using OpenAI GPT-5-mini for AI recommendations...", 'green')
-                log_message(f"Preparing to send analysis of your {len(loved_tracks_data)} tracks to OpenAI...", 'yellow')
-                log_message("Sending music taste analysis to OpenAI API...", 'yellow')
-
-                start_ai_time = time.time()
-                response = openai.chat.completions.create(
-                    model="gpt-5-mini",
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=0.8,
-                    max_completion_tokens=8192
-                )
-                ai_time = time.time() - start_ai_time
-                ai_response = response.choices[0].message.content
-                log_message(f"Successfully received AI recommendations from OpenAI in {ai_time:.1f} seconds!", 'green')
-            except Exception as e:
-                import traceback
-                log_message(f"OpenAI API error: {e}", 'red')
-                log_message(f"OpenAI error details: {traceback.format_exc()}", 'red')
-                log_message("Falling back to Gemini if available...", 'yellow')
-        
-        if (not ai_response or AI_PROVIDER == "gemini") and GEMINI_API_KEY and genai:
-            try:
-                genai.configure(api_key=GEMINI_API_KEY)
-                log_message("Using Google Gemini for AI recommendations...", 'green')
-                log_message(f"Preparing to send analysis of your {len(loved_tracks_data)} tracks to Gemini...", 'yellow')
-                log_message("Sending music taste analysis to Gemini API...", 'yellow')
-                log_message("This may take 10-30 seconds for Gemini to process your extensive music history...", 'yellow')
-                
-                start_ai_time = time.time()
-                model = genai.GenerativeModel('gemini-1.5-flash')
-                response = model.generate_content(prompt)
-                ai_time = time.time() - start_ai_time
-                ai_response = response.text
-                log_message(f"Successfully received AI recommendations from Gemini in {ai_time:.1f} seconds!", 'green')
-            except Exception as e:
-                import traceback
-                log_message(f"Gemini API error: {e}", 'red')
-                log_message(f"Gemini error details: {traceback.format_exc()}", 'red')
+        for name in AI_PROVIDER_CLASSES:
+            provider = get_ai_provider(name)
+            log_message(f"{provider.label} SDK available: {provider.is_available()}, API key set: {bool(provider.api_key)}", 'yellow')
+
+        log_message(f"Sending music taste analysis of your {len(loved_tracks_data)} tracks to the AI provider...", 'yellow')
+        log_message("This may take 10-30 seconds for the AI to process your extensive music history...", 'yellow')
+
+        # Each AI-recommended artist is handed to top-track lookup as soon as its object has streamed in
+        ai_artists = []
+        musical_directions = []
+        ai_artist_lookups = []
+        lookup_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ai-lookup")
+        try:
+            for rec in stream_ai_recommendations(prompt, "AI recommendations", temperature=0.8, max_tokens=8192):
+                if rec['type'] == 'artist':
+                    ai_artists.append(rec['name'])
+                    log_message(f"AI recommends artist: {rec['name']} - {rec.get('reason', '')}", 'yellow')
+                    if len(ai_artist_lookups) < 10:  # Use up to 10 AI-recommended artists
+                        lookup = lookup_executor.submit(find_ai_artist_track, sp, network, rec['name'], banned_items)
+                        ai_artist_lookups.append((rec['name'], lookup))
+                else:
+                    musical_directions.append(rec.get('description', ''))
+                    log_message(f"AI suggests direction: {rec.get('description', '')}", 'yellow')
+        finally:
+            lookup_executor.shutdown(wait=False)
         
-        if not ai_response:
+        if not ai_artists and not musical_directions:
             log_message("No AI API available or all failed. Falling back to Last.fm recommendations.", 'red')
             log_message(f"Debug: AI_PROVIDER={AI_PROVIDER}, OPENAI_API_KEY length={len(OPENAI_API_KEY) if OPENAI_API_KEY else 0}, GEMINI_API_KEY length={len(GEMINI_API_KEY) if GEMINI_API_KEY else 0}", 'red')
             return get_lastfm_recommendations(sp, network, num_tracks, 50)
         
         try:
-            log_message("Parsing AI response and extracting recommendations...", 'yellow')
-            import json
-            
-            # Try multiple parsing strategies
-            recommendations_data = None
-            
-            # Strategy 1: Look for JSON array in response
-            json_match = re.search(r'\[.*?\]', ai_response, re.DOTALL)
-            if json_match:
-                try:
-                    log_message("Found JSON array in AI response, attempting to parse...")
-                    recommendations_data = json.loads(json_match.group())
-                    log_message(f"Successfully parsed {len(recommendations_data)} recommendations from JSON array")
-                except json.JSONDecodeError as e:
-                    log_message(f"Failed to parse JSON array: {e}", 'yellow')
-            
-            # Strategy 2: Try parsing entire response
-            if not recommendations_data:
-                try:
-                    log_message("Attempting to parse entire AI response as JSON...")
-                    recommendations_data = json.loads(ai_response)
-                    log_message(f"Successfully parsed {len(recommendations_data)} recommendations from full response")
-                except json.JSONDecodeError as e:
-                    log_message(f"Failed to parse full response: {e}", 'yellow')
-            
-            # Strategy 3: Look for multiple JSON arrays and take the largest one
-            if not recommendations_data:
-                log_message("Searching for multiple JSON arrays in response...")
-                all_matches = re.findall(r'\[.*?\]', ai_response, re.DOTALL)
-                for i, match in enumerate(all_matches):
-                    try:
-                        parsed = json.loads(match)
-                        if isinstance(parsed, list) and len(parsed) > 0:
-                            recommendations_data = parsed
-                            log_message(f"Successfully parsed {len(recommendations_data)} recommendations from JSON array {i+1}")
-                            break
-                    except json.JSONDecodeError:
-                        continue
-            
-            if not recommendations_data:
-                raise ValueError("Could not extract valid JSON recommendations from AI response")
-            
-            log_message(f"AI provided {len(recommendations_data)} artist/direction recommendations", 'green')
-            
-            # Extract artist recommendations from AI
-            ai_artists = []
-            musical_directions = []
-            
-            for rec in recommendations_data:
-                if isinstance(rec, dict):
-                    if rec.get('type') == 'artist' and 'name' in rec:
-                        ai_artists.append(rec['name'])
-                        log_message(f"AI recommends artist: {rec['name']} - {rec.get('reason', '')}", 'yellow')
-                    elif rec.get('type') == 'direction':
-                        musical_directions.append(rec.get('description', ''))
-                        log_message(f"AI suggests direction: {rec.get('description', '')}", 'yellow')
+            log_message(f"AI provided {len(ai_artists) + len(musical_directions)} artist/direction recommendations", 'green')
             
             # Now create hybrid recommendations
             log_message("Creating hybrid playlist with AI guidance...", 'green')
@@ -2132,6 +4134,11 @@ Focus on giving me the musical DNA and artist suggestions - I'll handle finding
             # Shuffle loved tracks to ensure variety
             shuffled_loved = loved_tracks_data.copy()
             random.shuffle(shuffled_loved)
+
+            # Skip various artists and live songs, classifying the whole collection in one pass
+            loved_quality = get_quality_filter().classify_many((t['title'], t['artist']) for t in shuffled_loved)
+            shuffled_loved = [track_data for track_data, hits in zip(shuffled_loved, loved_quality)
+                              if not hits & {"live", "various_artists"}]
             
             for track_data in shuffled_loved:
                 if len(recommended_tracks) >= loved_count:
@@ -2141,16 +4148,10 @@ Focus on giving me the musical DNA and artist suggestions - I'll handle finding
                 track_title = track_data['title'].lower()
                 track_key = f"{track_title}|{artist_name}"
                 
-                # Skip various artists and live songs
-                is_various_artists = 'various artists' in artist_name or 'va' == artist_name
-                is_live = any(keyword in track_title for keyword in ['live', 'live at', 'live from', 'live in', 'live on', 'concert', 'acoustic version'])
-                
-                # Skip if we already have a song from this artist, this exact track, banned, or if it's filtered content
+                # Skip if we already have a song from this artist, this exact track, or banned
                 if (artist_name not in used_artists and 
                     track_key not in used_tracks and 
-                    not is_banned_item(track_data['title'], track_data['artist'], None, banned_items) and
-                    not is_various_artists and 
-                    not is_live):
+                    not is_banned_item(track_data['title'], track_data['artist'], None, banned_items)):
                     class LovedTrack:
                         def __init__(self, title, artist_name):
                             self.title = title
@@ -2166,61 +4167,33 @@ Focus on giving me the musical DNA and artist suggestions - I'll handle finding
             ai_target_count = int(num_tracks * 0.5)
             log_message(f"Getting {ai_target_count} tracks from AI-recommended artists using Last.fm and Spotify search...", 'yellow')
             
-            # Get tracks from AI-recommended artists using Last.fm
+            # Collect the lookups started while the AI response was streaming, in recommendation order
             ai_artist_tracks = []
-            for artist_name in ai_artists[:10]:  # Use up to 10 AI-recommended artists
+            for artist_name, lookup in ai_artist_lookups:
                 if len(ai_artist_tracks) >= ai_target_count:
                     break
                 try:
-                    # Get top tracks from this artist using Last.fm
-                    artist = network.get_artist(artist_name)
-                    top_tracks = artist.get_top_tracks(limit=5)
-                    
-                    for track_item in top_tracks:
-                        if len(ai_artist_tracks) >= ai_target_count:
-                            break
-                        
-                        track = track_item.item
-                        artist_name_lower = track.artist.name.lower()
-                        track_title_lower = track.title.lower()
-                        track_key = f"{track_title_lower}|{artist_name_lower}"
-                        
-                        # Skip various artists and live songs
-                        is_various_artists = 'various artists' in artist_name_lower or 'va' == artist_name_lower
-                        is_live = any(keyword in track_title_lower for keyword in ['live', 'live at', 'live from', 'live in', 'live on', 'concert', 'acoustic version'])
-                        
-                        # FIXED: Ensure one track per artist - skip if we already have a song from this artist, this exact track, banned, or if it's filtered content
-                        if (artist_name_lower not in used_artists and 
-                            track_key not in used_tracks and 
-                            not is_banned_item(track.title, track.artist.name, None, banned_items) and
-                            not is_various_artists and 
-                            not is_live):
-                            
-                            # Verify the track exists on Spotify
-                            try:
-                                search_results = sp.search(
-                                    q=f"track:{track.title} artist:{track.artist.name}", 
-                                    type="track", 
-                                    limit=1
-                                )
-                                if search_results["tracks"]["items"]:
-                                    class AIRecommendedTrack:
-                                        def __init__(self, title, artist_name):
-                                            self.title = title
-                                            self.artist = type('Artist', (), {'name': artist_name})()
-                                    
-                                    ai_artist_tracks.append(AIRecommendedTrack(
-                                        track.title, 
-                                        track.artist.name
-                                    ))
-                                    used_artists.add(artist_name_lower)
-                                    used_tracks.add(track_key)
-                            except Exception:
-                                continue
-                                
+                    found_track = lookup.result()
                 except Exception as e:
                     log_message(f"Could not get tracks for AI-recommended artist {artist_name}: {e}", 'yellow')
                     continue
+                if not found_track:
+                    continue
+
+                track_title, track_artist = found_track
+                artist_name_lower = track_artist.lower()
+                track_key = f"{track_title.lower()}|{artist_name_lower}"
+
+                # Ensure one track per artist - skip if we already have a song from this artist or this exact track
+                if artist_name_lower not in used_artists and track_key not in used_tracks:
+                    class AIRecommendedTrack:
+                        def __init__(self, title, artist_name):
+                            self.title = title
+                            self.artist = type('Artist', (), {'name': artist_name})()
+
+                    ai_artist_tracks.append(AIRecommendedTrack(track_title, track_artist))
+                    used_artists.add(artist_name_lower)
+                    used_tracks.add(track_key)
             
             recommended_tracks.extend(ai_artist_tracks)
             log_message(f"Added {len(ai_artist_tracks)} unique tracks from AI-recommended artists", 'green')
@@ -2232,7 +4205,7 @@ Focus on giving me the musical DNA and artist suggestions - I'll handle finding
                 
                 # Get similar artists based on user's loved tracks
                 similar_artist_tracks = []
-                sample_artists = random.sample(list(set([track['artist'] for track in loved_tracks_data])), min(5, len(loved_tracks_data)))
+                sample_artists = random.sample(sorted(set(track['artist'] for track in loved_tracks_data)), min(5, len(loved_tracks_data)))
                 
                 for base_artist_name in sample_artists:
                     if len(similar_artist_tracks) >= remaining_count:
@@ -2257,16 +4230,11 @@ Focus on giving me the musical DNA and artist suggestions - I'll handle finding
                                     track_title_lower = track.title.lower()
                                     track_key = f"{track_title_lower}|{artist_name_lower}"
                                     
-                                    # Skip various artists and live songs
-                                    is_various_artists = 'various artists' in artist_name_lower or 'va' == artist_name_lower
-                                    is_live = any(keyword in track_title_lower for keyword in ['live', 'live at', 'live from', 'live in', 'live on', 'concert', 'acoustic version'])
-                                    
-                                    # Ensure one track per artist
+                                    # Ensure one track per artist, skipping various artists and live songs
                                     if (artist_name_lower not in used_artists and 
                                         track_key not in used_tracks and 
                                         not is_banned_item(track.title, track.artist.name, None, banned_items) and
-                                        not is_various_artists and 
-                                        not is_live):
+                                        not get_quality_filter().rejects(track.title, track.artist.name, ("live", "various_artists"))):
                                         
                                         # Verify the track exists on Spotify
                                         try:
@@ -2312,16 +4280,10 @@ Focus on giving me the musical DNA and artist suggestions - I'll handle finding
                     track_title = track_data['title'].lower()
                     track_key = f"{track_title}|{artist_name}"
                     
-                    # Skip various artists and live songs
-                    is_various_artists = 'various artists' in artist_name or 'va' == artist_name
-                    is_live = any(keyword in track_title for keyword in ['live', 'live at', 'live from', 'live in', 'live on', 'concert', 'acoustic version'])
-                    
-                    # FIXED: Ensure one track per artist - skip if we already have a song from this artist, this exact track, banned, or if it's filtered content
+                    # FIXED: Ensure one track per artist - skip if we already have a song from this artist, this exact track, or banned
                     if (artist_name not in used_artists and 
                         track_key not in used_tracks and 
-                        not is_banned_item(track_data['title'], track_data['artist'], None, banned_items) and
-                        not is_various_artists and 
-                        not is_live):
+                        not is_banned_item(track_data['title'], track_data['artist'], None, banned_items)):
                         class LovedTrack:
                             def __init__(self, title, artist_name):
                                 self.title = title
@@ -2339,8 +4301,8 @@ Focus on giving me the musical DNA and artist suggestions - I'll handle finding
             log_message(f"Generated {len(recommended_tracks)} hybrid AI+Spotify recommendations", 'green')
             return recommended_tracks
             
-        except (json.JSONDecodeError, KeyError) as e:
-            log_message(f"Failed to parse AI response: {e}", 'red')
+        except KeyError as e:
+            log_message(f"Failed to use AI response: {e}", 'red')
             log_message("Falling back to Last.fm recommendations...", 'yellow')
             return get_lastfm_recommendations(sp, network, num_tracks, 50)
             
@@ -2349,124 +4311,571 @@ Focus on giving me the musical DNA and artist suggestions - I'll handle finding
         return get_lastfm_recommendations(sp, network, num_tracks, 50)
 
 
-def update_spotify_playlist(sp, playlist_id, tracks):
+def find_artist_match(items, artist_lower):
+    """Return the first search result with an artist whose name matches or contains artist_lower, or None."""
+    for result in items:
+        for artist in result["artists"]:
+            if (artist["name"].lower() == artist_lower or
+                artist_lower in artist["name"].lower() or
+                artist["name"].lower() in artist_lower):
+                return result
+    return None
+
+
+def resolve_spotify_track(sp, track):
+    """
+    Find a track on Spotify with the search ladder and return the matching item, or None.
+
+    Queries go from strict to loose; the first result whose artist matches wins, and
+    the first result of the loosest query is used as a last resort. A throttled client
+    ends the ladder instead of burning the remaining queries, and while Spotify's
+    breaker is open the last known match from the resolution cache is used.
+    Tracks that already carry a URI (offline station) are returned without searching.
+    """
+    if getattr(track, "uri", None):
+        return {"uri": track.uri, "artists": [{"name": track.artist.name}]}
+
+    # Try multiple search strategies to improve match rate
+    search_queries = [
+        f"track:{track.title} artist:{track.artist.name}",
+        f"{track.title} {track.artist.name}",
+        f"artist:{track.artist.name} {track.title}",
+        track.title
+    ]
+
+    artist_lower = track.artist.name.lower()
+    track_key = f"{track.title.lower()}|{artist_lower}"
+
+    def remember(match):
+        resolution_cache.put("tracks", track_key, {
+            "uri": match["uri"],
+            "artist": match["artists"][0]["name"],
+            "resolved_at": datetime.now().isoformat()
+        })
+        return match
+
+    for query in search_queries:
+        try:
+            search_results = spotify_search(sp, query)
+        except CircuitOpenError:
+            # Spotify is down: fall back to the last known match for this track
+            cached = resolution_cache.get("tracks", track_key)
+            metrics.count("cache_lookups_total", cache="resolutions", endpoint="search", result="hit" if cached else "miss")
+            return {"uri": cached["uri"], "artists": [{"name": cached["artist"]}]} if cached else None
+        except SpotifyThrottledError as e:
+            log_message(f"Spotify throttled while resolving {track.title} by {track.artist.name}: {e}", 'yellow')
+            return None
+        except Exception:
+            continue
+
+        items = search_results["tracks"]["items"]
+        if not items:
+            continue
+
+        match = find_artist_match(items, artist_lower)
+        if match:
+            return remember(match)
+
+        if query == search_queries[-1]:  # Last query, use first result
+            return remember(items[0])
+
+    return None
+
+
+def update_spotify_playlist(sp, playlist_id, tracks, retained=None, limit=None, dry_run=False):
+    """
+    Resolve tracks on Spotify and publish them to the playlist.
+
+    retained are playlist items kept by a rotation run: they stay first, in order, and
+    their artists count towards one-track-per-artist. limit caps the final playlist size.
+    With dry_run the would-be playlist is logged instead of published; sp may then be
+    None if every track already carries its URI. Returns the final playlist as dicts
+    with uri, title and artist.
+
+    With PUBLISH_MODE=replace, playlists expected to reach LARGE_PLAYLIST_THRESHOLD
+    tracks are first built and verified in a staging playlist. Spotify can't swap
+    playlists, so the target is still rewritten afterwards and every track is written
+    twice; in exchange a failed rewrite is completed from the verified build, which
+    stays in the staging playlist if that fails too. Diff mode only touches what
+    changed, guarded by snapshot_id, so it skips staging.
+    """
     try:
         banned_items = load_banned_items()
-        user_id = sp.me()["id"]
-        track_uris = []
-        track_uris_set = set()  # Track URIs we've already added to avoid duplicates
-        used_spotify_artists = set()  # Artist names we've already added to ensure one track per artist
+        retained = retained or []
+        track_uris = [track["uri"] for track in retained]
+        entries = [{"uri": track["uri"], "title": track["title"], "artist": track["artist"]} for track in retained]
+        track_uris_set = set(track_uris)  # Track URIs we've already added to avoid duplicates
+        used_spotify_artists = {track["artist"].lower() for track in retained}  # Artist names we've already added to ensure one track per artist
+
+        # Large full rewrites are built in a staging playlist while resolving; tracks is over-fetched, so size by the target
+        staging = None
+        if not dry_run and PUBLISH_MODE != "diff" and (limit or NUMBER_OF_TRACKS) >= LARGE_PLAYLIST_THRESHOLD:
+            staging = StagingPublisher(sp, get_staging_playlist(sp, sp.me()["id"], playlist_id))
+            log_message(f"Large playlist: staging batches of 100 in {staging.staging_id} while resolving", 'yellow')
+            for uri in track_uris:
+                staging.add(uri)
         not_found_count = 0 #Counts how many tracks were not found
         banned_count = 0 #Counts how many tracks were banned
         artist_duplicate_count = 0 #Counts how many tracks were skipped due to artist already being used
-        
-        for track in tracks:
-            # Try multiple search strategies to improve match rate
-            search_queries = [
-                f"track:{track.title} artist:{track.artist.name}",
-                f"{track.title} {track.artist.name}",
-                f"artist:{track.artist.name} {track.title}",
-                track.title
-            ]
-            
-            track_found = False
-            for query in search_queries:
-                try:
-                    search_results = sp.search(q=query, type="track", limit=10)
-                    if search_results["tracks"]["items"]:
-                        # Look for best match by checking artist names
-                        best_match = None
-                        for result in search_results["tracks"]["items"]:
-                            for artist in result["artists"]:
-                                if (artist["name"].lower() == track.artist.name.lower() or 
-                                    track.artist.name.lower() in artist["name"].lower() or
-                                    artist["name"].lower() in track.artist.name.lower()):
-                                    best_match = result
-                                    break
-                            if best_match:
-                                break
-                        
-                        if best_match:
-                            track_uri = best_match["uri"]
-                            spotify_artist_name = best_match["artists"][0]["name"].lower()
-
-                            # Check if we already have a track from this Spotify artist
-                            if spotify_artist_name in used_spotify_artists:
-                                log_message(f"Artist duplicate skipped: {track.title} by {track.artist.name} (already have track from {best_match['artists'][0]['name']})", 'yellow')
-                                artist_duplicate_count += 1
-                                track_found = True
-                                break
 
-                            # Check if this track has banned genres
-                            if banned_items['genres']:
-                                track_genres = get_track_genres(sp, track_uri)
-                                if is_banned_item(track.title, track.artist.name, None, banned_items, track_genres):
-                                    log_message(f"Track banned (genre filter): {track.title} by {track.artist.name}", 'yellow')
-                                    banned_count += 1
-                                    track_found = True
-                                    break
-
-                            if track_uri not in track_uris_set:
-                                track_uris.append(track_uri)
-                                track_uris_set.add(track_uri)
-                                used_spotify_artists.add(spotify_artist_name)
-                            track_found = True
+        # Local checks run before the search ladder, so banned tracks and artists we already have cost no Spotify calls
+        publish_filters = FilterChain("playlist update")
+        publish_filters.add("banned", lambda t: not is_banned_item(t.title, t.artist.name, None, banned_items), FILTER_COST_LOCAL, 0.05)
+        publish_filters.add("artist_duplicate", lambda t: t.artist.name.lower() not in used_spotify_artists, FILTER_COST_LOCAL, 0.3)
+
+        def needs_genres(track, match):
+            # Only for banned genres, and not for pre-resolved tracks, which must not need Spotify
+            return bool(match and banned_items['genres'] and not getattr(track, "uri", None))
+
+        def resolve(track):
+            match = resolve_spotify_track(sp, track)
+            # Prefetch genres alongside the search unless the artist is already taken; a match that
+            # becomes a duplicate in the meantime is dropped before its genres are used
+            genres = None
+            if needs_genres(track, match) and match["artists"][0]["name"].lower() not in used_spotify_artists:
+                genres = get_track_genres(sp, match["uri"])
+            return match, genres
+
+        # Searches run concurrently (the client throttles itself), results are applied in playlist order
+        pending = deque()
+        remaining_tracks = iter(tracks)
+        with ThreadPoolExecutor(max_workers=SPOTIFY_MAX_CONCURRENCY, thread_name_prefix="resolve") as executor:
+            while True:
+                for track in remaining_tracks:
+                    if publish_filters.passes(track):
+                        pending.append((track, executor.submit(resolve, track)))
+                        if len(pending) >= SPOTIFY_MAX_CONCURRENCY * 2:
                             break
-                        elif query == search_queries[-1]:  # Last query, use first result
-                            track_result = search_results["tracks"]["items"][0]
-                            track_uri = track_result["uri"]
-                            spotify_artist_name = track_result["artists"][0]["name"].lower()
-
-                            # Check if we already have a track from this Spotify artist
-                            if spotify_artist_name in used_spotify_artists:
-                                log_message(f"Artist duplicate skipped: {track.title} by {track.artist.name} (already have track from {track_result['artists'][0]['name']})", 'yellow')
-                                artist_duplicate_count += 1
-                                track_found = True
-                                break
+                if not pending or (limit is not None and len(track_uris) >= limit):
+                    for _, future in pending:
+                        future.cancel()
+                    break
+                if not get_run_deadline().allows(PUBLISH_RESERVE_SECONDS):
+                    log_message(f"Running out of time, publishing the {len(track_uris)} tracks resolved so far", 'yellow')
+                    for _, future in pending:
+                        future.cancel()
+                    break
 
-                            # Check if this track has banned genres
-                            if banned_items['genres']:
-                                track_genres = get_track_genres(sp, track_uri)
-                                if is_banned_item(track.title, track.artist.name, None, banned_items, track_genres):
-                                    log_message(f"Track banned (genre filter): {track.title} by {track.artist.name}", 'yellow')
-                                    banned_count += 1
-                                    track_found = True
-                                    break
+                track, future = pending.popleft()
+                try:
+                    match, genres = future.result()
+                except Exception:
+                    match, genres = None, None
 
-                            if track_uri not in track_uris_set:
-                                track_uris.append(track_uri)
-                                track_uris_set.add(track_uri)
-                                used_spotify_artists.add(spotify_artist_name)
-                            track_found = True
-                            break
-                except Exception as e:
+                if not match:
+                    log_message(f"Track not found: {track.title} by {track.artist.name}", 'yellow')
+                    not_found_count += 1
                     continue
-            
-            if not track_found:
-                log_message(f"Track not found: {track.title} by {track.artist.name}", 'yellow')
-                not_found_count += 1
 
-        # Replace playlist contents (completely clears and adds new tracks)
-        log_message(f"Replacing playlist with {len(track_uris)} new tracks...", 'yellow')
+                spotify_artist_name = match["artists"][0]["name"].lower()
+
+                # Check if we already have a track from this Spotify artist
+                if spotify_artist_name in used_spotify_artists:
+                    log_message(f"Artist duplicate skipped: {track.title} by {track.artist.name} (already have track from {match['artists'][0]['name']})", 'yellow')
+                    artist_duplicate_count += 1
+                    continue
+
+                if genres is None and needs_genres(track, match):
+                    genres = get_track_genres(sp, match["uri"])
+                if genres is not None and is_banned_item(track.title, track.artist.name, None, banned_items, genres):
+                    log_message(f"Track banned (genre filter): {track.title} by {track.artist.name}", 'yellow')
+                    banned_count += 1
+                    continue
 
-        if track_uris:
-            # First call replaces ALL existing tracks with new ones
-            sp.playlist_replace_items(playlist_id, track_uris[:100])
-            # Add remaining tracks in batches of 100
-            for i in range(100, len(track_uris), 100):
-                sp.playlist_add_items(playlist_id, track_uris[i : i + 100])
+                if match["uri"] not in track_uris_set:
+                    track_uris.append(match["uri"])
+                    entries.append({"uri": match["uri"], "title": track.title, "artist": track.artist.name})
+                    track_uris_set.add(match["uri"])
+                    if staging:
+                        staging.add(match["uri"])
+                    used_spotify_artists.add(spotify_artist_name)
+
+        publish_filters.log_summary()
+        banned_count += publish_filters.rejections["banned"]
+        artist_duplicate_count += publish_filters.rejections["artist_duplicate"]
+        metrics.count("playlist_tracks_total", len(track_uris) - len(retained), result="added")
+        metrics.count("playlist_tracks_total", len(retained), result="kept")
+        metrics.count("playlist_tracks_total", not_found_count, result="not_found")
+        metrics.count("playlist_tracks_total", banned_count, result="banned")
+        metrics.count("playlist_tracks_total", artist_duplicate_count, result="artist_duplicate")
+
+        if staging:
+            # Only a complete, verified staging build reaches the target playlist
+            staging.finish(track_uris)
+            log_message(f"Staging playlist complete with {len(track_uris)} tracks, publishing to target...", 'green')
+
+        if dry_run:
+            log_message(f"Dry run: would publish {len(track_uris)} tracks to playlist {playlist_id}:", 'yellow')
+            for position, entry in enumerate(entries, 1):
+                log_message(f"  {position:3d}. {entry['title']} by {entry['artist']} ({entry['uri']})")
+            return entries
+
+        if staging:
+            publish_staged_playlist(sp, playlist_id, track_uris, staging.staging_id)
+        elif track_uris:
+            publish_playlist(sp, playlist_id, track_uris)
         else:
             # If no tracks, just clear the playlist
             log_message("No tracks to add, clearing playlist", 'yellow')
             sp.playlist_replace_items(playlist_id, [])
 
-        log_message(f"Playlist updated successfully! Added {len(track_uris)} tracks. {not_found_count} tracks not found, {banned_count} tracks banned, {artist_duplicate_count} artist duplicates skipped.", 'green')
-
+        log_message(f"Playlist updated successfully! Added {len(track_uris) - len(retained)} tracks ({len(retained)} kept). {not_found_count} tracks not found, {banned_count} tracks banned, {artist_duplicate_count} artist duplicates skipped.", 'green')
+        return entries
 
     except Exception as e:
         log_message(f"Error updating Spotify playlist: {e}", 'red')
 
 
+def longest_increasing_subsequence(values):
+    """Return the positions of one longest strictly increasing subsequence of values."""
+    tails = []  # tails[k] = position of the smallest tail of an increasing run of length k + 1
+    tail_values = []
+    previous = [None] * len(values)
+    for position, value in enumerate(values):
+        k = bisect.bisect_left(tail_values, value)
+        if k > 0:
+            previous[position] = tails[k - 1]
+        if k == len(tails):
+            tails.append(position)
+            tail_values.append(value)
+        else:
+            tails[k] = position
+            tail_values[k] = value
+
+    positions = set()
+    position = tails[-1] if tails else None
+    while position is not None:
+        positions.add(position)
+        position = previous[position]
+    return positions
+
+
+def get_playlist_uris(sp, playlist_id):
+    """Fetch the playlist's snapshot_id and current item URIs in order."""
+    snapshot_id = sp.playlist(playlist_id, fields="snapshot_id")["snapshot_id"]
+    uris = []
+    results = sp.playlist_items(playlist_id, fields="items(track(uri)),next", limit=100)
+    while results:
+        uris.extend((item.get("track") or {}).get("uri") for item in results["items"])
+        results = sp.next(results) if results.get("next") else None
+    return snapshot_id, uris
+
+
+def get_playlist_tracks(sp, playlist_id):
+    """Fetch the playlist's current items as dicts with uri, title, artist and added_at, in order."""
+    tracks = []
+    results = sp.playlist_items(playlist_id, fields="items(added_at,track(uri,name,artists(name))),next", limit=100)
+    while results:
+        for item in results["items"]:
+            track = item.get("track") or {}
+            tracks.append({
+                "uri": track.get("uri"),
+                "title": track.get("name", ""),
+                "artist": (track.get("artists") or [{}])[0].get("name", ""),
+                "added_at": item.get("added_at") or ""
+            })
+        results = sp.next(results) if results.get("next") else None
+    return tracks
+
+
+def plan_rotation(sp, playlist_id, num_tracks):
+    """
+    Choose which playlist tracks survive a rotation run.
+
+    Rotates out ROTATION_FRACTION of num_tracks, picking the oldest additions or the
+    most played tracks (scrobbles counted in the taste profile) first, plus
+    anything banned since it was added. Returns (retained, replace_count), or None
+    when the playlist should be rebuilt in full.
+    """
+    try:
+        current = get_playlist_tracks(sp, playlist_id)
+    except Exception as e:
+        log_message(f"Could not read playlist for rotation ({e}), rebuilding in full", 'yellow')
+        return None
+
+    banned_items = load_banned_items()
+    candidates = [track for track in current
+                  if track["uri"] and not is_banned_item(track["title"], track["artist"], None, banned_items)]
+    if not candidates:
+        return None
+
+    if ROTATION_STRATEGY == "most_played":
+        track_plays = load_taste_profile()["track_plays"]
+        rotate_order = sorted(candidates, key=lambda t: (
+            -track_plays.get(f"{t['title'].lower()}|{t['artist'].lower()}", 0), t["added_at"]))
+    else:
+        rotate_order = sorted(candidates, key=lambda t: t["added_at"])
+
+    rotate_count = max(1, math.ceil(num_tracks * ROTATION_FRACTION))
+    keep_count = max(0, min(len(candidates), num_tracks) - rotate_count)
+    rotated_out = {track["uri"] for track in rotate_order[:len(candidates) - keep_count]}
+    retained = [track for track in candidates if track["uri"] not in rotated_out]
+    replace_count = num_tracks - len(retained)
+
+    if replace_count >= num_tracks:
+        return None
+
+    log_message(f"Rotation ({ROTATION_STRATEGY}): keeping {len(retained)} tracks, replacing {replace_count}", 'green')
+    return retained, replace_count
+
+
+def plan_playlist_diff(current_uris, target_uris):
+    """
+    Work out how to turn current_uris into target_uris with the fewest item moves.
+
+    Returns (removals, moves, insertions):
+    - removals: positions in current_uris to delete, highest first
+    - moves: (range_start, insert_before) reorder steps applied after the removals
+    - insertions: (position, uris) runs to add after the moves, in ascending order
+    Kept items on a longest increasing subsequence of target order stay where they are.
+    """
+    target_index = {uri: index for index, uri in enumerate(target_uris)}
+
+    removals = []
+    kept = []
+    seen = set()
+    for position, uri in enumerate(current_uris):
+        if uri in target_index and uri not in seen:
+            kept.append(uri)
+            seen.add(uri)
+        else:
+            removals.append(position)
+    removals.reverse()
+
+    # Move the kept items that are out of order next to their settled neighbours
+    state = list(kept)
+    settled = {kept[position] for position in longest_increasing_subsequence([target_index[uri] for uri in kept])}
+    moves = []
+    for uri in sorted(set(kept) - settled, key=target_index.get):
+        range_start = state.index(uri)
+        insert_before = next((position for position, other in enumerate(state)
+                              if other in settled and target_index[other] > target_index[uri]), len(state))
+        if insert_before not in (range_start, range_start + 1):
+            moves.append((range_start, insert_before))
+            # Like Spotify's reorder, insert_before counts positions before the item is taken out
+            state.insert(insert_before - 1 if insert_before > range_start else insert_before, state.pop(range_start))
+        settled.add(uri)
+
+    # With kept items in target order, every run of new items goes at its final target position
+    insertions = []
+    for position, uri in enumerate(target_uris):
+        if uri in seen:
+            continue
+        if insertions and insertions[-1][0] + len(insertions[-1][1]) == position and len(insertions[-1][1]) < 100:
+            insertions[-1][1].append(uri)
+        else:
+            insertions.append((position, [uri]))
+
+    return removals, moves, insertions
+
+
+def replace_playlist_items(sp, playlist_id, track_uris):
+    """Rewrite the whole playlist: replace with the first 100 tracks, then append the rest in batches."""
+    # First call replaces ALL existing tracks with new ones
+    sp.playlist_replace_items(playlist_id, track_uris[:100])
+    # Add remaining tracks in batches of 100
+    for i in range(100, len(track_uris), 100):
+        add_items_idempotent(sp, playlist_id, track_uris[i : i + 100], i)
+
+
+def add_items_idempotent(sp, playlist_id, uris, position):
+    """
+    Add uris at position, retrying on failure without ever adding a batch twice.
+
+    Before each retry the playlist window at position is read back: if the batch is
+    already there the earlier attempt succeeded and only its response was lost.
+    """
+    for attempt in range(PUBLISH_RETRIES + 1):
+        try:
+            if attempt:
+                window = sp.playlist_items(playlist_id, fields="items(track(uri))", limit=len(uris), offset=position)
+                landed = [(item.get("track") or {}).get("uri") for item in window["items"]]
+                if landed == uris:
+                    return
+                if landed:
+                    raise RuntimeError(f"Unexpected items at position {position}, refusing to add the batch again")
+            sp.playlist_add_items(playlist_id, uris, position=position)
+            return
+        except RuntimeError:
+            raise
+        except Exception as e:
+            if attempt == PUBLISH_RETRIES:
+                raise
+            log_message(f"Adding {len(uris)} tracks at position {position} failed ({e}), retrying...", 'yellow')
+            time.sleep(2 ** attempt)
+
+
+def get_staging_playlist(sp, user_id, playlist_id):
+    """Return the staging playlist for a target playlist, creating a private one on first use."""
+    if STAGING_PLAYLIST_ID:
+        return STAGING_PLAYLIST_ID
+
+    staging = load_json_state(STAGING_STATE_FILE, {})
+    if playlist_id in staging:
+        return staging[playlist_id]
+
+    name = sp.playlist(playlist_id, fields="name")["name"]
+    staging_id = sp.user_playlist_create(user_id, f"{name} (staging)", public=False,
+                                         description="Build area for Spotify My Station, safe to ignore")["id"]
+    staging[playlist_id] = staging_id
+    save_json_state(STAGING_STATE_FILE, staging)
+    log_message(f"Created staging playlist {staging_id} for {name}", 'green')
+    return staging_id
+
+
+class StagingPublisher:
+    """
+    Streams resolved URIs into a staging playlist while resolution continues.
+
+    Every full batch of 100 URIs is handed to a background thread that appends it
+    with add_items_idempotent, so writes overlap with the Spotify searches.
+    """
+
+    def __init__(self, sp, staging_id):
+        self.sp = sp
+        self.staging_id = staging_id
+        self.pending = []
+        self.batches = queue.Queue()
+        self.error = None
+        sp.playlist_replace_items(staging_id, [])
+        self.thread = threading.Thread(target=self._publish_batches, name="staging-publisher", daemon=True)
+        self.thread.start()
+
+    def add(self, uri):
+        self.pending.append(uri)
+        if len(self.pending) == 100:
+            self.batches.put(self.pending)
+            self.pending = []
+
+    def _publish_batches(self):
+        position = 0
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                return
+            if self.error:
+                continue
+            try:
+                add_items_idempotent(self.sp, self.staging_id, batch, position)
+                position += len(batch)
+            except Exception as e:
+                self.error = e
+
+    def finish(self, track_uris):
+        """Flush the last batch, wait for all writes and check the staging playlist holds track_uris."""
+        if self.pending:
+            self.batches.put(self.pending)
+            self.pending = []
+        self.batches.put(None)
+        self.thread.join()
+        if self.error:
+            raise self.error
+
+        _, staged_uris = get_playlist_uris(self.sp, self.staging_id)
+        if staged_uris != track_uris:
+            raise RuntimeError(f"Staging playlist has {len(staged_uris)} tracks, expected {len(track_uris)}")
+
+
+def publish_playlist(sp, playlist_id, track_uris):
+    """
+    Make the playlist contain exactly track_uris, in order.
+
+    In diff mode the current items are fetched once and only the removals, moves and
+    insertions needed are sent, each guarded by the snapshot_id returned by the previous
+    change. If the diff touches more items than a rebuild would, or the playlist changes
+    under us, the playlist is replaced in full.
+    """
+    if PUBLISH_MODE != "diff" or not track_uris:
+        log_message(f"Replacing playlist with {len(track_uris)} new tracks...", 'yellow')
+        replace_playlist_items(sp, playlist_id, track_uris)
+        return
+
+    try:
+        snapshot_id, current_uris = get_playlist_uris(sp, playlist_id)
+        if None in current_uris:
+            # Unavailable or local items can't be addressed by URI, so only a rebuild clears them
+            log_message(f"Playlist has items without a URI, replacing playlist with {len(track_uris)} tracks...", 'yellow')
+            replace_playlist_items(sp, playlist_id, track_uris)
+            return
+
+        removals, moves, insertions = plan_playlist_diff(current_uris, track_uris)
+
+        # A rebuild rewrites every item, so the diff is only worth it while it touches fewer
+        added = sum(len(uris) for _, uris in insertions)
+        changed_items = len(removals) + len(moves) + added
+        diff_calls = math.ceil(len(removals) / 100) + len(moves) + len(insertions)
+        if changed_items == 0:
+            log_message("Playlist already up to date, nothing to publish", 'green')
+            return
+        if changed_items > len(track_uris) or diff_calls > len(track_uris):
+            log_message(f"Diff touches {changed_items} items, replacing playlist with {len(track_uris)} tracks...", 'yellow')
+            replace_playlist_items(sp, playlist_id, track_uris)
+            return
+
+        log_message(f"Publishing diff: {len(removals)} removed, {len(moves)} moved, {added} added ({diff_calls} calls)", 'yellow')
+
+        # Highest positions first, so the positions of the remaining removals stay valid
+        for i in range(0, len(removals), 100):
+            batch = defaultdict(list)
+            for position in removals[i : i + 100]:
+                batch[current_uris[position]].append(position)
+            snapshot_id = sp.playlist_remove_specific_occurrences_of_items(
+                playlist_id, [{"uri": uri, "positions": positions} for uri, positions in batch.items()],
+                snapshot_id=snapshot_id
+            )["snapshot_id"]
+
+        for range_start, insert_before in moves:
+            snapshot_id = sp.playlist_reorder_items(
+                playlist_id, range_start=range_start, insert_before=insert_before, snapshot_id=snapshot_id
+            )["snapshot_id"]
+
+        for position, uris in insertions:
+            sp.playlist_add_items(playlist_id, uris, position=position)
+
+    except Exception as e:
+        log_message(f"Diff publish failed ({e}), replacing playlist in full", 'yellow')
+        replace_playlist_items(sp, playlist_id, track_uris)
+
+
+def publish_staged_playlist(sp, playlist_id, track_uris, staging_id):
+    """
+    Publish a verified staging build to the target, recovering from failed writes.
+
+    If publishing fails, the target is read back and completed from the staged URI list:
+    a target that already holds a correct prefix is resumed from there, anything else is
+    replaced in full. Gives up after PUBLISH_RETRIES attempts, leaving the complete
+    build in the staging playlist.
+    """
+    try:
+        publish_playlist(sp, playlist_id, track_uris)
+        return
+    except Exception as e:
+        error = e
+
+    for attempt in range(1, PUBLISH_RETRIES + 1):
+        log_message(f"Publishing to the target failed ({error}), completing it from the staged tracks (attempt {attempt}/{PUBLISH_RETRIES})...", 'yellow')
+        time.sleep(2 ** (attempt - 1))
+        try:
+            _, current_uris = get_playlist_uris(sp, playlist_id)
+            if current_uris == track_uris:
+                return
+            prefix = 0
+            while prefix < min(len(current_uris), len(track_uris)) and current_uris[prefix] == track_uris[prefix]:
+                prefix += 1
+            if prefix and prefix == len(current_uris):
+                log_message(f"Target holds the first {prefix} tracks, adding the remaining {len(track_uris) - prefix}", 'yellow')
+                for i in range(prefix, len(track_uris), 100):
+                    add_items_idempotent(sp, playlist_id, track_uris[i : i + 100], i)
+            else:
+                replace_playlist_items(sp, playlist_id, track_uris)
+            return
+        except Exception as e:
+            error = e
+
+    log_message(f"Could not publish to the target playlist ({error}); the complete build is in staging playlist {staging_id}", 'red')
+    raise error
+
+
 def log_message(message, color=None):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     log_entry = f"{timestamp}: {message}\n"
@@ -2491,43 +4900,301 @@ def log_message(message, color=None):
         f.write(log_entry)
 
 
-def job(playlist_id=None):
+def write_dry_run_report(playlist_id, playlist, seed=None, offline=False):
+    """Log a dry run's stage timings and API calls, and save them with the would-be playlist to DRY_RUN_FILE."""
+    stages = metrics.stage_seconds()
+    api_calls = metrics.api_call_counts()
+    log_message("Dry run timings: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in stages.items()), 'yellow')
+    for api, endpoints in api_calls.items():
+        busiest = sorted(endpoints.items(), key=lambda item: -item[1])
+        log_message(f"Dry run {api} calls: {sum(endpoints.values())} (" + ", ".join(f"{endpoint} {count}" for endpoint, count in busiest) + ")", 'yellow')
+    save_json_state(DRY_RUN_FILE, {
+        "version": __version__,
+        "created_at": datetime.now().isoformat(),
+        "playlist_id": playlist_id,
+        "seed": seed,
+        "offline": offline,
+        "tracks": playlist or [],
+        "stage_seconds": stages,
+        "api_calls": api_calls
+    }, report=True)
+    log_message(f"Dry run report written to {DRY_RUN_FILE}", 'green')
+
+
+def job(playlist_id=None, offline=False, dry_run=False, seed=None):
+    """
+    Generate the station and publish it to the playlist.
+
+    offline builds the station from local caches only, and a run whose Last.fm side is
+    down falls back to the same. dry_run runs the whole pipeline but writes the would-be
+    playlist, stage timings and API call counts to DRY_RUN_FILE instead of publishing,
+    and leaves the history, every cache and the production metrics (METRICS_TEXTFILE,
+    RUN_SUMMARY_FILE) untouched; offline with dry_run makes no
+    network calls at all. seed makes every random choice repeatable, so two runs over
+    the same data do the same work.
+    """
+    if seed is not None:
+        random.seed(seed)
+    set_state_read_only(dry_run)
+    refresh_quality_filter()
     target_playlist_id = playlist_id or SPOTIFY_PLAYLIST_ID
+    deadline = start_run_deadline(RUN_DEADLINE_SECONDS)
+    metrics.set_gauge("run_success", 0)
+    stage_started = time.time()
     
     log_message(f"Starting playlist update job (version {__version__})...", 'yellow')
     log_message(f"Target playlist ID: {target_playlist_id}")
     log_message(f"Requesting {NUMBER_OF_TRACKS} tracks from Last.fm user: {LASTFM_USERNAME}")
-    log_message("Mode: AI-powered My Station")
-
-    log_message("Authenticating with Last.fm...")
-    lastfm_network = authenticate_lastfm()
-    if not lastfm_network:
-        log_message("Last.fm authentication failed. Aborting.", 'red')
+    log_message("Mode: " + ("offline station from local caches" if offline else "AI-powered My Station") + (" (dry run)" if dry_run else "")
+                + (f", random seed {seed}" if seed is not None else ""))
+
+    lastfm_network = None
+    if not offline:
+        log_message("Authenticating with Last.fm...")
+        lastfm_network = authenticate_lastfm()
+        if not lastfm_network:
+            log_message("Last.fm authentication failed, falling back to offline generation.", 'yellow')
+            offline = True
+        else:
+            log_message("Last.fm authentication successful.", 'green')
+
+    # Publishing is the only step that needs Spotify when the station is built offline
+    spotify_client = None
+    if not (offline and dry_run):
+        log_message("Authenticating with Spotify...")
+        spotify_client = authenticate_spotify()
+        if not spotify_client:
+            log_message("Spotify authentication failed. Aborting.", 'red')
+            return
+        log_message("Spotify authentication successful.", 'green')
+    stage_started = metrics.lap("authenticate", stage_started)
+
+    # Rotation mode only discovers and resolves the share of tracks being replaced
+    rotation = None
+    if 0 < ROTATION_FRACTION < 1 and spotify_client:
+        rotation = plan_rotation(spotify_client, target_playlist_id, NUMBER_OF_TRACKS)
+    retained, replace_count = rotation or ([], NUMBER_OF_TRACKS)
+    exclude_artists = [track["artist"] for track in retained]
+    stage_started = metrics.lap("rotation", stage_started)
+
+    tracks = []
+    if not offline:
+        log_message("Generating Apple Music-style discovery station...")
+        tracks = get_apple_music_discovery_station(spotify_client, lastfm_network, replace_count,
+                                                   exclude_artists=exclude_artists)
+        if not tracks:
+            log_message("Failed to retrieve tracks from Last.fm, falling back to offline generation.", 'yellow')
+    if not tracks:
+        tracks = get_offline_station(replace_count, exclude_artists=exclude_artists)
+    metrics.set_gauge("run_offline", int(offline))
+    stage_started = metrics.lap("station", stage_started)
+    
+    if not tracks:
+        log_message("No tracks from Last.fm or the local caches. Aborting.", 'red')
         return
-    log_message("Last.fm authentication successful.", 'green')
+    log_message(f"Successfully retrieved {len(tracks)} tracks.", 'green')
+
+    log_message("Updating Spotify playlist..." if not dry_run else "Resolving playlist (dry run)...")
+    if rotation:
+        playlist = update_spotify_playlist(spotify_client, target_playlist_id, tracks, retained=retained, limit=NUMBER_OF_TRACKS, dry_run=dry_run)
+    elif offline:
+        # Every offline track resolves, so the playlist size has to be capped explicitly
+        playlist = update_spotify_playlist(spotify_client, target_playlist_id, tracks, limit=NUMBER_OF_TRACKS, dry_run=dry_run)
+    else:
+        playlist = update_spotify_playlist(spotify_client, target_playlist_id, tracks, dry_run=dry_run)
 
-    log_message("Authenticating with Spotify...")
-    spotify_client = authenticate_spotify()
-    if not spotify_client:
-        log_message("Spotify authentication failed. Aborting.", 'red')
+    stage_started = metrics.lap("publish", stage_started)
+    if playlist is None:
+        log_message("Playlist update failed, leaving the history untouched.", 'red')
         return
-    log_message("Spotify authentication successful.", 'green')
 
-    log_message("Generating Apple Music-style discovery station...")
-    tracks = get_apple_music_discovery_station(spotify_client, lastfm_network, NUMBER_OF_TRACKS)
-    
-    if not tracks:
-        log_message("Failed to retrieve tracks from Last.fm. Aborting.", 'red')
-        return
-    log_message(f"Successfully retrieved {len(tracks)} tracks from Last.fm.", 'green')
+    if spotify_client:
+        spotify_client.log_stats()
+    log_request_coalescing()
+    save_fallback_caches()
+
+    if not dry_run:
+        log_message("Saving playlist history...")
+        save_playlist_history(tracks)
+    metrics.lap("save_state", stage_started)
+    if dry_run:
+        write_dry_run_report(target_playlist_id, playlist, seed, offline)
+    metrics.set_gauge("run_success", 1)
+
+    log_message(f"Playlist update job completed successfully ({deadline.remaining():.0f}s of the run budget left).", 'green')
+
+
+# --- Profiling ---
+
+# Functions whose frames mark a pipeline stage; the innermost one on the main thread's stack wins
+PROFILE_STAGES = {
+    "authenticate_lastfm": "authenticate",
+    "authenticate_spotify": "authenticate",
+    "plan_rotation": "rotation",
+    "get_apple_music_discovery_station": "apple_music_station",
+    "get_offline_station": "offline_station",
+    "get_sonic_station": "sonic_station",
+    "get_ai_hybrid_recommendations": "ai_hybrid_station",
+    "get_coherent_my_station_recommendations": "coherent_station",
+    "get_lastfm_recommendations": "lastfm_station",
+    "update_spotify_playlist": "publish",
+    "save_playlist_history": "save_state",
+}
+# Frames from these modules mean the thread is blocked on the network
+PROFILE_NETWORK_MODULES = ("socket", "ssl", "selectors", "http", "httpx", "httpcore", "h2", "h11", "requests",
+                           "urllib3", "anyio", "grpc", "openai", "google")
+# ... and these mean it is waiting on another thread or a rate limit
+PROFILE_WAIT_MODULES = ("threading", "queue", "concurrent")
+PROFILE_WAIT_FUNCTIONS = {"acquire", "call_with_retries"}
+
+
+class WallClockSampler:
+    """
+    Sampling wall-clock profiler for every thread of the run.
+
+    Each tick records every thread's stack as a collapsed stack (for flamegraph.pl or
+    speedscope) and classifies it: CPU if the thread's own CPU clock advanced for most
+    of the tick, otherwise network or waiting by the modules on its stack (where
+    per-thread CPU clocks are unavailable, the stack alone decides). Samples are attributed
+    to the stage the main thread is in, so worker threads count towards the station
+    builder they work for. Process CPU time is measured per stage as well.
+    """
 
-    log_message("Updating Spotify playlist...")
-    update_spotify_playlist(spotify_client, target_playlist_id, tracks)
+    def __init__(self, interval=None):
+        self.interval = interval or PROFILE_SAMPLE_INTERVAL
+        self.stacks = Counter()
+        self.stages = defaultdict(lambda: {"wall": 0.0, "cpu": 0.0, "main": Counter(), "threads": Counter()})
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+        self.main_ident = threading.main_thread().ident
+
+    @staticmethod
+    def module_of(frame):
+        return frame.f_globals.get("__name__", "").split(".")[0]
+
+    def stage_of(self, frame):
+        while frame is not None:
+            if frame.f_code.co_filename == __file__ and frame.f_code.co_name in PROFILE_STAGES:
+                return PROFILE_STAGES[frame.f_code.co_name]
+            frame = frame.f_back
+        return "other"
+
+    @staticmethod
+    def thread_cpu_time(ident):
+        try:
+            return time.clock_gettime(time.pthread_getcpuclockid(ident))
+        except (AttributeError, OSError):
+            return None
+
+    def classify(self, frame, cpu_share=None):
+        if cpu_share is not None and cpu_share >= 0.5:
+            return "cpu"
+        top = frame
+        while frame is not None:
+            if self.module_of(frame) in PROFILE_NETWORK_MODULES:
+                return "network"
+            frame = frame.f_back
+        if cpu_share is not None or self.module_of(top) in PROFILE_WAIT_MODULES or top.f_code.co_name in PROFILE_WAIT_FUNCTIONS:
+            return "waiting"
+        return "cpu"
+
+    def collapse(self, frame, thread_name):
+        names = []
+        while frame is not None:
+            names.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join([thread_name] + names[::-1])
+
+    def run(self):
+        thread_names = {}
+        thread_cpu = {}
+        last_wall, last_cpu = time.perf_counter(), time.process_time()
+        while not self.stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            main_frame = frames.get(self.main_ident)
+            stage = self.stage_of(main_frame) if main_frame is not None else "other"
+
+            now_wall, now_cpu = time.perf_counter(), time.process_time()
+            tick = now_wall - last_wall
+            self.stages[stage]["wall"] += tick
+            self.stages[stage]["cpu"] += now_cpu - last_cpu
+            last_wall, last_cpu = now_wall, now_cpu
+
+            if len(thread_names) != threading.active_count():
+                thread_names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident == self.thread.ident:
+                    continue
+                cpu_time = self.thread_cpu_time(ident)
+                previous_cpu_time = thread_cpu.get(ident)
+                thread_cpu[ident] = cpu_time
+                cpu_share = None
+                if cpu_time is not None and previous_cpu_time is not None and tick > 0:
+                    cpu_share = (cpu_time - previous_cpu_time) / tick
+                kind = self.classify(frame, cpu_share)
+                self.stages[stage]["threads"][kind] += 1
+                if ident == self.main_ident:
+                    self.stages[stage]["main"][kind] += 1
+                self.stacks[self.collapse(frame, thread_names.get(ident, str(ident)))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def breakdown(self):
+        """Per stage: wall and CPU seconds, and the main thread's and all threads' network/waiting/CPU split."""
+        def shares(counts):
+            total = sum(counts.values()) or 1
+            return {kind: round(counts[kind] / total, 3) for kind in ("network", "waiting", "cpu")}
+
+        return {stage: {"wall_seconds": round(data["wall"], 3), "cpu_seconds": round(data["cpu"], 3),
+                        "main_thread": shares(data["main"]), "all_threads": shares(data["threads"])}
+                for stage, data in sorted(self.stages.items(), key=lambda item: -item[1]["wall"])}
+
+
+def profile_job(**job_kwargs):
+    """
+    Run job() under cProfile and the wall-clock sampler.
 
-    log_message("Saving playlist history...")
-    save_playlist_history(tracks)
+    Writes job.pstats (deterministic profile of the main thread), wall.collapsed
+    (sampled stacks of every thread, flamegraph-compatible) and stages.json (per-stage
+    network versus CPU breakdown) to a timestamped directory under PROFILE_DIR.
+    """
+    import cProfile
+    import pstats
 
-    log_message("Playlist update job completed successfully.", 'green')
+    output_dir = os.path.join(PROFILE_DIR, datetime.now().strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(output_dir, exist_ok=True)
+
+    profiler = cProfile.Profile()
+    sampler = WallClockSampler()
+    sampler.start()
+    profiler.enable()
+    try:
+        job(**job_kwargs)
+    finally:
+        profiler.disable()
+        sampler.stop()
+
+        profiler.dump_stats(os.path.join(output_dir, "job.pstats"))
+        with open(os.path.join(output_dir, "wall.collapsed"), 'w') as f:
+            for stack, count in sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        breakdown = sampler.breakdown()
+        save_json_state(os.path.join(output_dir, "stages.json"), breakdown, report=True)
+
+        log_message(f"Profile written to {output_dir}", 'green')
+        for stage, data in breakdown.items():
+            main_thread = data["main_thread"]
+            log_message(f"  {stage}: {data['wall_seconds']:.2f}s wall, {data['cpu_seconds']:.2f}s CPU, main thread "
+                        f"{main_thread['network']:.0%} network / {main_thread['waiting']:.0%} waiting / {main_thread['cpu']:.0%} CPU")
+        stats = pstats.Stats(profiler)
+        top_functions = sorted(stats.stats.items(), key=lambda item: -item[1][3])[:10]
+        for (filename, line, name), (_, calls, _, cumulative, _) in top_functions:
+            log_message(f"  {cumulative:8.3f}s cumulative {calls:8d} calls  {name} ({os.path.basename(filename)}:{line})")
 
 
 # --- Main ---
@@ -2539,10 +5206,27 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Spotify My Station - AI-powered discovery with quality filtering')
     parser.add_argument('--playlist', type=str,
                        help='Spotify playlist ID to update (overrides environment variable)')
+    parser.add_argument('--offline', action='store_true',
+                       help='Build the station from local caches only (loved tracks, similarity graph, resolutions, history)')
+    parser.add_argument('--dry-run', action='store_true',
+                       help='Run the whole pipeline but write the would-be playlist, timings and API calls to DRY_RUN_FILE instead of publishing')
+    parser.add_argument('--seed', type=int,
+                       help='Seed every random choice so runs over the same data are repeatable')
+    parser.add_argument('--profile', action='store_true',
+                       help='Profile the run (cProfile, sampled flamegraph stacks, per-stage network vs CPU) into PROFILE_DIR')
 
     args = parser.parse_args()
 
     try:
-        job(playlist_id=args.playlist)
+        if args.profile:
+            profile_job(playlist_id=args.playlist, offline=args.offline, dry_run=args.dry_run, seed=args.seed)
+        else:
+            job(playlist_id=args.playlist, offline=args.offline, dry_run=args.dry_run, seed=args.seed)
     finally:
+        # Exported even when the run failed, so run_success can be alerted on; a dry run
+        # keeps its summary apart and leaves the production metrics to the last real run
+        if args.dry_run:
+            metrics.export(summary_file=DRY_RUN_SUMMARY_FILE, prometheus=False)
+        else:
+            metrics.export()
         release_lock()